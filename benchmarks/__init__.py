@@ -0,0 +1,19 @@
+"""
+Performance benchmarks for the Flask Stock Portfolio App.
+
+The benchmarks are not run by pytest. Run the suite of route, model and
+CLI benchmarks (see benchmarks/__main__.py for the options), or a single
+benchmark module, from the top-level directory:
+
+    python -m benchmarks run --sizes 1k,100k --output results.json
+    python -m benchmarks compare baseline.json results.json --max-regression 10
+    python -m benchmarks.bench_logging
+    python -m benchmarks.bench_login
+    python -m benchmarks.bench_indexes
+    python -m benchmarks.bench_ledger
+    python -m benchmarks.bench_analytics
+    python -m benchmarks.bench_snapshots
+    python -m benchmarks.bench_streaming
+    python -m benchmarks.bench_api
+    python -m benchmarks.bench_batch_create
+"""
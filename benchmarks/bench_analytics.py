@@ -0,0 +1,87 @@
+"""
+Benchmark of the portfolio analytics for a large portfolio.
+
+The benchmark user is given one stock in each of 1000 symbols, and the
+price history store (in a temporary directory) 10 years of daily closing
+prices (2520 trading days) for each of them and for the benchmark symbol.
+The time taken to compute every metric (the same as the analytics page) is
+then printed, split between reading the aligned price matrix from the
+memory-mapped files and computing the metrics:
+
+    python -m benchmarks.bench_analytics --holdings 1000 --years 10 --repeat 5
+"""
+import argparse
+import itertools
+import os
+import statistics
+import string
+import tempfile
+import time
+
+import numpy as np
+
+from project import create_app, database
+from project.models import Stock
+from project.stocks.analytics import analyze_portfolio, get_portfolio_symbols, load_price_matrix
+from project.stocks.history import PriceHistoryStore, to_day
+from project.stocks.summary import add_stocks
+from benchmarks.suite import seed_users, get_benchmark_user_id
+
+
+def seed_price_history(store, symbols, days):
+    # Random walks with a common market factor, so the holdings are correlated
+    rng = np.random.default_rng(42)
+    market = rng.normal(0.0003, 0.01, size=len(days))
+    for symbol in symbols:
+        returns = market * rng.uniform(0.5, 1.5) + rng.normal(0, 0.01, size=len(days))
+        closes = np.round(10000 * np.cumprod(1 + returns)).astype(np.int64)
+        store.append(symbol, days, closes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--holdings', type=int, default=1000, help='number of holdings')
+    parser.add_argument('--years', type=int, default=10, help='years of daily prices')
+    parser.add_argument('--repeat', type=int, default=5, help='number of times the analytics are computed')
+    args = parser.parse_args()
+
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        database.drop_all()
+        database.create_all()
+        seed_users(1)
+        user_id = get_benchmark_user_id()
+
+        symbols = [''.join(letters) for letters in
+                   itertools.islice(itertools.product(string.ascii_uppercase, repeat=4), args.holdings)]
+        add_stocks([Stock(symbol, '10', '100.00', user_id) for symbol in symbols])
+        database.session.commit()
+
+        # Trading days only (no weekends)
+        all_days = np.arange(to_day('2013-01-01'), to_day('2013-01-01') + args.years * 365)
+        days = all_days[np.is_busday(all_days.astype('datetime64[D]'))][:args.years * 252]
+        print(f'Writing {len(days)} days of prices for {args.holdings} symbols...')
+        store = PriceHistoryStore(directory)
+        seed_price_history(store, symbols + ['SPY'], days)
+
+        load_timings = []
+        total_timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            load_price_matrix(store, symbols + ['SPY'])
+            load_timings.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            analytics = analyze_portfolio(user_id, store, get_portfolio_symbols(user_id), benchmark='SPY')
+            total_timings.append(time.perf_counter() - start)
+
+        print(f'price matrix ({len(analytics.matrix.days)} days x {len(analytics.matrix.symbols)} symbols): '
+              f'p50 {statistics.median(load_timings) * 1000:.1f} ms')
+        print(f'analytics (including the price matrix): p50 {statistics.median(total_timings) * 1000:.1f} ms, '
+              f'max {max(total_timings) * 1000:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark of the JSON API against the stocks page (HTML) for a large portfolio.
+
+The benchmark user is given 100k stocks, which are then read page by page,
+following the cursors from the first page to the last, through:
+
+    * the stocks page ('/stocks/', rendered HTML, with the fragment cache
+      disabled, as a scraper reads each page once)
+    * the JSON API ('/api/v1/stocks'), with the same page size
+    * the JSON API with larger pages (its maximum page size is larger)
+
+The time per page, the rows read per second and the bytes sent per row are
+printed for each:
+
+    python -m benchmarks.bench_api --stocks 100000 --per-page 100 --api-per-page 1000
+"""
+import argparse
+import os
+import re
+import statistics
+import time
+
+from project import create_app, database
+from benchmarks.suite import seed_stocks, seed_users, log_in
+
+NEXT_PAGE = re.compile(rb'after=(\d+)')
+
+
+def walk(client, url, next_cursor):
+    """
+    Read every page starting at `url`; `next_cursor(response)` returns the cursor of the next page (or None)
+    """
+    timings = []
+    size = 0
+    cursor = None
+    while True:
+        start = time.perf_counter()
+        response = client.get(url if cursor is None else f'{url}&after={cursor}')
+        timings.append(time.perf_counter() - start)
+        size += len(response.data)
+        cursor = next_cursor(response)
+        if cursor is None:
+            return timings, size
+
+
+def report(label, rows, timings, size):
+    total = sum(timings)
+    print(f'{label:<34} {len(timings):>6} pages  p50 {statistics.median(timings) * 1000:7.2f} ms/page  '
+          f'{rows / total:>10,.0f} rows/s  {size / rows:6.1f} bytes/row')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stocks', type=int, default=100000, help='number of stocks of the user')
+    parser.add_argument('--per-page', type=int, default=100, help='page size of the stocks page')
+    parser.add_argument('--api-per-page', type=int, default=1000, help='larger page size of the API')
+    args = parser.parse_args()
+
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    app.config.update(STOCKS_FRAGMENT_CACHE='none',
+                      STOCKS_MAX_PER_PAGE=args.per_page,
+                      API_MAX_PER_PAGE=max(args.per_page, args.api_per_page))
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        seed_users(1)
+        print(f'Seeding {args.stocks} stocks...')
+        seed_stocks(args.stocks)
+
+    client = app.test_client()
+    log_in(client)
+    # (the first page shows the message flashed by the login)
+    client.get('/stocks/')
+
+    def next_html_page(response):
+        match = NEXT_PAGE.search(response.data)
+        return int(match.group(1)) if match else None
+
+    def next_api_page(response):
+        return response.json['next_cursor']
+
+    report(f'HTML ({args.per_page}/page)', args.stocks,
+           *walk(client, f'/stocks/?per_page={args.per_page}', next_html_page))
+    report(f'JSON API ({args.per_page}/page)', args.stocks,
+           *walk(client, f'/api/v1/stocks?per_page={args.per_page}', next_api_page))
+    report(f'JSON API ({args.api_per_page}/page)', args.stocks,
+           *walk(client, f'/api/v1/stocks?per_page={args.api_per_page}', next_api_page))
+    report(f'JSON API ({args.api_per_page}/page, 2 fields)', args.stocks,
+           *walk(client, f'/api/v1/stocks?per_page={args.api_per_page}&fields=stock_symbol,number_of_shares',
+                 next_api_page))
+
+
+if __name__ == '__main__':
+    main()
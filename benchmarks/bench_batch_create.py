@@ -0,0 +1,80 @@
+"""
+Benchmark of adding stocks one at a time against adding them in batches.
+
+The stocks are added by the benchmark user through:
+
+    * the 'Add a Stock' form ('/add_stock'), one request (and one commit) per stock
+    * the JSON API ('/api/v1/stocks'), one request (and one commit) per stock
+    * the batch endpoint of the JSON API ('/api/v1/stocks/batch'), one
+      request (one INSERT statement and one commit) per batch of stocks
+
+The stocks added per second by each, and the speedup of the batches over
+the form, are printed:
+
+    python -m benchmarks.bench_batch_create --stocks 1000 --batch-size 1000
+"""
+import argparse
+import contextlib
+import io
+import os
+import time
+
+from project import create_app, database
+from benchmarks.suite import seed_users, log_in
+
+STOCK = {'stock_symbol': 'AAPL', 'number_of_shares': '10', 'purchase_price': '172.50'}
+
+
+def timed(count, add):
+    """
+    Return the stocks added per second by `add()`, which adds `count` stocks
+    """
+    start = time.perf_counter()
+    add()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stocks', type=int, default=1000, help='number of stocks added by each method')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of stocks per batch')
+    args = parser.parse_args()
+
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    app.config['API_MAX_BATCH_SIZE'] = max(args.batch_size, app.config.get('API_MAX_BATCH_SIZE', 10000))
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        seed_users(1)
+
+    client = app.test_client()
+    log_in(client)
+
+    def add_with_form():
+        # (the view prints the form data of every stock)
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(args.stocks):
+                client.post('/add_stock', data=STOCK)
+
+    def add_with_api():
+        for _ in range(args.stocks):
+            client.post('/api/v1/stocks', json=STOCK)
+
+    def add_with_batches():
+        for start in range(0, args.stocks, args.batch_size):
+            response = client.post('/api/v1/stocks/batch', json=[STOCK] * min(args.batch_size, args.stocks - start))
+            assert response.status_code == 201, response.json
+
+    form_rate = timed(args.stocks, add_with_form)
+    api_rate = timed(args.stocks, add_with_api)
+    batch_rate = timed(args.stocks, add_with_batches)
+    print(f'{"form (1 stock/request)":<40} {form_rate:>10,.0f} stocks/s')
+    print(f'{"JSON API (1 stock/request)":<40} {api_rate:>10,.0f} stocks/s')
+    print(f'{f"JSON API batch ({args.batch_size} stocks/request)":<40} {batch_rate:>10,.0f} stocks/s '
+          f'({batch_rate / form_rate:.0f}x the form)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""
+Benchmark of the query plans and latencies of the portfolio queries with and without their indexes.
+
+The stocks table is seeded with 1M rows, shared between 1000 owners (and
+the users table with 100k users) in the benchmark database. Each query is
+then run without the indexes added for it and with them, and the query plan
+(EXPLAIN QUERY PLAN on SQLite, EXPLAIN on PostgreSQL) and the latency
+percentiles are printed for both:
+
+    python -m benchmarks.bench_indexes --stocks 1000000 --users 100000 --owners 1000 --repeat 20
+"""
+import argparse
+import os
+import statistics
+import time
+
+from sqlalchemy import func, select, text, cast, BigInteger
+from sqlalchemy.schema import CreateIndex, DropIndex
+
+from project import create_app, database
+from project.models import Stock, User
+from benchmarks.suite import seed_stocks, seed_users, get_benchmark_user_id, BENCHMARK_EMAIL
+
+
+def query_stocks_by_symbol():
+    return select(Stock.id, Stock.number_of_shares, Stock.purchase_price).where(Stock.stock_symbol == 'NKE')
+
+
+def query_symbol_totals():
+    # The totals of each symbol, as computed by rebuild_summaries() ('flask stocks rebuild-summary');
+    # the pages read them from the position summaries instead
+    return (select(Stock.stock_symbol,
+                   func.sum(Stock.number_of_shares),
+                   func.sum(cast(Stock.number_of_shares, BigInteger) * Stock.purchase_price))
+            .group_by(Stock.stock_symbol))
+
+
+def query_user_stocks_page():
+    # The first page of the stocks page (list_stocks)
+    return (select(Stock.id, Stock.stock_symbol, Stock.number_of_shares, Stock.purchase_price)
+            .where(Stock.user_id == get_benchmark_user_id())
+            .order_by(Stock.id)
+            .limit(21))
+
+
+def query_user_symbol_totals():
+    return query_symbol_totals().where(Stock.user_id == get_benchmark_user_id())
+
+
+def query_user_by_email():
+    return select(User.id).where(func.lower(User.email) == BENCHMARK_EMAIL)
+
+
+# name -> (function that returns the query, names of the indexes it uses)
+QUERIES = {
+    'stocks_by_symbol': (query_stocks_by_symbol, ['ix_stocks_symbol_shares_price']),
+    'symbol_totals': (query_symbol_totals, ['ix_stocks_symbol_shares_price']),
+    'user_stocks_page': (query_user_stocks_page, ['ix_stocks_user_id_id', 'ix_stocks_user_id_symbol']),
+    'user_symbol_totals': (query_user_symbol_totals, ['ix_stocks_user_id_id', 'ix_stocks_user_id_symbol']),
+    'user_by_email': (query_user_by_email, ['ix_users_email_lower']),
+}
+
+
+def get_index(name):
+    for table in database.metadata.tables.values():
+        for index in table.indexes:
+            if index.name == name:
+                return index
+    raise KeyError(name)
+
+
+def set_indexes(indexes, present):
+    connection = database.session.connection()
+    for index in indexes:
+        # (SQLAlchemy can't check whether a functional index exists, so let the database check)
+        if present:
+            connection.execute(CreateIndex(index, if_not_exists=True))
+        else:
+            connection.execute(DropIndex(index, if_exists=True))
+    # Update the statistics used by the query planner
+    connection.execute(text('ANALYZE'))
+    database.session.commit()
+
+
+def explain(query):
+    connection = database.session.connection()
+    compiled = query.compile(dialect=connection.dialect, compile_kwargs={'literal_binds': True})
+    if connection.dialect.name == 'sqlite':
+        rows = connection.execute(text(f'EXPLAIN QUERY PLAN {compiled}'))
+        return [row[-1] for row in rows]
+    return [row[0] for row in connection.execute(text(f'EXPLAIN {compiled}'))]
+
+
+def time_query(query, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        database.session.execute(query).all()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--stocks', type=int, default=1000000, help='number of stocks')
+    parser.add_argument('--users', type=int, default=100000, help='number of users')
+    parser.add_argument('--owners', type=int, default=1000, help='number of users the stocks are shared between')
+    parser.add_argument('--repeat', type=int, default=20, help='number of times each query is run')
+    args = parser.parse_args()
+
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        print(f'Seeding {args.users} users and {args.stocks} stocks...')
+        seed_users(args.users)
+        owner_ids = database.session.scalars(select(User.id).order_by(User.id).limit(args.owners)).all()
+        seed_stocks(args.stocks, owner_ids)
+
+        for name, (build_query, index_names) in QUERIES.items():
+            indexes = [get_index(index_name) for index_name in index_names]
+            # 'before' is the schema without the indexes, 'after' is the current schema
+            for mode in ('before', 'after'):
+                set_indexes(indexes, present=mode == 'after')
+                query = build_query()
+                timings = sorted(time_query(query, args.repeat))
+                print(f'\n{name} ({mode}): p50 {statistics.median(timings) * 1000:.2f} ms, '
+                      f'max {timings[-1] * 1000:.2f} ms')
+                for line in explain(query):
+                    print(f'    {line}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmark of the ledger: rebuilding the lots from 10M trades, and recording one trade incrementally.
+
+The transactions table is seeded with 10M trades (buys, sells and a few
+splits) of 100 symbols, shared between 1000 owners, in the benchmark
+database. The ledger is then rebuilt with each cost method, and the latency
+of recording a buy and a sell with `record_trade()` is measured (it depends
+on the lots touched by the trade, not on the number of trades):
+
+    python -m benchmarks.bench_ledger --trades 10000000 --owners 1000 --symbols 100 --repeat 200
+"""
+import argparse
+import os
+import random
+import statistics
+import time
+
+from sqlalchemy import insert, select
+
+from project import create_app, database
+from project.models import Transaction, User
+from project.stocks.ledger import COST_METHODS, rebuild_ledger, record_trade
+from benchmarks.suite import seed_users, get_benchmark_user_id
+
+
+def seed_trades(count, owner_ids, symbols, batch_size=50000):
+    """
+    Insert `count` random trades (mostly buys and sells, never selling more shares than are held)
+    """
+    rng = random.Random(42)
+    shares = {}
+    batch = []
+    for index in range(count):
+        user_id = owner_ids[index % len(owner_ids)]
+        symbol = symbols[(index // len(owner_ids)) % len(symbols)]
+        held = shares.get((user_id, symbol), 0)
+        roll = rng.random()
+        if roll < 0.0001 and held:
+            row = {'kind': 'split', 'quantity': None, 'price': None, 'split_to': 2, 'split_from': 1}
+            held *= 2
+        elif roll < 0.4 and held:
+            quantity = rng.randint(1, max(1, held // 2))
+            row = {'kind': 'sell', 'quantity': quantity, 'price': rng.randint(1000, 50000),
+                   'split_to': None, 'split_from': None}
+            held -= quantity
+        else:
+            quantity = rng.randint(1, 100)
+            row = {'kind': 'buy', 'quantity': quantity, 'price': rng.randint(1000, 50000),
+                   'split_to': None, 'split_from': None}
+            held += quantity
+        shares[(user_id, symbol)] = held
+        row.update(user_id=user_id, stock_symbol=symbol)
+        batch.append(row)
+        if len(batch) >= batch_size:
+            database.session.execute(insert(Transaction), batch)
+            database.session.commit()
+            batch = []
+    if batch:
+        database.session.execute(insert(Transaction), batch)
+        database.session.commit()
+
+
+def time_trades(user_id, symbol, repeat):
+    timings = {'buy': [], 'sell': []}
+    for _ in range(repeat):
+        for kind in ('buy', 'sell'):
+            start = time.perf_counter()
+            record_trade(user_id, symbol, kind, quantity=10, price=10000)
+            database.session.commit()
+            timings[kind].append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--trades', type=int, default=10000000, help='number of trades')
+    parser.add_argument('--owners', type=int, default=1000, help='number of users the trades are shared between')
+    parser.add_argument('--symbols', type=int, default=100, help='number of stock symbols')
+    parser.add_argument('--repeat', type=int, default=200, help='number of buys and sells recorded incrementally')
+    args = parser.parse_args()
+
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        print(f'Seeding {args.owners} users and {args.trades} trades...')
+        seed_users(args.owners)
+        owner_ids = database.session.scalars(select(User.id).order_by(User.id).limit(args.owners)).all()
+        symbols = [f'S{index:04d}' for index in range(args.symbols)]
+        seed_trades(args.trades, owner_ids, symbols)
+
+        for method in COST_METHODS:
+            result = rebuild_ledger(method)
+            print(f'rebuild ({method}): {result.trades} trades in {result.elapsed:.2f}s '
+                  f'({result.trades_per_second:,.0f} trades/sec), {result.lots} open lots')
+
+        # The holding of the benchmark user with the most open lots
+        app.config['LEDGER_COST_METHOD'] = 'fifo'
+        rebuild_ledger('fifo')
+        user_id = get_benchmark_user_id()
+        timings = time_trades(user_id, symbols[0], args.repeat)
+        for kind, values in timings.items():
+            values.sort()
+            print(f'record_trade ({kind}): p50 {statistics.median(values) * 1000:.2f} ms, '
+                  f'max {values[-1] * 1000:.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark of the request latency added by logging.
+
+Each simulated request logs the same seven INFO records as a request to the
+stocks blueprint does (before/after/teardown callbacks of the application
+and of the blueprint, plus teardown_appcontext). The latency of every
+request is measured with the log file handler attached directly to the
+logger (the default) and through the queue and listener thread
+(LOG_ASYNC = True), and the percentiles are printed for each mode.
+
+    python -m benchmarks.bench_logging --threads 8 --requests 2000
+"""
+import argparse
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from project.log_handlers import create_file_handler, attach_async_handlers
+
+LOG_LINES_PER_REQUEST = [
+    'Calling before_request() for the Flask application...',
+    'Calling before_request() for the stocks blueprint...',
+    'Calling after_request() for the stocks blueprint...',
+    'Calling after_request() for the Flask application...',
+    'Calling teardown_request() for the stocks blueprint...',
+    'Calling teardown_request() for the Flask application...',
+    'Calling teardown_appcontext() for the Flask application...',
+]
+
+
+def simulate_requests(logger, requests_per_thread, latencies):
+    for _ in range(requests_per_thread):
+        start = time.perf_counter()
+        for line in LOG_LINES_PER_REQUEST:
+            logger.info(line)
+        latencies.append(time.perf_counter() - start)
+
+
+def run(mode, threads, requests_per_thread, directory):
+    logger = logging.getLogger(f'benchmark.{mode}')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    file_handler = create_file_handler(os.path.join(directory, f'{mode}.log'))
+
+    async_logging = None
+    if mode == 'async':
+        async_logging = attach_async_handlers(logger, [file_handler], queue_size=100000, drop_policy='block')
+    else:
+        logger.addHandler(file_handler)
+
+    latencies = []
+    workers = [threading.Thread(target=simulate_requests, args=(logger, requests_per_thread, latencies))
+               for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+
+    if async_logging is not None:
+        async_logging.stop()
+        logger.removeHandler(async_logging.handler)
+    else:
+        logger.removeHandler(file_handler)
+    file_handler.close()
+    return latencies, elapsed
+
+
+def percentile(values, percent):
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=8, help='number of concurrent request threads')
+    parser.add_argument('--requests', type=int, default=2000, help='number of requests per thread')
+    args = parser.parse_args()
+
+    print(f'{"mode":<6} {"requests":>9} {"p50 (us)":>10} {"p99 (us)":>10} {"max (us)":>10} {"req/s":>10}')
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ('sync', 'async'):
+            latencies, elapsed = run(mode, args.threads, args.requests, directory)
+            print(f'{mode:<6} {len(latencies):>9} '
+                  f'{percentile(latencies, 50) * 1e6:>10.1f} '
+                  f'{percentile(latencies, 99) * 1e6:>10.1f} '
+                  f'{max(latencies) * 1e6:>10.1f} '
+                  f'{len(latencies) / elapsed:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
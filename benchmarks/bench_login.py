@@ -0,0 +1,90 @@
+"""
+Benchmark of the login throughput under concurrent load.
+
+A number of threads (each with its own test client, like the worker threads
+of a web server) log in and out with the benchmark user as fast as they can.
+The logins are run with the password checked on the request thread
+(PASSWORD_HASH_WORKERS = 0) and on the password hashing pool, and the
+throughput, the latency percentiles and the number of requests rejected
+with 503 (pool queue full) are printed for each mode.
+
+    python -m benchmarks.bench_login --threads 16 --requests 20 --workers 4 --queue-depth 16
+"""
+import argparse
+import os
+import statistics
+import threading
+import time
+
+from project import create_app, database, password_hasher
+from project.models import User
+from benchmarks.suite import BENCHMARK_EMAIL, BENCHMARK_PASSWORD
+
+
+def simulate_logins(app, requests_per_thread, latencies, statuses):
+    with app.test_client() as client:
+        for _ in range(requests_per_thread):
+            start = time.perf_counter()
+            response = client.post('/users/login', data={'email': BENCHMARK_EMAIL, 'password': BENCHMARK_PASSWORD})
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+            if response.status_code != 503:
+                client.get('/users/logout')
+
+
+def run(app, threads, requests_per_thread):
+    latencies = []
+    statuses = []
+    workers = [threading.Thread(target=simulate_logins, args=(app, requests_per_thread, latencies, statuses))
+               for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return latencies, statuses, time.perf_counter() - start
+
+
+def percentile(values, percent):
+    return statistics.quantiles(values, n=100, method='inclusive')[percent - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--threads', type=int, default=16, help='number of concurrent request threads')
+    parser.add_argument('--requests', type=int, default=20, help='number of logins per thread')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='number of hashing processes')
+    parser.add_argument('--queue-depth', type=int, default=None, help='maximum number of queued hashes')
+    parser.add_argument('--iterations', type=int, default=260000, help='PBKDF2 iterations')
+    args = parser.parse_args()
+
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    password_hasher.configure(workers=0, iterations=args.iterations)
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        database.session.add(User(BENCHMARK_EMAIL, BENCHMARK_PASSWORD))
+        database.session.commit()
+
+    print(f'{"mode":<6} {"logins":>7} {"503s":>6} {"p50 (ms)":>10} {"p99 (ms)":>10} {"logins/s":>10}')
+    for mode, workers in (('inline', 0), ('pool', args.workers)):
+        password_hasher.configure(workers=workers, queue_depth=args.queue_depth, iterations=args.iterations)
+        # Start all of the worker processes before timing
+        warm_up = [threading.Thread(target=password_hasher.hash, args=('warm-up',)) for _ in range(max(workers, 1))]
+        for thread in warm_up:
+            thread.start()
+        for thread in warm_up:
+            thread.join()
+        latencies, statuses, elapsed = run(app, args.threads, args.requests)
+        succeeded = len(statuses) - statuses.count(503)
+        print(f'{mode:<6} {len(latencies):>7} {statuses.count(503):>6} '
+              f'{percentile(latencies, 50) * 1000:>10.1f} '
+              f'{percentile(latencies, 99) * 1000:>10.1f} '
+              f'{succeeded / elapsed:>10.1f}')
+    password_hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
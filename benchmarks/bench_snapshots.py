@@ -0,0 +1,73 @@
+"""
+Benchmark of the daily portfolio snapshots.
+
+The benchmark database is seeded with 1000 users holding stocks in the 10
+symbols of the suite, and the price history store (in a temporary directory)
+with 5 years of daily closing prices for each symbol. The time taken to
+write the snapshots of every user is then printed for:
+
+    * a full run on one thread, and on the pool of worker threads
+    * an incremental run after one more day of prices is loaded
+    * an incremental run with nothing new (every user is skipped)
+
+    python -m benchmarks.bench_snapshots --users 1000 --years 5 --workers 4
+"""
+import argparse
+import os
+import tempfile
+
+import numpy as np
+from sqlalchemy import select
+
+from project import create_app, database
+from project.models import User
+from project.stocks.history import PriceHistoryStore, to_day
+from project.stocks.snapshots import take_snapshots
+from benchmarks.bench_analytics import seed_price_history
+from benchmarks.suite import seed_stocks, seed_users
+
+SYMBOLS = ['AAPL', 'HD', 'DIS', 'MSFT', 'SBUX', 'NFLX', 'AMZN', 'TSLA', 'NKE', 'KO']
+
+
+def run(label, store, **options):
+    result = take_snapshots(store, **options)
+    print(f'{label}: {result.snapshots} snapshots for {result.users} users ({result.skipped} up to date) '
+          f'in {result.elapsed:.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000, help='number of users')
+    parser.add_argument('--years', type=int, default=5, help='years of daily prices')
+    parser.add_argument('--workers', type=int, default=4, help='number of worker threads')
+    parser.add_argument('--batch-size', type=int, default=100, help='number of users per batch')
+    args = parser.parse_args()
+
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        database.drop_all()
+        database.create_all()
+        seed_users(args.users)
+        owner_ids = database.session.scalars(select(User.id).order_by(User.id)).all()
+        seed_stocks(args.users * len(SYMBOLS), owner_ids)
+
+        # Trading days only (no weekends); the last one is loaded later
+        all_days = np.arange(to_day('2018-01-01'), to_day('2018-01-01') + args.years * 365 + 7)
+        days = all_days[np.is_busday(all_days.astype('datetime64[D]'))][:args.years * 252 + 1]
+        print(f'Writing {len(days) - 1} days of prices for {len(SYMBOLS)} symbols...')
+        store = PriceHistoryStore(directory)
+        seed_price_history(store, SYMBOLS, days[:-1])
+
+        run('full (1 thread)', store, full=True, batch_size=args.batch_size, workers=0)
+        run(f'full ({args.workers} threads)', store, full=True, batch_size=args.batch_size, workers=args.workers)
+
+        for symbol in SYMBOLS:
+            store.append(symbol, days[-1:], [10000])
+        run('one more day', store, batch_size=args.batch_size, workers=args.workers)
+        run('nothing new', store, batch_size=args.batch_size, workers=args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Benchmark of the quote publisher behind the live stocks page (Server-Sent Events).
+
+10000 subscriptions (one per open stocks page), each holding 10 of 500
+symbols, share one publisher fed by a local quote feed. Each poll changes
+the prices of a fraction of the symbols; the time taken by a poll (one
+batched call to the feed, then handing the changes to the subscriptions of
+the changed symbols) and the time for every client to collect its changes
+are printed:
+
+    python -m benchmarks.bench_streaming --clients 10000 --symbols 500 --changed 0.1 --repeat 20
+"""
+import argparse
+import itertools
+import random
+import statistics
+import string
+import time
+
+from project.stocks.quotes import QuoteCache, QuoteProvider
+from project.stocks.streaming import QuotePublisher
+
+
+class RandomQuoteFeed(QuoteProvider):
+    """
+    Local quote feed where a fraction of the prices change before each batch
+    """
+
+    def __init__(self, symbols, changed):
+        self.prices = {symbol: 10000 for symbol in symbols}
+        self.changed = changed
+        self.batches = 0
+
+    def get_quote(self, symbol):
+        return self.prices.get(symbol)
+
+    def get_quotes(self, symbols):
+        self.batches += 1
+        for symbol in random.sample(sorted(self.prices), int(len(self.prices) * self.changed)):
+            self.prices[symbol] += random.choice((-1, 1))
+        return {symbol: self.prices.get(symbol) for symbol in symbols}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=10000, help='number of open streams')
+    parser.add_argument('--symbols', type=int, default=500, help='number of distinct symbols')
+    parser.add_argument('--holdings', type=int, default=10, help='number of symbols held by each client')
+    parser.add_argument('--changed', type=float, default=0.1, help='fraction of the prices changed per poll')
+    parser.add_argument('--repeat', type=int, default=20, help='number of polls')
+    args = parser.parse_args()
+
+    random.seed(42)
+    symbols = [''.join(letters) for letters in
+               itertools.islice(itertools.product(string.ascii_uppercase, repeat=3), args.symbols)]
+    feed = RandomQuoteFeed(symbols, args.changed)
+    publisher = QuotePublisher(QuoteCache(feed, ttl=0, negative_ttl=0, maxsize=args.symbols))
+    subscriptions = [publisher.subscribe(random.sample(symbols, args.holdings)) for _ in range(args.clients)]
+    publisher.poll()
+    for subscription in subscriptions:
+        subscription.wait(0)
+
+    poll_timings = []
+    collect_timings = []
+    events = 0
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        publisher.poll()
+        poll_timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        events += sum(1 for subscription in subscriptions if subscription.wait(0))
+        collect_timings.append(time.perf_counter() - start)
+
+    print(f'{args.clients} clients, {args.symbols} symbols: {feed.batches} feed calls for {args.repeat + 1} polls')
+    print(f'poll (fetch and publish): p50 {statistics.median(poll_timings) * 1000:.1f} ms, '
+          f'max {max(poll_timings) * 1000:.1f} ms')
+    print(f'collect (every client): p50 {statistics.median(collect_timings) * 1000:.1f} ms, '
+          f'{events / args.repeat:.0f} events per poll')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,331 @@
+"""
+Benchmark suite for the hot routes, the model layer and the CLI commands.
+
+The database is seeded with each requested number of stocks (e.g. 1k, 100k
+and 1M), all owned by the benchmark user, plus a number of other users, and
+every benchmark is then run against it
+with the Flask test client (no network or web server involved). The results
+are written as JSON, one entry per benchmark and database size:
+
+    {"name": "list_stocks", "size": 1000, "iterations": 200,
+     "ops_per_sec": 812.3, "mean_ms": 1.23, "p50_ms": 1.19, "p95_ms": 1.41}
+
+Two result files can be compared; the comparison fails when the throughput
+(ops/sec) of any benchmark dropped by more than the allowed percentage.
+"""
+import contextlib
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, func, select
+
+from project import create_app, database, login
+from project.models import Stock, User
+from project.stocks.importer import insert_stocks
+from project.stocks.summary import rebuild_summaries
+
+# Every benchmark user has this password (hashed once, then copied into every row)
+BENCHMARK_PASSWORD = 'benchmarkPassword123'
+BENCHMARK_EMAIL = 'benchmark@email.com'
+
+
+class BenchmarkResult:
+    """
+    Class that holds the timings of one benchmark at one database size
+    """
+
+    def __init__(self, name, size, timings):
+        self.name = name
+        self.size = size
+        self.timings = timings
+
+    def to_dict(self):
+        total = sum(self.timings)
+        ordered = sorted(self.timings)
+        return {'name': self.name,
+                'size': self.size,
+                'iterations': len(self.timings),
+                'ops_per_sec': len(self.timings) / total if total else 0.0,
+                'mean_ms': statistics.fmean(self.timings) * 1000,
+                'p50_ms': ordered[len(ordered) // 2] * 1000,
+                'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000}
+
+
+def measure(operation, iterations, max_seconds):
+    """
+    Time `operation` (called with the iteration number) up to `iterations` times or `max_seconds`
+    """
+    timings = []
+    deadline = time.perf_counter() + max_seconds
+    for iteration in range(iterations):
+        start = time.perf_counter()
+        operation(iteration)
+        timings.append(time.perf_counter() - start)
+        if start > deadline:
+            break
+    return timings
+
+
+# ----------------
+# Database seeding
+# ----------------
+
+def seed_stocks(size, owner_ids=None, batch_size=10000):
+    """
+    Add stocks to the database until it holds `size` stocks, shared in turn
+    between the users `owner_ids` (default: all owned by the benchmark user)
+    """
+    if owner_ids is None:
+        owner_ids = [get_benchmark_user_id()]
+    count = database.session.scalar(select(func.count(Stock.id)))
+    symbols = ['AAPL', 'HD', 'DIS', 'MSFT', 'SBUX', 'NFLX', 'AMZN', 'TSLA', 'NKE', 'KO']
+    while count < size:
+        batch = [{'stock_symbol': symbols[index % len(symbols)],
+                  'number_of_shares': index % 500 + 1,
+                  'purchase_price': 1000 + index % 50000,
+                  'user_id': owner_ids[index % len(owner_ids)]}
+                 for index in range(count, min(size, count + batch_size))]
+        count += insert_stocks(batch)
+
+
+def seed_users(count, batch_size=10000):
+    """
+    Add users to the database until it holds `count` users (including the benchmark user)
+    """
+    if database.session.scalar(select(func.count(User.id))) >= count:
+        return
+    benchmark_user = User(BENCHMARK_EMAIL, BENCHMARK_PASSWORD)
+    database.session.add(benchmark_user)
+    database.session.commit()
+
+    # Hashing is deliberately slow, so every seeded user shares the benchmark user's hash
+    for start in range(1, count, batch_size):
+        database.session.execute(insert(User), [{'email': f'user{index}@email.com',
+                                                 'password_hashed': benchmark_user.password_hashed}
+                                                for index in range(start, min(count, start + batch_size))])
+        database.session.commit()
+
+
+def get_benchmark_user_id():
+    return database.session.scalar(select(User.id).where(User.email == BENCHMARK_EMAIL))
+
+
+# ----------------
+# Benchmarks
+# ----------------
+
+def log_in(client):
+    client.post('/users/login', data={'email': BENCHMARK_EMAIL, 'password': BENCHMARK_PASSWORD})
+
+
+def benchmark_list_stocks(app, client, size):
+    log_in(client)
+    return lambda iteration: client.get('/stocks/')
+
+
+def benchmark_list_stocks_uncached(app, client, size):
+    # The stocks page with its rows rendered every time (see project/stocks/fragments.py)
+    log_in(client)
+
+    def list_stocks(iteration):
+        fragment_cache = app.extensions.get('stocks_fragment_cache')
+        if fragment_cache is not None:
+            fragment_cache.clear()
+        client.get('/stocks/')
+    return list_stocks
+
+
+def benchmark_list_stocks_last_page(app, client, size):
+    with app.app_context():
+        last_id = database.session.scalar(select(func.max(Stock.id)))
+    log_in(client)
+    return lambda iteration: client.get(f'/stocks/?after={last_id - 20}')
+
+
+def benchmark_list_stocks_not_modified(app, client, size):
+    # Revalidation of a copy of the stocks page that is still current (304 Not Modified)
+    log_in(client)
+    # (the first page shows the message flashed by the login, so it has no ETag)
+    client.get('/stocks/')
+    etag = client.get('/stocks/').headers['ETag']
+    return lambda iteration: client.get('/stocks/', headers={'If-None-Match': etag})
+
+
+def benchmark_add_stock(app, client, size):
+    log_in(client)
+    return lambda iteration: client.post('/add_stock', data={'stock_symbol': 'AAPL',
+                                                             'number_of_shares': '10',
+                                                             'purchase_price': '172.50'})
+
+
+def benchmark_login(app, client, size):
+    def login(iteration):
+        client.post('/users/login', data={'email': BENCHMARK_EMAIL, 'password': BENCHMARK_PASSWORD})
+        client.get('/users/logout')
+    return login
+
+
+def benchmark_register(app, client, size):
+    run_id = int(time.time() * 1000)
+    return lambda iteration: client.post('/users/register', data={'email': f'new{run_id}.{iteration}@email.com',
+                                                                  'password': BENCHMARK_PASSWORD})
+
+
+def benchmark_load_user(app, client, size):
+    with app.app_context():
+        user_id = str(User.query.filter_by(email=BENCHMARK_EMAIL).first().id)
+
+    def load_user(iteration):
+        with app.test_request_context():
+            login._user_callback(user_id)
+    return load_user
+
+
+def benchmark_stock_init(app, client, size):
+    return lambda iteration: Stock('AAPL', '16', '406.78', 1)
+
+
+def benchmark_cli_create(app, client, size):
+    runner = app.test_cli_runner()
+    return lambda iteration: runner.invoke(args=['stocks', 'create', 'AAPL', '10', '172.50',
+                                                 '--owner', BENCHMARK_EMAIL])
+
+
+def benchmark_cli_value(app, client, size):
+    runner = app.test_cli_runner()
+    return lambda iteration: runner.invoke(args=['stocks', 'value'])
+
+
+def benchmark_cli_export(app, client, size):
+    runner = app.test_cli_runner()
+    return lambda iteration: runner.invoke(args=['stocks', 'export', '--output', os.devnull])
+
+
+def benchmark_cli_import(app, client, size):
+    runner = app.test_cli_runner()
+    # The file is written to a temporary directory (removed by `cleanup()`, see run_suite())
+    directory = tempfile.mkdtemp(prefix='benchmark-import-')
+    filename = os.path.join(directory, 'benchmark_import.csv')
+    with open(filename, 'w') as file:
+        file.write('stock_symbol,number_of_shares,purchase_price\n')
+        file.write(''.join(f'AAPL,{index + 1},172.50\n' for index in range(1000)))
+
+    def import_file(iteration):
+        runner.invoke(args=['stocks', 'import', filename, '--owner', BENCHMARK_EMAIL])
+    import_file.cleanup = lambda: shutil.rmtree(directory, ignore_errors=True)
+    return import_file
+
+
+# name -> (function that returns the operation to time, maximum iterations)
+BENCHMARKS = {
+    'list_stocks': (benchmark_list_stocks, 200),
+    'list_stocks_uncached': (benchmark_list_stocks_uncached, 200),
+    'list_stocks_last_page': (benchmark_list_stocks_last_page, 200),
+    'list_stocks_not_modified': (benchmark_list_stocks_not_modified, 200),
+    'add_stock': (benchmark_add_stock, 200),
+    'login': (benchmark_login, 20),
+    'register': (benchmark_register, 20),
+    'load_user': (benchmark_load_user, 2000),
+    'stock_init': (benchmark_stock_init, 20000),
+    'cli_create': (benchmark_cli_create, 50),
+    'cli_value': (benchmark_cli_value, 5),
+    'cli_export': (benchmark_cli_export, 3),
+    'cli_import': (benchmark_cli_import, 5),
+}
+
+
+def run_suite(sizes, users, names=None, max_seconds=10.0, log=print):
+    """
+    Run the benchmarks called `names` (default: all) at each database size and return the results
+    """
+    # Always use the benchmark database, as the tables are dropped and re-created
+    os.environ['CONFIG_TYPE'] = 'benchmarks.config.BenchmarkConfig'
+    app = create_app()
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        log(f'Seeding {users} users...')
+        seed_users(users)
+
+    results = []
+    for size in sorted(sizes):
+        with app.app_context():
+            log(f'Seeding {size} stocks...')
+            seed_stocks(size)
+
+        for name in names or BENCHMARKS:
+            setup, iterations = BENCHMARKS[name]
+            with app.test_client() as client:
+                operation = setup(app, client, size)
+                try:
+                    # Some routes print the form data, which would be timed as well
+                    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                        timings = measure(operation, iterations, max_seconds)
+                finally:
+                    # Remove the files written by the benchmark (if any)
+                    getattr(operation, 'cleanup', lambda: None)()
+            result = BenchmarkResult(name, size, timings).to_dict()
+            log(f'{name:<24} {size:>9} {result["ops_per_sec"]:>12.1f} ops/s '
+                f'{result["p50_ms"]:>9.2f} ms p50 {result["p95_ms"]:>9.2f} ms p95')
+            results.append(result)
+
+            # Keep the table at the seeded size for the next benchmark
+            with app.app_context():
+                _trim_stocks(size)
+
+    return {'meta': {'created': datetime.now(timezone.utc).isoformat(),
+                     'python': platform.python_version(),
+                     'platform': platform.platform(),
+                     'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0],
+                     'users': users},
+            'results': results}
+
+
+def _trim_stocks(size):
+    cutoff = database.session.scalar(select(Stock.id).order_by(Stock.id).offset(size).limit(1))
+    if cutoff is not None:
+        database.session.execute(Stock.__table__.delete().where(Stock.id >= cutoff))
+        database.session.commit()
+        rebuild_summaries()
+
+
+def compare_results(baseline, current, max_regression):
+    """
+    Compare two result dictionaries and return (report lines, list of regressions)
+
+    A regression is a benchmark whose throughput dropped by more than
+    `max_regression` percent compared to the baseline.
+    """
+    baseline_results = {(result['name'], result['size']): result for result in baseline['results']}
+    lines = []
+    regressions = []
+    for result in current['results']:
+        key = (result['name'], result['size'])
+        if key not in baseline_results:
+            lines.append(f'{result["name"]:<24} {result["size"]:>9}   (no baseline)')
+            continue
+
+        base_ops = baseline_results[key]['ops_per_sec']
+        change = (result['ops_per_sec'] - base_ops) * 100.0 / base_ops if base_ops else 0.0
+        regressed = change < -max_regression
+        lines.append(f'{result["name"]:<24} {result["size"]:>9} {base_ops:>12.1f} -> '
+                     f'{result["ops_per_sec"]:>12.1f} ops/s {change:>+8.1f}%{"  REGRESSION" if regressed else ""}')
+        if regressed:
+            regressions.append((key, change))
+    return lines, regressions
+
+
+def load_results(filename):
+    with open(filename) as file:
+        return json.load(file)
+
+
+def save_results(results, filename):
+    with open(filename, 'w') as file:
+        json.dump(results, file, indent=2)
@@ -0,0 +1,40 @@
+"""add indexes for query paths
+
+Revision ID: 8d3e9a6c41f2
+Revises: 5b1f0c7d2e4a
+Create Date: 2023-05-10 16:27:03.551209
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3e9a6c41f2'
+down_revision = '5b1f0c7d2e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Covering index for the queries by symbol and the totals grouped by symbol
+    op.create_index('ix_stocks_symbol_shares_price', 'stocks',
+                    ['stock_symbol', 'number_of_shares', 'purchase_price'], unique=False)
+    # Functional index for the case-insensitive email lookups, which is also
+    # unique: the emails that only differ in case are different accounts that
+    # can't be merged automatically (each has its own password and stocks), so
+    # they have to be resolved by hand before upgrading
+    connection = op.get_bind()
+    duplicates = connection.execute(sa.text('SELECT lower(email) FROM users '
+                                            'GROUP BY lower(email) HAVING count(*) > 1')).scalars().all()
+    if duplicates:
+        raise RuntimeError(f'Users with the same email in a different case must be merged before '
+                           f'upgrading: {", ".join(sorted(duplicates))}')
+    # Email addresses are stored in lower case from now on
+    connection.execute(sa.text('UPDATE users SET email = lower(email) WHERE email != lower(email)'))
+    op.create_index('ix_users_email_lower', 'users', [sa.text('lower(email)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_email_lower', table_name='users')
+    op.drop_index('ix_stocks_symbol_shares_price', table_name='stocks')
@@ -0,0 +1,75 @@
+"""add owner (user_id) to stocks
+
+Revision ID: b7c2f4e91d05
+Revises: 8d3e9a6c41f2
+Create Date: 2023-05-15 09:41:26.107354
+
+The existing stocks are given to an owner (backfill) before the column is
+made NOT NULL:
+    * the user whose email is passed with `flask db upgrade -x stocks_owner=<email>`
+    * otherwise, the first registered user
+    * otherwise (stocks but no users), a placeholder user that can't log in
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c2f4e91d05'
+down_revision = '8d3e9a6c41f2'
+branch_labels = None
+depends_on = None
+
+PLACEHOLDER_OWNER_EMAIL = 'unclaimed-stocks@localhost'
+
+
+def upgrade():
+    with op.batch_alter_table('stocks') as batch_op:
+        batch_op.add_column(sa.Column('user_id', sa.Integer(), nullable=True))
+
+    connection = op.get_bind()
+    owner_id = _get_backfill_owner_id(connection)
+    if owner_id is not None:
+        connection.execute(sa.text('UPDATE stocks SET user_id = :owner_id WHERE user_id IS NULL'),
+                           {'owner_id': owner_id})
+
+    with op.batch_alter_table('stocks') as batch_op:
+        batch_op.alter_column('user_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_foreign_key('fk_stocks_user_id_users', 'users', ['user_id'], ['id'])
+        batch_op.create_index('ix_stocks_user_id_id', ['user_id', 'id'], unique=False)
+        batch_op.create_index('ix_stocks_user_id_symbol',
+                              ['user_id', 'stock_symbol', 'number_of_shares', 'purchase_price'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stocks') as batch_op:
+        batch_op.drop_index('ix_stocks_user_id_symbol')
+        batch_op.drop_index('ix_stocks_user_id_id')
+        batch_op.drop_constraint('fk_stocks_user_id_users', type_='foreignkey')
+        batch_op.drop_column('user_id')
+
+
+def _get_backfill_owner_id(connection):
+    """
+    Return the ID of the user that is given the existing stocks (None if there are no stocks)
+    """
+    if connection.execute(sa.text('SELECT 1 FROM stocks LIMIT 1')).first() is None:
+        return None
+
+    email = context.get_x_argument(as_dictionary=True).get('stocks_owner')
+    if email is not None:
+        owner_id = connection.execute(sa.text('SELECT id FROM users WHERE lower(email) = :email'),
+                                      {'email': email.lower()}).scalar()
+        if owner_id is None:
+            raise ValueError(f'No user with the email {email} (stocks_owner) to give the existing stocks to')
+        return owner_id
+
+    owner_id = connection.execute(sa.text('SELECT min(id) FROM users')).scalar()
+    if owner_id is None:
+        # An empty password hash never matches a password, so nobody can log in as this user
+        connection.execute(sa.text("INSERT INTO users (email, password_hashed) VALUES (:email, '')"),
+                           {'email': PLACEHOLDER_OWNER_EMAIL})
+        owner_id = connection.execute(sa.text('SELECT id FROM users WHERE email = :email'),
+                                      {'email': PLACEHOLDER_OWNER_EMAIL}).scalar()
+    return owner_id
@@ -1,13 +1,14 @@
 import os
-import logging
 from flask import Flask, render_template
-from logging.handlers import RotatingFileHandler
 from flask.logging import default_handler
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager
 from flask_mail import Mail
+from project.log_handlers import create_file_handler, attach_async_handlers
+from project.instrumentation import register_instrumentation
+from project.hashing import PasswordHasher, PasswordHasherBusy
 
 # --------------
 # Configuration
@@ -22,6 +23,8 @@ csrf_protection = CSRFProtect()
 login = LoginManager()
 login.login_view = 'users.login'
 mail = Mail()
+# Hashes and checks passwords on a bounded pool of worker processes
+password_hasher = PasswordHasher()
 
 
 # ----------------
@@ -34,16 +37,22 @@ def initialize_extensions(app):
     db_migration.init_app(app, database)
     csrf_protection.init_app(app)
     mail.init_app(app)
+    password_hasher.init_app(app)
 
     login.init_app(app)
 
-    from project.models import User
+    from project.users.identity import load_user, register_user_cache_invalidation
 
     # Specify how the Flask-Login module should load a user from the database
     # the user_loader callback, used to reload the user object from the session
-    @login.user_loader
-    def load_user(user_id):
-        return database.session.get(User, int(user_id))
+    # (through the user cache, see project/users/identity.py)
+    login.user_loader(load_user)
+    register_user_cache_invalidation()
+
+    from project.stocks.fragments import register_fragment_cache_invalidation
+
+    # Drop the cached rows of the stocks table of the portfolios that change
+    register_fragment_cache_invalidation()
 
 
 # ----------------------------
@@ -65,6 +74,8 @@ def create_app():
     # Configure the logger
     configure_logging(app)
 
+    # Measure every request (Server-Timing header, /metrics and the access log)
+    register_instrumentation(app)
     register_app_callbacks(app)
     register_error_pages(app)
     return app
@@ -73,22 +84,29 @@ def create_app():
 def register_blueprints(app):
     from project.stocks import stocks_blueprint
     from project.users import users_blueprint
+    from project.api import api_blueprint
     # Import blueprints in this function to avoid a circular reference
     # The blueprints effectively handle the 'Steady State' - where requests are processed (by view functions
     # and responses are returned
     app.register_blueprint(stocks_blueprint)
     app.register_blueprint(users_blueprint, url_prefix='/users')
+    app.register_blueprint(api_blueprint, url_prefix='/api/v1')
 
 
 def configure_logging(app):
     # Logging Configuration
-    file_handler = RotatingFileHandler('instance/flask-stock-portfolio.log',
-                                       maxBytes=16384,
-                                       backupCount=20)
-    file_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(filename)s:%(lineno)d]')
-    file_handler.setFormatter(file_formatter)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
+    file_handler = create_file_handler('instance/flask-stock-portfolio.log')
+
+    if app.config.get('LOG_ASYNC', False):
+        # Asynchronous logging: request threads only put the log records on a bounded
+        # queue, and a single listener thread writes them to the log file
+        app.extensions['async_logging'] = attach_async_handlers(
+            app.logger,
+            [file_handler],
+            queue_size=app.config.get('LOG_QUEUE_SIZE', 10000),
+            drop_policy=app.config.get('LOG_QUEUE_DROP_POLICY', 'drop_new'))
+    else:
+        app.logger.addHandler(file_handler)
 
     # Remove the default logger configured by Flask
     app.logger.removeHandler(default_handler)
@@ -98,6 +116,11 @@ def configure_logging(app):
 
 
 def register_app_callbacks(app):
+    # The callbacks below log several lines for every request, so they are
+    # only registered when debugging the request lifecycle
+    if not app.config.get('LOG_REQUEST_CALLBACKS', False):
+        return
+
     @app.before_request
     def app_before_request():
         app.logger.info('Calling before_request() for the Flask application...')
@@ -124,3 +147,9 @@ def register_error_pages(app):
     @app.errorhandler(405)
     def method_not_allowed(e):
         return render_template('405.html'), 405
+
+    # Back-pressure from the password hashing pool: ask the client to retry later
+    # rather than queueing more work behind a full pool
+    @app.errorhandler(PasswordHasherBusy)
+    def service_unavailable(e):
+        return render_template('503.html'), 503, {'Retry-After': str(app.config.get('PASSWORD_HASH_RETRY_AFTER', 1))}
@@ -0,0 +1,10 @@
+"""
+The api Blueprint provides the JSON API of this application (version 1,
+under /api/v1). Specifically, this Blueprint allows for the stocks of the
+logged in user to be listed, added and added in batches
+"""
+from flask import Blueprint
+
+api_blueprint = Blueprint('api', __name__)
+
+from . import routes
@@ -0,0 +1,186 @@
+"""
+Views of the JSON API (version 1).
+
+    GET  /api/v1/stocks        - page of the user's stocks (keyset pagination)
+    POST /api/v1/stocks        - add one stock
+    POST /api/v1/stocks/batch  - add a list of stocks (in one transaction)
+
+The API uses the session of the logged in user (the same as the pages), but
+answers 401 Unauthorized instead of redirecting to the login page. The
+requests that change data must be sent with a JSON body (Content-Type:
+application/json), which a cross-site form can't send, so they are exempt
+from the CSRF token of the forms.
+
+Errors are returned as a JSON object: {"error": <message>}, plus "errors"
+with the problems of each invalid field or item.
+"""
+from functools import wraps
+
+from flask import current_app, request, jsonify
+from flask_login import current_user
+from pydantic import ValidationError
+
+from . import api_blueprint
+from .serializers import parse_fields, stock_columns, encode_stocks, encode_stock
+from project import database, csrf_protection
+from project.models import Stock
+from project.stocks.forms import StockModel
+from project.stocks.pagination import keyset_paginate
+from project.stocks.quotes import get_quote_cache
+from project.stocks.summary import add_stocks
+from project.stocks.importer import validate_stock_row, insert_stocks, format_error
+from project.stocks.conditional import conditional_portfolio
+
+# The API is authenticated by the session cookie and only accepts JSON bodies (see above)
+csrf_protection.exempt(api_blueprint)
+
+
+# ----------------
+# Helper Functions
+# ----------------
+
+def json_response(body, status=200):
+    """
+    Return a response with the JSON document `body` (bytes)
+    """
+    return current_app.response_class(body, status=status, mimetype='application/json')
+
+
+def json_error(message, status, errors=None):
+    document = {'error': message}
+    if errors is not None:
+        document['errors'] = errors
+    return jsonify(document), status
+
+
+def api_login_required(view):
+    """
+    Decorator for the views of the API that need a logged in user (401 Unauthorized otherwise)
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            return json_error('Authentication required', 401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _get_json_body():
+    """
+    Return the JSON body of the request, or None if it isn't a JSON document
+    """
+    if not request.is_json:
+        return None
+    return request.get_json(silent=True)
+
+
+def _get_per_page():
+    """
+    Return the page size requested in the query string, limited to the
+    configured maximum (API_MAX_PER_PAGE)
+    """
+    default_per_page = current_app.config.get('API_PER_PAGE', 100)
+    max_per_page = current_app.config.get('API_MAX_PER_PAGE', 1000)
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    return max(1, min(per_page, max_per_page))
+
+
+# ------
+# Views
+# ------
+
+@api_blueprint.route('/stocks', methods=['GET'])
+@api_login_required
+@conditional_portfolio()
+def list_stocks():
+    # Only the requested fields are selected, as plain rows (no Stock
+    # objects), and the page is selected with keyset pagination (see
+    # project/stocks/pagination.py) like the stocks page
+    try:
+        fields = parse_fields(request.args.get('fields'))
+    except ValueError as e:
+        return json_error(str(e), 400)
+
+    page = keyset_paginate(database.session.query(*stock_columns(fields)).filter(Stock.user_id == current_user.id),
+                           Stock.id,
+                           _get_per_page(),
+                           after=request.args.get('after', type=int),
+                           before=request.args.get('before', type=int),
+                           key=lambda row: row[0])
+    return json_response(encode_stocks(page.items, fields,
+                                       next_cursor=page.next_cursor,
+                                       prev_cursor=page.prev_cursor))
+
+
+@api_blueprint.route('/stocks', methods=['POST'])
+@api_login_required
+def create_stock():
+    data = _get_json_body()
+    if not isinstance(data, dict):
+        return json_error('Request body must be a JSON object with the stock data', 400)
+
+    # Validated with the same model as the 'Add a Stock' form
+    try:
+        stock_data = StockModel(**data)
+    except ValidationError as e:
+        return json_error('Invalid stock data', 422,
+                          [{'field': '.'.join(str(field) for field in item['loc']), 'message': item['msg']}
+                           for item in e.errors()])
+
+    # Check that the stock symbol exists (the quote cache remembers unknown symbols too)
+    quote_cache = get_quote_cache()
+    if quote_cache is not None and not quote_cache.is_known(stock_data.stock_symbol):
+        return json_error(f'Unknown stock symbol ({stock_data.stock_symbol})', 422)
+
+    stock = Stock(stock_data.stock_symbol,
+                  stock_data.number_of_shares,
+                  stock_data.purchase_price,
+                  current_user.id)
+    add_stocks([stock])
+    database.session.commit()
+    current_app.logger.info(f'Added new stock ({stock.stock_symbol}) with the API!')
+
+    return json_response(encode_stock(stock), 201)
+
+
+@api_blueprint.route('/stocks/batch', methods=['POST'])
+@api_login_required
+def create_stocks():
+    # Every item is validated first (with the same model as the 'Add a Stock'
+    # form), then the valid items are inserted with one INSERT statement
+    # and committed in one transaction, together with the update of the
+    # portfolio summary, however many items there are. The invalid items
+    # are reported with their index in the list
+    items = _get_json_body()
+    if isinstance(items, dict):
+        items = items.get('stocks')
+    if not isinstance(items, list):
+        return json_error('Request body must be a JSON list of stocks (or an object with a "stocks" list)', 400)
+    max_items = current_app.config.get('API_MAX_BATCH_SIZE', 10000)
+    if len(items) > max_items:
+        return json_error(f'Too many stocks ({len(items)}), the maximum is {max_items}', 413)
+
+    # index in the list -> column values of the stock (or error message)
+    rows = {}
+    errors = {}
+    for index, item in enumerate(items):
+        try:
+            rows[index] = validate_stock_row(item, current_user.id)
+        except (ValueError, TypeError) as e:
+            errors[index] = format_error(e)
+
+    # Check that the stock symbols exist, with one call of the quote provider for all the symbols
+    # (the symbols it fails to return, e.g. while it is down, are accepted)
+    quote_cache = get_quote_cache()
+    if quote_cache is not None and rows:
+        unknown = quote_cache.unknown_symbols({row['stock_symbol'] for row in rows.values()})
+        for index in [index for index, row in rows.items() if row['stock_symbol'] in unknown]:
+            errors[index] = f'Unknown stock symbol ({rows.pop(index)["stock_symbol"]})'
+
+    if rows:
+        insert_stocks(list(rows.values()))
+    current_app.logger.info(f'Added {len(rows)} stocks with the API ({len(errors)} invalid)!')
+
+    document = {'created': len(rows),
+                'errors': [{'index': index, 'message': errors[index]} for index in sorted(errors)]}
+    return jsonify(document), 201 if rows else 422
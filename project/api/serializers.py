@@ -0,0 +1,75 @@
+"""
+Serialization of stocks for the JSON API.
+
+The stocks are read as plain rows of the selected columns (no `Stock`
+objects are created), with the purchase price already converted to
+dollars by the database, and the rows are encoded to JSON bytes in one
+call to the encoder of the standard library: there is no ORM object and no
+pydantic model between the database and the response.
+
+The fields of a stock are:
+    * id - ID of the stock
+    * stock_symbol - stock symbol (e.g. 'AAPL')
+    * number_of_shares - number of shares purchased
+    * purchase_price - purchase price of one share (in dollars)
+"""
+import json
+
+from sqlalchemy import Float, type_coerce
+
+from project.models import Stock
+
+STOCK_FIELDS = {
+    'id': Stock.id,
+    'stock_symbol': Stock.stock_symbol,
+    'number_of_shares': Stock.number_of_shares,
+    'purchase_price': type_coerce(Stock.purchase_price / 100.0, Float).label('purchase_price'),
+}
+
+# Compact output (no spaces after the separators)
+_encoder = json.JSONEncoder(separators=(',', ':'))
+
+
+def parse_fields(fields):
+    """
+    Return the names of the fields selected by `fields` (a comma-separated
+    list of field names, or None for every field)
+
+    Raises ValueError if a field doesn't exist.
+    """
+    if not fields:
+        return list(STOCK_FIELDS)
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in STOCK_FIELDS]
+    if unknown or not names:
+        raise ValueError(f'Invalid fields ({", ".join(unknown)}), expected any of: {", ".join(STOCK_FIELDS)}')
+    # Each field only once, in the order given
+    return list(dict.fromkeys(names))
+
+
+def stock_columns(fields):
+    """
+    Return the columns to select for the stock `fields`: the ID (the key
+    of the pagination) followed by the columns of the fields
+    """
+    return [Stock.id] + [STOCK_FIELDS[name] for name in fields]
+
+
+def encode_stocks(rows, fields, **extra):
+    """
+    Return the JSON document (bytes) of the stocks in `rows` (rows of the
+    columns returned by `stock_columns(fields)`), with the `extra` members
+    """
+    document = {'stocks': [dict(zip(fields, row[1:])) for row in rows]}
+    document.update(extra)
+    return _encoder.encode(document).encode()
+
+
+def encode_stock(stock):
+    """
+    Return the JSON document (bytes) of one `Stock`
+    """
+    return _encoder.encode({'id': stock.id,
+                            'stock_symbol': stock.stock_symbol,
+                            'number_of_shares': stock.number_of_shares,
+                            'purchase_price': stock.purchase_price / 100}).encode()
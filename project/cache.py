@@ -0,0 +1,201 @@
+"""
+Caches shared by the application.
+
+`TTLCache` is a thread-safe least-recently-used (LRU) cache where every
+entry also has its own time-to-live (TTL). When the cache is full (it holds
+`maxsize` entries, or, if `maxbytes` is given, the sizes of its entries add
+up to more than `maxbytes`), the least recently used entries are evicted;
+an expired entry is treated as a miss and removed the next time it is
+looked up.
+
+`RedisCache` has the same interface, but keeps the entries in Redis, so
+they are shared by every process (e.g. all the gunicorn workers) and an
+entry deleted by one process is gone for all of them. Its values must be
+JSON serializable. The `redis` package is only needed when it is used.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# Returned by TTLCache.get() when the key is not cached (so that None can be cached)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    Class that implements an LRU cache with a per-entry time-to-live
+
+    The size of an entry is given by `sizeof(value)` (default: `len(value)`)
+    and only counted if `maxbytes` is given.
+
+    The following statistics are kept:
+        * hits - number of lookups that found a live entry
+        * misses - number of lookups that found no entry (or an expired one)
+        * evictions - number of entries removed to make room for new ones
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0, timer=time.monotonic, maxbytes=None, sizeof=len):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Total size of the entries (when `maxbytes` is given)
+        self.bytes = 0
+        # key -> (expiry time, value, size), ordered from least to most recently used
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, default=MISSING, count=True):
+        """
+        Return the cached value for `key`, or `default` if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.timer():
+                self._entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry[1]
+
+            if entry is not None:
+                self._remove(key)
+            if count:
+                self.misses += 1
+            return default
+
+    def existing(self, keys):
+        """
+        Return the set of `keys` that are cached (without counting them as
+        lookups, or marking them as recently used)
+        """
+        now = self.timer()
+        with self._lock:
+            found = set()
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    found.add(key)
+                elif entry is not None:
+                    self._remove(key)
+            return found
+
+    def set(self, key, value, ttl=None):
+        """
+        Cache `value` under `key` for `ttl` seconds (defaults to the cache's TTL)
+        """
+        expires = self.timer() + (self.ttl if ttl is None else ttl)
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        with self._lock:
+            self._remove(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                # It would evict every other entry (and still not fit)
+                return
+            self._entries[key] = (expires, value, size)
+            self.bytes += size
+            while len(self._entries) > self.maxsize or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def stats(self):
+        """
+        Return the cache statistics as a dictionary
+        """
+        return {'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
+class RedisCache:
+    """
+    Class that implements a cache with a per-entry time-to-live in Redis
+
+    Every key is prefixed with `prefix`, so several caches can share one
+    Redis database. Redis evicts the expired entries itself.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='', ttl=60.0, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError('The redis package is required for a Redis cache (pip install redis)')
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return self.get(key, count=False) is not MISSING
+
+    def get(self, key, default=MISSING, count=True):
+        value = self.client.get(self.prefix + str(key))
+        if value is None:
+            if count:
+                self.misses += 1
+            return default
+        if count:
+            self.hits += 1
+        return json.loads(value)
+
+    def existing(self, keys):
+        """
+        Return the set of `keys` that are cached, with one round trip to Redis
+        """
+        keys = list(keys)
+        pipeline = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.exists(self.prefix + str(key))
+        return {key for key, exists in zip(keys, pipeline.execute()) if exists}
+
+    def set(self, key, value, ttl=None):
+        # Redis expiry times are in milliseconds
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.prefix + str(key), json.dumps(value), px=max(1, int(ttl * 1000)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + str(key))
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def stats(self):
+        """
+        Return the cache statistics (of this process) as a dictionary
+        """
+        return {'hits': self.hits,
+                'misses': self.misses}
@@ -0,0 +1,130 @@
+"""
+Password hashing on a bounded pool of worker processes.
+
+Hashing and checking a password is deliberately slow (PBKDF2 with many
+iterations). Doing it on the request thread means a burst of logins or
+registrations ties up every worker thread of the web server, so instead the
+work is sent to a pool of processes:
+
+    * PASSWORD_HASH_WORKERS - number of worker processes (default: number of CPUs;
+      0 hashes on the request thread)
+    * PASSWORD_HASH_QUEUE_DEPTH - maximum number of hashes waiting or running in the
+      pool (default: 4 per worker); further requests fail fast with a 503 response
+    * PASSWORD_HASH_TIMEOUT - seconds to wait for a hash before giving up (default: 10)
+    * PASSWORD_HASH_ITERATIONS - PBKDF2 iterations of new hashes (default: 260000)
+
+When a user logs in with a hash that is weaker than the current setting
+(e.g. fewer iterations), the password is re-hashed with the current setting.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_ITERATIONS = 260000
+
+
+class PasswordHasherBusy(Exception):
+    """
+    Raised when the password hashing pool is full (or too slow) to take another password
+    """
+
+
+class PasswordHasher:
+    """
+    Class that hashes and checks passwords on a bounded process pool
+
+    Until `init_app()` is called (e.g. when a `User` is created outside of the
+    application), passwords are hashed on the calling thread.
+    """
+
+    def __init__(self):
+        self.workers = 0
+        self.queue_depth = 0
+        self.timeout = 10.0
+        self.iterations = DEFAULT_ITERATIONS
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.configure(workers=app.config.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1),
+                       queue_depth=app.config.get('PASSWORD_HASH_QUEUE_DEPTH'),
+                       timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 10.0),
+                       iterations=app.config.get('PASSWORD_HASH_ITERATIONS', DEFAULT_ITERATIONS))
+        app.extensions['password_hasher'] = self
+
+    def configure(self, workers, queue_depth=None, timeout=10.0, iterations=DEFAULT_ITERATIONS):
+        with self._lock:
+            self._shutdown()
+            self.workers = workers
+            self.queue_depth = queue_depth if queue_depth is not None else workers * 4
+            self.timeout = timeout
+            self.iterations = iterations
+            self._slots = threading.BoundedSemaphore(self.queue_depth) if workers else None
+
+    @property
+    def method(self):
+        return f'pbkdf2:sha256:{self.iterations}'
+
+    def hash(self, password_plaintext):
+        return self._run(generate_password_hash, password_plaintext, self.method)
+
+    def check(self, password_hashed, password_plaintext):
+        return self._run(check_password_hash, password_hashed, password_plaintext)
+
+    def needs_rehash(self, password_hashed):
+        """
+        Return True if `password_hashed` is weaker than the hashes created with the current setting
+        """
+        method = password_hashed.split('$', 1)[0]
+        parts = method.split(':')
+        if len(parts) != 3 or parts[0] != 'pbkdf2' or parts[1] != 'sha256':
+            return True
+        try:
+            return int(parts[2]) < self.iterations
+        except ValueError:
+            return True
+
+    def shutdown(self):
+        with self._lock:
+            self._shutdown()
+
+    def _run(self, function, *args):
+        # The slot is released to the semaphore it was taken from, even if
+        # `configure()` replaces the semaphore while the password is hashed
+        slots = self._slots
+        if slots is None:
+            return function(*args)
+
+        # Reject the work straight away if the pool already has a full queue
+        if not slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Too many passwords are being hashed, please try again later')
+        try:
+            future = self._get_executor().submit(function, *args)
+        except Exception:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy('Password hashing timed out, please try again later')
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # The pool is created on first use (so after a web server worker has forked),
+                # and its processes are spawned, as forking a threaded process isn't safe
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def _shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
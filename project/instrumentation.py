@@ -0,0 +1,311 @@
+"""
+Request instrumentation for the Flask application.
+
+For every request, the following are measured:
+    * wall time of the request
+    * time spent in SQLAlchemy and number of queries (engine events)
+    * time spent rendering templates (template signals)
+    * time spent hashing and checking passwords (`timed('hash')` in the User model)
+
+The measurements are:
+    * returned in a `Server-Timing` header (SERVER_TIMING_HEADER, default: True), which
+      the browser's developer tools show for each request
+    * recorded in in-process histograms (MetricsRegistry), which are served in the
+      Prometheus text format by the '/metrics' endpoint (see below)
+    * written to the access log, as one record per request:
+
+        GET /stocks/ (stocks.list_stocks) 200 12.3ms queries=2 bytes=5120
+
+The access log is configured with:
+    * ACCESS_LOG_SAMPLE_RATE - fraction of successful requests that are logged (default: 1.0)
+    * ACCESS_LOG_LEVEL - minimum level of the access log records that are logged, as
+      a level name (in any case) or number (default: INFO); read once, by create_app
+
+The '/metrics' endpoint is configured with:
+    * METRICS_ENABLED - serve the histograms (default: False, the endpoint is
+      a 404 Not Found), as they show the endpoints and the load of the application
+    * METRICS_TOKEN - token that the scraper must send in an
+      'Authorization: Bearer <token>' header (default: None, no token needed:
+      only enable it without a token behind a proxy that doesn't expose it)
+
+Successful requests are logged at INFO, client errors (4xx) at WARNING and
+server errors (5xx) at ERROR; only the INFO records are sampled. The log
+message is formatted by the log handler, so a record that is filtered out
+by its level or by sampling costs no string formatting at all.
+"""
+import bisect
+import hmac
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_app_context, template_rendered, before_render_template, current_app, Response, \
+    abort
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Upper bounds (in seconds) of the histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """
+    Class that implements a Prometheus-style histogram with labels
+
+    For each combination of label values, the number of observations in each
+    bucket, the sum of the observations and their count are kept.
+    """
+
+    def __init__(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        # label values -> [count per bucket..., count above the last bucket, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return sum(series[:-1]) if series else 0
+
+    def render(self):
+        """
+        Return the histogram in the Prometheus text exposition format
+        """
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series_items = sorted((key, list(value)) for key, value in self._series.items())
+        for label_values, series in series_items:
+            labels = [f'{name}="{_escape_label(value)}"' for name, value in zip(self.label_names, label_values)]
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += bucket_count
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {cumulative}')
+            label_text = '{' + ','.join(labels) + '}' if labels else ''
+            lines.append(f'{self.name}_sum{label_text} {series[-1]}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return '\n'.join(lines)
+
+
+class MetricsRegistry:
+    """
+    Class that holds the histograms of the application
+    """
+
+    def __init__(self):
+        self.histograms = {}
+
+    def histogram(self, name, description, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        Return the histogram called `name`, creating it the first time
+        """
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(name, description, label_names, buckets)
+        return self.histograms[name]
+
+    def render(self):
+        return '\n'.join(histogram.render() for histogram in self.histograms.values()) + '\n'
+
+
+# ----------------
+# Timers
+# ----------------
+
+@contextmanager
+def timed(name):
+    """
+    Add the time spent in the `with` block to the `name` timer of the current request
+
+    Outside of a request (e.g. in a CLI command) nothing is recorded.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _add_time(name, time.perf_counter() - start)
+
+
+def _add_time(name, duration):
+    if has_app_context() and 'timings' in g:
+        g.timings[name] = g.timings.get(name, 0.0) + duration
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    SQLAlchemy event listener that counts the queries of the current request and starts their timer
+    """
+    if has_app_context() and 'timings' in g:
+        g.query_count += 1
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    SQLAlchemy event listener that adds the time taken by a query to the current request
+    """
+    start_times = conn.info.get('query_start_time')
+    if start_times:
+        _add_time('db', time.perf_counter() - start_times.pop())
+
+
+def _start_template_timer(sender, template, context, **extra):
+    if has_app_context() and 'timings' in g:
+        g.template_start = time.perf_counter()
+
+
+def _stop_template_timer(sender, template, context, **extra):
+    if has_app_context() and 'template_start' in g:
+        _add_time('template', time.perf_counter() - g.pop('template_start'))
+
+
+# ----------------------------
+# Registration (create_app)
+# ----------------------------
+
+def resolve_log_level(level):
+    """
+    Return the number of the logging `level` (a level name in any case, or a number)
+
+    Raises ValueError if `level` isn't a known level name.
+    """
+    if isinstance(level, int):
+        return level
+    if str(level).isdigit():
+        return int(level)
+    number = logging.getLevelName(str(level).upper())
+    if not isinstance(number, int):
+        raise ValueError(f'Invalid log level ({level})')
+    return number
+
+
+def register_instrumentation(app):
+    access_log_level = resolve_log_level(app.config.get('ACCESS_LOG_LEVEL', 'INFO'))
+    registry = MetricsRegistry()
+    app.extensions['metrics'] = registry
+    request_duration = registry.histogram('http_request_duration_seconds',
+                                          'Wall time of the requests',
+                                          ('endpoint', 'method', 'status'))
+    db_duration = registry.histogram('db_duration_seconds',
+                                     'Time spent in database queries per request',
+                                     ('endpoint',))
+    db_queries = registry.histogram('db_queries_per_request',
+                                    'Number of database queries per request',
+                                    ('endpoint',), buckets=COUNT_BUCKETS)
+    template_duration = registry.histogram('template_render_seconds',
+                                           'Time spent rendering templates per request',
+                                           ('endpoint',))
+    hash_duration = registry.histogram('password_hash_seconds',
+                                       'Time spent hashing and checking passwords per request',
+                                       ('endpoint',))
+
+    # The SQLAlchemy listeners are added to every engine (and only once per process)
+    if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    before_render_template.connect(_start_template_timer, app)
+    template_rendered.connect(_stop_template_timer, app)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.query_count = 0
+        g.timings = {}
+
+    @app.after_request
+    def record_request(response):
+        if 'request_start' not in g:
+            return response
+
+        duration = time.perf_counter() - g.request_start
+        timings = g.timings
+        endpoint = request.endpoint or 'none'
+        request_duration.observe(duration, endpoint, request.method, str(response.status_code))
+        db_duration.observe(timings.get('db', 0.0), endpoint)
+        db_queries.observe(g.query_count, endpoint)
+        template_duration.observe(timings.get('template', 0.0), endpoint)
+        if 'hash' in timings:
+            hash_duration.observe(timings['hash'], endpoint)
+
+        if app.config.get('SERVER_TIMING_HEADER', True):
+            response.headers['Server-Timing'] = _server_timing(duration, g.query_count, timings)
+
+        _log_request(app, response, duration, access_log_level)
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def metrics():
+    """
+    Return the histograms of the application in the Prometheus text format
+    """
+    if not current_app.config.get('METRICS_ENABLED', False):
+        abort(404)
+    token = current_app.config.get('METRICS_TOKEN')
+    if token is not None:
+        scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(credentials.encode(), token.encode()):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain',
+                            headers={'WWW-Authenticate': 'Bearer'})
+    return Response(current_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
+
+
+def _server_timing(duration, query_count, timings):
+    entries = [f'total;dur={duration * 1000:.1f}',
+               f'db;dur={timings.get("db", 0.0) * 1000:.1f};desc="{query_count} queries"',
+               f'tpl;dur={timings.get("template", 0.0) * 1000:.1f};desc="Template rendering"']
+    if 'hash' in timings:
+        entries.append(f'hash;dur={timings["hash"] * 1000:.1f};desc="Password hashing"')
+    return ', '.join(entries)
+
+
+def _log_request(app, response, duration, threshold):
+    """
+    Write the access log record for the current request (subject to level and sampling)
+    """
+    if response.status_code >= 500:
+        level = logging.ERROR
+    elif response.status_code >= 400:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+
+    if level < threshold or not app.logger.isEnabledFor(level):
+        return
+    sample_rate = app.config.get('ACCESS_LOG_SAMPLE_RATE', 1.0)
+    if level == logging.INFO and sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+
+    access = {'method': request.method,
+              'route': request.url_rule.rule if request.url_rule else request.path,
+              'endpoint': request.endpoint,
+              'status': response.status_code,
+              'duration_ms': duration * 1000,
+              'queries': g.query_count,
+              # Unknown (None) for streamed responses
+              'bytes': response.content_length}
+    # The dictionary is both the arguments of the message and a structured
+    # 'access' attribute of the log record
+    app.logger.log(level,
+                   '%(method)s %(route)s (%(endpoint)s) %(status)d %(duration_ms).1fms '
+                   'queries=%(queries)d bytes=%(bytes)s',
+                   access,
+                   extra={'access': access})
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,121 @@
+"""
+Non-blocking logging for the Flask application.
+
+In the asynchronous logging mode, the request threads only put log records
+on a bounded queue (QueueHandler) and a single listener thread
+(QueueListener) takes them off the queue and writes them to the log file.
+The file writes and rotation checks are therefore no longer done on the
+request path.
+
+When the queue is full, the drop policy decides what happens:
+    * 'drop_new' - the new record is discarded (default)
+    * 'drop_oldest' - the oldest queued record is discarded to make room
+    * 'block' - the request thread waits until there is room in the queue
+"""
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+DROP_POLICIES = ('drop_new', 'drop_oldest', 'block')
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler that applies a drop policy when its queue is full
+
+    The number of records that were discarded is counted in `dropped`.
+    """
+
+    def __init__(self, log_queue, drop_policy='drop_new'):
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f'Invalid drop policy ({drop_policy}), expected one of: {", ".join(DROP_POLICIES)}')
+        super().__init__(log_queue)
+        self.drop_policy = drop_policy
+        self.dropped = 0
+
+    def enqueue(self, record):
+        if self.drop_policy == 'block':
+            self.queue.put(record)
+            return
+
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if self.drop_policy == 'drop_oldest':
+                try:
+                    self.queue.get_nowait()
+                    self.queue.put_nowait(record)
+                except (queue.Empty, queue.Full):
+                    pass
+            # The new record (drop_new) or the oldest record (drop_oldest) was discarded
+            self.dropped += 1
+
+
+class BlockingSentinelQueueListener(QueueListener):
+    """
+    QueueListener that waits for room in a full queue when it is being stopped
+
+    (The base class raises `queue.Full` if the queue is full when `stop()` is called.)
+    """
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class AsyncLogging:
+    """
+    Class that moves the handlers of a logger onto a listener thread
+
+    `start()` adds a `BoundedQueueHandler` to the logger in place of the
+    handlers, and `stop()` writes out any queued records and stops the
+    listener thread. `stop()` is also registered to run when the interpreter
+    exits, so no queued records are lost on shutdown.
+    """
+
+    def __init__(self, handlers, queue_size=10000, drop_policy='drop_new'):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = BoundedQueueHandler(self.queue, drop_policy=drop_policy)
+        self.listener = BlockingSentinelQueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    @property
+    def dropped(self):
+        return self.handler.dropped
+
+    def start(self, logger):
+        logger.addHandler(self.handler)
+        self.listener.start()
+        self._started = True
+        atexit.register(self.stop)
+
+    def stop(self):
+        """
+        Flush the queued records to the handlers and stop the listener thread
+        """
+        if self._started:
+            self._started = False
+            self.listener.stop()
+            for handler in self.listener.handlers:
+                handler.flush()
+            atexit.unregister(self.stop)
+
+
+def attach_async_handlers(logger, handlers, queue_size=10000, drop_policy='drop_new'):
+    """
+    Log the records of `logger` to `handlers` through a queue and a listener thread
+    """
+    async_logging = AsyncLogging(handlers, queue_size=queue_size, drop_policy=drop_policy)
+    async_logging.start(logger)
+    return async_logging
+
+
+def create_file_handler(filename, max_bytes=16384, backup_count=20):
+    """
+    Create the rotating file handler used for the application log
+    """
+    file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+    file_formatter = logging.Formatter('%(asctime)s %(levelname)s: %(message)s [in %(filename)s:%(lineno)d]')
+    file_handler.setFormatter(file_formatter)
+    file_handler.setLevel(logging.INFO)
+    return file_handler
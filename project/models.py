@@ -1,8 +1,9 @@
 # As the database is not associated with a blueprint,
 # the file will be kept outside any blueprints
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime
 
-from project import database
+from project import database, password_hasher
+from project.instrumentation import timed
 
 
 # All models need to be defined as sub-classes of database.Model
@@ -14,6 +15,7 @@ class Stock(database.Model):
         stock symbols (type: string)
         number of shares (type: integer)
         purchase price (type: integer)
+        user ID of the owner (type: integer)
 
     Note: Due to limitation in the data types supported by SQLite, the
     purchase price is stored as an integer:
@@ -31,11 +33,32 @@ class Stock(database.Model):
     stock_symbol = database.Column(database.String, nullable=False)
     number_of_shares = database.Column(database.Integer, nullable=False)
     purchase_price = database.Column(database.Integer, nullable=False)
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_stocks_user_id_users'),
+                              nullable=False)
 
-    def __init__(self, stock_symbol: str, number_of_shares: str, purchase_price: str):
+    # Index for the queries by symbol; it also includes the shares and the price, so
+    # the portfolio totals (grouped by symbol) are read from the index alone.
+    # The portfolio of a user is read with the indexes that start with the user ID, so
+    # it costs the same however many stocks the other users have:
+    #   * (user_id, id) - the pages of the user's stocks (keyset pagination)
+    #   * (user_id, stock_symbol, ...) - the user's totals grouped by symbol (covering)
+    __table_args__ = (database.Index('ix_stocks_symbol_shares_price',
+                                     'stock_symbol', 'number_of_shares', 'purchase_price'),
+                      database.Index('ix_stocks_user_id_id', 'user_id', 'id'),
+                      database.Index('ix_stocks_user_id_symbol',
+                                     'user_id', 'stock_symbol', 'number_of_shares', 'purchase_price'))
+
+    def __init__(self, stock_symbol: str, number_of_shares: str, purchase_price: str, user_id: int):
         self.stock_symbol = stock_symbol
         self.number_of_shares = int(number_of_shares)
-        self.purchase_price = int(float(purchase_price) * 100)
+        self.purchase_price = self._convert_price_to_cents(purchase_price)
+        self.user_id = user_id
+
+    @staticmethod
+    def _convert_price_to_cents(purchase_price):
+        # Also used by the bulk insert paths, which don't create Stock objects
+        return int(float(purchase_price) * 100)
 
     def __repr__(self):
         return f'{self.stock_symbol} - {self.number_of_shares} shares purchased at ${self.purchase_price / 100}'
@@ -58,12 +81,28 @@ class User(database.Model):
     email = database.Column(database.String, unique=True)
     password_hashed = database.Column(database.String(128))
 
+    # The emails are looked up case-insensitively (e.g. when logging in), which
+    # the unique constraint on the email column can't be used for. The index is
+    # also unique, so 'A@x.com' and 'a@x.com' can't be two accounts
+    __table_args__ = (database.Index('ix_users_email_lower', database.func.lower(email), unique=True),)
+
     def __init__(self, email: str, password_plaintext: str):
-        self.email = email
+        # Email addresses are stored in lower case
+        self.email = email.lower()
         self.password_hashed = self._generate_password_hash(password_plaintext)
 
     def is_password_correct(self, password_plaintext: str):
-        return check_password_hash(self.password_hashed, password_plaintext)
+        with timed('hash'):
+            return password_hasher.check(self.password_hashed, password_plaintext)
+
+    def password_needs_rehash(self):
+        """
+        Return True if the password hash is weaker than the current hash setting
+        """
+        return password_hasher.needs_rehash(self.password_hashed)
+
+    def set_password(self, password_plaintext: str):
+        self.password_hashed = self._generate_password_hash(password_plaintext)
 
     # the @staticmethod decorator to indicate that it is a static method
     # within the User class that doesn't rely on any instance variable
@@ -71,7 +110,9 @@ class User(database.Model):
     # underscore ('_') at the start of the method name is a
     # convention in Python to indicate that the method should be considered private.
     def _generate_password_hash(password_plaintext):
-        return generate_password_hash(password_plaintext)
+        # Hashed on the password hashing pool (see project/hashing.py)
+        with timed('hash'):
+            return password_hasher.hash(password_plaintext)
 
     def __repr__(self):
         return f'<User: {self: email}>'
@@ -104,3 +145,257 @@ class User(database.Model):
         Return the user ID as a unicode string (`str`)
         """
         return str(self.id)
+
+
+class OutboxMessage(database.Model):
+    """
+    Class that represents an email waiting to be sent (or already sent)
+
+    Emails are added to this table in the same transaction as the change
+    that causes them (e.g. registering a user), and are sent by the outbox
+    worker (see project/users/outbox.py), so no email is lost if the
+    application is restarted before it is sent.
+
+    The following attributes of an email are stored in this table:
+        * recipients - email addresses, separated by commas
+        * subject, body and sender (None for the default sender)
+        * status - 'pending', 'sent' or 'failed' (gave up after the maximum number of attempts)
+        * attempts - number of failed attempts to send the email
+        * next_attempt_at - time (UTC) after which the email can be sent (or retried)
+        * claim_token - identifies the worker currently sending the email
+        * last_error - error of the last failed attempt
+    """
+    __tablename__ = 'outbox'
+
+    id = database.Column(database.Integer, primary_key=True)
+    recipients = database.Column(database.String, nullable=False)
+    subject = database.Column(database.String, nullable=False)
+    body = database.Column(database.Text, nullable=False)
+    sender = database.Column(database.String, nullable=True)
+    status = database.Column(database.String(16), nullable=False, default='pending')
+    attempts = database.Column(database.Integer, nullable=False, default=0)
+    next_attempt_at = database.Column(database.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = database.Column(database.String(32), nullable=True)
+    last_error = database.Column(database.String, nullable=True)
+    created_at = database.Column(database.DateTime, nullable=False, default=datetime.utcnow)
+    sent_at = database.Column(database.DateTime, nullable=True)
+
+    __table_args__ = (database.Index('ix_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
+    def __init__(self, recipients: list, subject: str, body: str, sender: str = None):
+        self.recipients = ','.join(recipients)
+        self.subject = subject
+        self.body = body
+        self.sender = sender
+        self.status = 'pending'
+        self.attempts = 0
+        self.next_attempt_at = datetime.utcnow()
+
+    def __repr__(self):
+        return f'<OutboxMessage: {self.subject} to {self.recipients} ({self.status})>'
+
+
+class Transaction(database.Model):
+    """
+    Class that represents a trade in the ledger of a user: a buy, a sell or a split
+
+    The following attributes of a trade are stored in this table:
+        * kind - 'buy', 'sell' or 'split'
+        * quantity - number of shares bought or sold (None for a split)
+        * price - price per share in cents (None for a split)
+        * split_to, split_from - ratio of a split (e.g. 2 and 1 for a 2-for-1 split)
+        * traded_at - time (UTC) of the trade
+
+    Trades are applied to the open lots (see project/stocks/ledger.py) in the
+    order that they are recorded (by ID), both incrementally and when the
+    ledger is rebuilt, so both give the same lots.
+    """
+    __tablename__ = 'transactions'
+
+    id = database.Column(database.Integer, primary_key=True)
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_transactions_user_id_users'),
+                              nullable=False)
+    stock_symbol = database.Column(database.String, nullable=False)
+    kind = database.Column(database.String(8), nullable=False)
+    quantity = database.Column(database.Integer, nullable=True)
+    price = database.Column(database.Integer, nullable=True)
+    split_to = database.Column(database.Integer, nullable=True)
+    split_from = database.Column(database.Integer, nullable=True)
+    traded_at = database.Column(database.DateTime, nullable=False, default=datetime.utcnow)
+
+    # The ledger is replayed one (user, symbol) at a time, in the order of the trades
+    __table_args__ = (database.Index('ix_transactions_user_id_symbol_id', 'user_id', 'stock_symbol', 'id'),)
+
+    def __repr__(self):
+        if self.kind == 'split':
+            return f'<Transaction: {self.stock_symbol} split {self.split_to}-for-{self.split_from}>'
+        return f'<Transaction: {self.kind} {self.quantity} {self.stock_symbol} at ${self.price / 100}>'
+
+
+class Lot(database.Model):
+    """
+    Class that represents an open lot: shares of a buy that haven't been sold yet
+
+    The following attributes of a lot are stored in this table:
+        * quantity - number of shares still held
+        * cost - total cost in cents of the shares still held (kept as a total
+          rather than a price per share, so that splits and partial sells don't round it)
+        * transaction_id - the buy that opened the lot (None for the single
+          merged lot of the 'average' cost method)
+    """
+    __tablename__ = 'lots'
+
+    id = database.Column(database.Integer, primary_key=True)
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_lots_user_id_users'),
+                              nullable=False)
+    stock_symbol = database.Column(database.String, nullable=False)
+    quantity = database.Column(database.Integer, nullable=False)
+    cost = database.Column(database.BigInteger, nullable=False)
+    transaction_id = database.Column(database.Integer,
+                                     database.ForeignKey('transactions.id', name='fk_lots_transaction_id_transactions'),
+                                     nullable=True)
+
+    # Lots are consumed in the order that they were opened (or the reverse for LIFO)
+    __table_args__ = (database.Index('ix_lots_user_id_symbol_id', 'user_id', 'stock_symbol', 'id'),)
+
+    def __repr__(self):
+        return f'<Lot: {self.quantity} {self.stock_symbol} costing ${self.cost / 100}>'
+
+
+class Holding(database.Model):
+    """
+    Class that represents the position of a user in one stock symbol, as kept by the ledger
+
+    The following attributes of a holding are stored in this table:
+        * shares - number of shares held (the sum of the open lots)
+        * cost_basis - cost in cents of the shares held (the sum of the open lots)
+        * realized_gain - gain (or loss) in cents of all the shares sold
+        * lot_count - number of open lots
+        * method - cost method used for the lots ('fifo', 'lifo' or 'average')
+    """
+    __tablename__ = 'holdings'
+
+    id = database.Column(database.Integer, primary_key=True)
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_holdings_user_id_users'),
+                              nullable=False)
+    stock_symbol = database.Column(database.String, nullable=False)
+    shares = database.Column(database.Integer, nullable=False, default=0)
+    cost_basis = database.Column(database.BigInteger, nullable=False, default=0)
+    realized_gain = database.Column(database.BigInteger, nullable=False, default=0)
+    lot_count = database.Column(database.Integer, nullable=False, default=0)
+    method = database.Column(database.String(8), nullable=False)
+
+    __table_args__ = (database.UniqueConstraint('user_id', 'stock_symbol', name='uq_holdings_user_id_symbol'),)
+
+    def __repr__(self):
+        return f'<Holding: {self.shares} {self.stock_symbol} costing ${self.cost_basis / 100}>'
+
+
+class PositionSummary(database.Model):
+    """
+    Class that represents the totals of the stocks of a user in one stock symbol
+
+    The summaries are kept up to date in the same transaction as the stocks
+    that are added (see project/stocks/summary.py), so the pages that show
+    totals read them rather than aggregating every `Stock` row.
+
+    The totals are stored as big integers, as they can outgrow a 32-bit integer.
+
+    The following attributes of a position are stored in this table:
+        * number_of_shares - total number of shares
+        * cost_basis - total purchase cost in cents
+        * lot_count - number of stocks (purchases) in the position
+    """
+    __tablename__ = 'position_summaries'
+
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_position_summaries_user_id_users'),
+                              primary_key=True)
+    stock_symbol = database.Column(database.String, primary_key=True)
+    number_of_shares = database.Column(database.BigInteger, nullable=False, default=0)
+    cost_basis = database.Column(database.BigInteger, nullable=False, default=0)
+    lot_count = database.Column(database.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PositionSummary: {self.number_of_shares} {self.stock_symbol} costing ${self.cost_basis / 100}>'
+
+
+class PortfolioSummary(database.Model):
+    """
+    Class that represents the totals of the portfolio of a user (one row per user)
+
+    The following attributes of a portfolio are stored in this table:
+        * position_count - number of stock symbols held
+        * lot_count - number of stocks (purchases)
+        * number_of_shares - total number of shares
+        * cost_basis - total purchase cost in cents
+        * version - number of changes of the portfolio (the ETag of the portfolio pages)
+        * updated_at - time (UTC) the portfolio last changed (their Last-Modified)
+    """
+    __tablename__ = 'portfolio_summaries'
+
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_portfolio_summaries_user_id_users'),
+                              primary_key=True)
+    position_count = database.Column(database.Integer, nullable=False, default=0)
+    lot_count = database.Column(database.Integer, nullable=False, default=0)
+    number_of_shares = database.Column(database.BigInteger, nullable=False, default=0)
+    cost_basis = database.Column(database.BigInteger, nullable=False, default=0)
+    version = database.Column(database.Integer, nullable=False, default=0)
+    updated_at = database.Column(database.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<PortfolioSummary: {self.position_count} positions costing ${self.cost_basis / 100}>'
+
+
+class PortfolioSnapshot(database.Model):
+    """
+    Class that represents the value of the portfolio of a user at the end of a day
+
+    The snapshots are written by 'flask stocks snapshot' (see
+    project/stocks/snapshots.py), so the history of the value of a portfolio
+    is read from this table rather than revalued from the price history.
+
+    The following attributes of a snapshot are stored in this table:
+        * day - the day of the closing prices
+        * market_value - value of the shares held at the end of the day, in cents
+        * position_count - number of stock symbols held at the end of the day
+    """
+    __tablename__ = 'portfolio_snapshots'
+
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_portfolio_snapshots_user_id_users'),
+                              primary_key=True)
+    day = database.Column(database.Date, primary_key=True)
+    market_value = database.Column(database.BigInteger, nullable=False)
+    position_count = database.Column(database.Integer, nullable=False)
+
+    def __repr__(self):
+        return f'<PortfolioSnapshot: ${self.market_value / 100} on {self.day}>'
+
+
+class SnapshotState(database.Model):
+    """
+    Class that represents how far the snapshots of a user are up to date (one row per user)
+
+    The following attributes are stored in this table:
+        * last_day - the last day with a snapshot
+        * transaction_id - the last transaction (trade) of the user included in the snapshots
+        * summary_updated_at - the `PortfolioSummary.updated_at` included in the snapshots
+        * updated_at - time (UTC) the snapshots were last written
+    """
+    __tablename__ = 'snapshot_states'
+
+    user_id = database.Column(database.Integer,
+                              database.ForeignKey('users.id', name='fk_snapshot_states_user_id_users'),
+                              primary_key=True)
+    last_day = database.Column(database.Date, nullable=True)
+    transaction_id = database.Column(database.Integer, nullable=True)
+    summary_updated_at = database.Column(database.DateTime, nullable=True)
+    updated_at = database.Column(database.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<SnapshotState: user {self.user_id} up to {self.last_day}>'
@@ -0,0 +1,446 @@
+"""
+Analytics of the portfolio of a user over the price history.
+
+The closing prices of the holdings (and of the benchmark symbol) are read
+from the price history store (see project/stocks/history.py) and aligned
+into one price matrix (days x symbols), then every metric is computed with
+batched NumPy operations over the whole matrix, never with a Python loop
+over days or holdings:
+
+    * time-weighted return - the daily returns of the portfolio value, net of
+      the money added or taken out, chained together
+    * money-weighted return - the rate (IRR) at which the money put in grows
+      to the final value of the portfolio (annualized for periods over a year)
+    * rolling volatility - annualized standard deviation of the daily returns
+      over a moving window (ANALYTICS_WINDOW, default: 21 days)
+    * max drawdown - largest fall from a previous peak
+    * beta - against the benchmark symbol (ANALYTICS_BENCHMARK, default: 'SPY')
+    * correlation matrix - of the daily returns of the holdings
+
+The portfolio has two sources, which are added together:
+    * the stocks table (the stocks added with the pages, the CLI and the API),
+      whose positions have no trade date: they are held over the whole
+      period, without cash flows
+    * the ledger (project/stocks/ledger.py), whose trades are dated: the
+      shares change on the day of each trade, and buys and sells are cash
+      flows of the money-weighted return (a split only applies to the shares
+      of the ledger)
+Each source is authoritative for its own positions: adding a stock doesn't
+record a trade, and recording a trade doesn't change the stocks table.
+
+Days without a price for a symbol (e.g. a holiday on its exchange) use the
+last price before them; the days before the history of a symbol starts use
+its first price, so the symbol's value is flat until then. Holdings without
+any price history are left out (and listed as `missing`).
+"""
+import math
+
+import numpy as np
+from sqlalchemy import select
+
+from project import database
+from project.models import Transaction
+from .history import to_day
+from .summary import load_position_summaries
+
+TRADING_DAYS = 252
+
+
+class PriceMatrix:
+    """
+    Class that holds the closing prices of several symbols aligned on the same days
+
+    The following attributes are available:
+        * days - int array of the days (days since 1970-01-01), sorted
+        * symbols - the symbols of the columns
+        * prices - float array (days x symbols) of the closing prices in cents
+        * missing - the symbols without any price history in the range
+    """
+
+    def __init__(self, days, symbols, prices, missing=()):
+        self.days = days
+        self.symbols = list(symbols)
+        self.prices = prices
+        self.missing = list(missing)
+
+    @property
+    def dates(self):
+        return self.days.astype('datetime64[D]')
+
+
+def load_price_matrix(store, symbols, start=None, end=None):
+    """
+    Read the prices of `symbols` between `start` and `end` from the price
+    history `store`, and align them on the days that any of them has a price
+    """
+    series = []
+    missing = []
+    for symbol in symbols:
+        symbol_series = store.read(symbol, start, end)
+        if len(symbol_series):
+            series.append(symbol_series)
+        else:
+            missing.append(symbol)
+
+    if not series:
+        return PriceMatrix(np.empty(0, dtype=np.int64), [], np.empty((0, 0)), missing)
+
+    days = np.unique(np.concatenate([symbol_series.days for symbol_series in series])).astype(np.int64)
+    prices = np.full((len(days), len(series)), np.nan)
+    for column, symbol_series in enumerate(series):
+        if len(symbol_series) == len(days):
+            # A price on every day (the usual case), so no search is needed
+            prices[:, column] = symbol_series.closes
+        else:
+            prices[np.searchsorted(days, symbol_series.days), column] = symbol_series.closes
+    return PriceMatrix(days, [symbol_series.symbol for symbol_series in series], fill_gaps(prices), missing)
+
+
+def fill_gaps(prices):
+    """
+    Fill the missing prices (NaN) of each column with the last price before
+    them, or with the first price for the days before the first one (in place)
+    """
+    # Only the columns with gaps are filled (usually few of them, or none)
+    columns = np.flatnonzero(np.isnan(prices).any(axis=0))
+    if not len(columns):
+        return prices
+    gaps = prices[:, columns]
+    present = ~np.isnan(gaps)
+    rows = np.arange(len(gaps))[:, np.newaxis]
+    # Index of the last row with a price, up to each row (forward fill)
+    last_present = np.maximum.accumulate(np.where(present, rows, 0), axis=0)
+    # ...and the first row with a price for the rows before it (backward fill)
+    first_present = present.argmax(axis=0)
+    source = np.where(rows < first_present, first_present, last_present)
+    prices[:, columns] = gaps[source, np.arange(len(columns))]
+    return prices
+
+
+# ----------------------
+# Metrics
+# ----------------------
+
+def daily_returns(values):
+    """
+    Return the daily returns of `values` (a series, or one series per column)
+    """
+    previous = values[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(previous != 0, values[1:] / previous - 1.0, 0.0)
+
+
+def rolling_volatility(returns, window):
+    """
+    Return the annualized volatility of `returns` over each moving window of `window` days
+
+    The sums over each window are taken from cumulative sums, so the cost
+    doesn't depend on the size of the window.
+    """
+    if len(returns) < window or window < 2:
+        return np.empty((0,) + returns.shape[1:])
+    zero = np.zeros((1,) + returns.shape[1:])
+    sums = np.concatenate([zero, np.cumsum(returns, axis=0)])
+    squares = np.concatenate([zero, np.cumsum(returns * returns, axis=0)])
+    window_sum = sums[window:] - sums[:-window]
+    window_squares = squares[window:] - squares[:-window]
+    variance = (window_squares - window_sum * window_sum / window) / (window - 1)
+    return np.sqrt(np.maximum(variance, 0.0) * TRADING_DAYS)
+
+
+def volatility(returns):
+    """
+    Return the annualized volatility of `returns` (of each column)
+    """
+    if len(returns) < 2:
+        return np.zeros(returns.shape[1:]) if returns.ndim > 1 else 0.0
+    return returns.std(axis=0, ddof=1) * math.sqrt(TRADING_DAYS)
+
+
+def max_drawdown(values):
+    """
+    Return the max drawdown of `values` (of each column), as a negative fraction of the peak
+    """
+    if len(values) == 0:
+        return np.zeros(values.shape[1:]) if values.ndim > 1 else 0.0
+    peaks = np.maximum.accumulate(values, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdowns = np.where(peaks > 0, values / peaks - 1.0, 0.0)
+    return drawdowns.min(axis=0)
+
+
+def beta(returns, benchmark_returns):
+    """
+    Return the beta of `returns` (of each column) against `benchmark_returns`
+    """
+    if len(benchmark_returns) < 2:
+        return np.full(returns.shape[1:], np.nan) if returns.ndim > 1 else math.nan
+    benchmark = benchmark_returns - benchmark_returns.mean()
+    centered = returns - returns.mean(axis=0)
+    variance = benchmark @ benchmark
+    if variance == 0:
+        return np.full(returns.shape[1:], np.nan) if returns.ndim > 1 else math.nan
+    return (benchmark @ centered) / variance
+
+
+def correlation_matrix(returns):
+    """
+    Return the correlation matrix of the columns of `returns`
+    (NaN for a column whose returns don't vary)
+    """
+    if len(returns) < 2:
+        return np.full((returns.shape[1], returns.shape[1]), np.nan)
+    centered = returns - returns.mean(axis=0)
+    norms = np.sqrt((centered * centered).sum(axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        normalized = centered / norms
+        correlation = normalized.T @ normalized
+    return np.clip(correlation, -1.0, 1.0)
+
+
+def net_returns(values, flows):
+    """
+    Return the daily returns of the portfolio `values`, net of `flows[t]`,
+    the money added (positive) or taken out on day t
+    """
+    previous = values[:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(previous != 0, (values[1:] - flows[1:]) / previous - 1.0, 0.0)
+
+
+def time_weighted_return(returns):
+    """
+    Return the time-weighted return of the daily `returns` (net of the cash flows) chained together
+    """
+    return float(np.prod(1.0 + returns) - 1.0)
+
+
+def money_weighted_return(days, values, flows, iterations=100):
+    """
+    Return the money-weighted return (IRR) of the portfolio `values` on
+    `days`, where `flows[t]` is the money added (positive) or taken out on day t
+
+    The initial value and the flows are paid in, and the final value is paid
+    out. The rate is solved for the whole period (so a short period can't
+    overflow), with Newton's method on the vector of cash flows (falling back
+    to bisection if it doesn't converge), and annualized if the period is
+    longer than a year.
+    """
+    if len(values) < 2 or days[-1] == days[0]:
+        return 0.0
+    cash_flows = -flows.astype(float)
+    cash_flows[0] = -values[0]
+    cash_flows[-1] += values[-1]
+    used = cash_flows != 0
+    cash_flows = cash_flows[used]
+    # Time of each cash flow as a fraction of the period
+    times = (days[used] - days[0]) / (days[-1] - days[0])
+    if not (cash_flows < 0).any() or not (cash_flows > 0).any():
+        return math.nan
+
+    def npv(rate):
+        return float(cash_flows @ (1.0 + rate) ** -times)
+
+    rate = None
+    guess = 0.0
+    for _ in range(iterations):
+        discount = (1.0 + guess) ** -times
+        derivative = -(cash_flows * times) @ (discount / (1.0 + guess))
+        if derivative == 0:
+            break
+        new_guess = guess - (cash_flows @ discount) / derivative
+        if new_guess <= -1.0 or not math.isfinite(new_guess):
+            break
+        if abs(new_guess - guess) < 1e-12:
+            rate = new_guess
+            break
+        guess = new_guess
+
+    if rate is None:
+        low, high = -0.999999, 1e6
+        if npv(low) * npv(high) > 0:
+            return math.nan
+        for _ in range(iterations):
+            middle = (low + high) / 2
+            if npv(low) * npv(middle) <= 0:
+                high = middle
+            else:
+                low = middle
+        rate = (low + high) / 2
+
+    years = (days[-1] - days[0]) / 365.25
+    return float((1.0 + rate) ** (1.0 / years) - 1.0) if years > 1 else float(rate)
+
+
+# ----------------------
+# Portfolio
+# ----------------------
+
+class PortfolioAnalytics:
+    """
+    Class that computes the analytics of a portfolio from its price matrix and the shares held on each day
+
+    `shares` is an array (days x symbols) of the shares held at the end of
+    each day, and `flows` the money added to (positive) or taken out of the
+    portfolio on each day, in cents.
+    """
+
+    def __init__(self, matrix, shares, flows, benchmark=None, benchmark_prices=None, window=21):
+        self.matrix = matrix
+        self.benchmark = benchmark
+        self.window = window
+
+        prices = matrix.prices
+        self.values = (prices * shares).sum(axis=1)
+        self.returns = daily_returns(prices)
+        self.portfolio_returns = net_returns(self.values, flows)
+
+        self.time_weighted_return = time_weighted_return(self.portfolio_returns)
+        self.money_weighted_return = money_weighted_return(matrix.days, self.values, flows)
+        self.volatility = float(volatility(self.portfolio_returns))
+        self.rolling_volatility = rolling_volatility(self.portfolio_returns, window)
+        self.max_drawdown = float(max_drawdown(self.values))
+        self.holding_returns = (prices[-1] / prices[0] - 1.0) if len(prices) else np.zeros(0)
+        self.holding_volatility = volatility(self.returns)
+        self.holding_max_drawdown = max_drawdown(prices)
+        self.correlation = correlation_matrix(self.returns)
+
+        self.beta = math.nan
+        self.holding_beta = np.full(len(matrix.symbols), np.nan)
+        if benchmark_prices is not None:
+            benchmark_returns = daily_returns(benchmark_prices)
+            self.beta = float(beta(self.portfolio_returns, benchmark_returns))
+            self.holding_beta = beta(self.returns, benchmark_returns)
+
+    def holdings(self):
+        """
+        Yield one dictionary per holding (for templates)
+        """
+        for index, symbol in enumerate(self.matrix.symbols):
+            yield {'stock_symbol': symbol,
+                   'total_return': _number(self.holding_returns[index]),
+                   'volatility': _number(self.holding_volatility[index]),
+                   'max_drawdown': _number(self.holding_max_drawdown[index]),
+                   'beta': _number(self.holding_beta[index])}
+
+    def to_dict(self):
+        """
+        Return the analytics as a dictionary of JSON types (NaN becomes None)
+        """
+        dates = [str(day) for day in self.matrix.dates]
+        return {
+            'start': dates[0] if dates else None,
+            'end': dates[-1] if dates else None,
+            'days': len(dates),
+            'benchmark': self.benchmark,
+            'time_weighted_return': _number(self.time_weighted_return),
+            'money_weighted_return': _number(self.money_weighted_return),
+            'volatility': _number(self.volatility),
+            'max_drawdown': _number(self.max_drawdown),
+            'beta': _number(self.beta),
+            'rolling_volatility': {'window': self.window,
+                                   'dates': dates[self.window:],
+                                   'values': _numbers(self.rolling_volatility)},
+            'values': {'dates': dates, 'values': _numbers(self.values / 100)},
+            'holdings': list(self.holdings()),
+            'missing': self.matrix.missing,
+            'correlation': {'symbols': self.matrix.symbols,
+                            'matrix': [_numbers(row) for row in self.correlation]},
+        }
+
+
+def get_portfolio_symbols(user_id):
+    """
+    Return the symbols of the portfolio of the user `user_id`: the symbols
+    of their stocks and of their trades
+    """
+    symbols = database.session.scalars(select(Transaction.stock_symbol)
+                                       .where(Transaction.user_id == user_id)
+                                       .distinct()).all()
+    return sorted(set(symbols) | set(load_position_summaries(user_id).symbols))
+
+
+def load_share_matrix(user_id, matrix):
+    """
+    Return the shares of the user `user_id` held at the end of each day of
+    `matrix` (days x symbols), and the money added to the portfolio each day
+
+    The current positions of the stocks table are held on every day, plus
+    the shares of the trades recorded in the ledger up to each day (a trade
+    on or before the first day is part of the holdings at the start, not a
+    cash flow).
+    """
+    days = matrix.days
+    columns = {symbol: index for index, symbol in enumerate(matrix.symbols)}
+    flows = np.zeros(len(days))
+    trades = database.session.execute(select(Transaction.stock_symbol, Transaction.kind, Transaction.quantity,
+                                             Transaction.price, Transaction.split_to, Transaction.split_from,
+                                             Transaction.traded_at)
+                                      .where(Transaction.user_id == user_id)
+                                      .order_by(Transaction.id)).all()
+    if not len(days):
+        return np.zeros((0, len(columns))), flows
+    positions = load_position_summaries(user_id)
+    shares = np.zeros(len(columns))
+    for symbol, number_of_shares in zip(positions.symbols, positions.number_of_shares):
+        if symbol in columns:
+            shares[columns[symbol]] = number_of_shares
+    if not trades:
+        return np.broadcast_to(shares, (len(days), len(columns))), flows
+
+    # The change of the shares of each symbol on each day; a split changes
+    # the shares held at the time, so the trades are applied in order
+    changes = np.zeros((len(days), len(columns)))
+    held = np.zeros(len(columns))
+    for symbol, kind, quantity, price, split_to, split_from, traded_at in trades:
+        day = to_day(traded_at)
+        if symbol not in columns or day > days[-1]:
+            continue
+        column = columns[symbol]
+        row = int(np.searchsorted(days, day))
+        if kind == 'split':
+            change = held[column] * split_to // split_from - held[column]
+        else:
+            change = quantity if kind == 'buy' else -quantity
+            if row > 0:
+                flows[row] += change * price
+        held[column] += change
+        changes[row, column] += change
+    return shares + np.cumsum(changes, axis=0), flows
+
+
+def analyze_portfolio(user_id, store, symbols, start=None, end=None, benchmark=None, window=21):
+    """
+    Compute the `PortfolioAnalytics` of the user `user_id` holding `symbols`,
+    from the price history `store` between `start` and `end`
+    """
+    load_symbols = list(symbols)
+    if benchmark and benchmark not in load_symbols:
+        load_symbols.append(benchmark)
+    matrix = load_price_matrix(store, load_symbols, start, end)
+
+    benchmark_prices = None
+    if benchmark in matrix.symbols:
+        column = matrix.symbols.index(benchmark)
+        benchmark_prices = matrix.prices[:, column]
+        if benchmark not in symbols:
+            # The benchmark was only loaded to be compared against
+            keep = [index for index in range(len(matrix.symbols)) if index != column]
+            matrix = PriceMatrix(matrix.days, [matrix.symbols[index] for index in keep],
+                                 matrix.prices[:, keep], matrix.missing)
+    elif benchmark in matrix.missing and benchmark not in symbols:
+        matrix.missing.remove(benchmark)
+
+    shares, flows = load_share_matrix(user_id, matrix)
+    return PortfolioAnalytics(matrix, shares, flows, benchmark, benchmark_prices, window)
+
+
+def _number(value):
+    value = float(value)
+    return None if math.isnan(value) or math.isinf(value) else value
+
+
+def _numbers(values):
+    # NaN isn't valid JSON, so it becomes None (null)
+    values = np.asarray(values, dtype=float)
+    return [None if math.isnan(value) else value for value in values.tolist()]
@@ -0,0 +1,83 @@
+"""
+Conditional GET (ETag and Last-Modified) for the portfolio pages.
+
+The version of a user's portfolio is kept in their summary row
+(`PortfolioSummary.version`, bumped by every write of their stocks, and
+`updated_at`, see project/stocks/summary.py), so whether a page the
+browser already has is still current is known from one primary key lookup:
+
+    ETag          - "<user ID>.<version>.<updated_at>" (plus the quote window, see below)
+    Last-Modified - the time the portfolio last changed
+
+A request whose If-None-Match (or If-Modified-Since) matches gets an empty
+304 Not Modified response, without the stocks being queried or the page
+being rendered. The responses are marked `private, no-cache`, so the
+browser (and no shared cache) keeps them and asks again every time.
+
+The stocks page also shows the market prices, which change without the
+portfolio changing: when a quote provider is configured, its ETag also
+holds the number of the current QUOTES_TTL window, and its Last-Modified is
+at least the start of that window, so a copy is never reused for longer
+than the quotes are cached anyway.
+
+A page that shows flashed messages is always rendered (the messages are
+only removed from the session when they are shown) and is sent without
+validators, so the browser never shows the messages again from its copy.
+"""
+import time
+from datetime import datetime
+from functools import wraps
+
+from flask import current_app, request, session, make_response
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+from .quotes import get_quote_cache
+from .summary import get_portfolio_summary
+
+
+def get_portfolio_validators(user_id, quotes=False):
+    """
+    Return the ETag and the Last-Modified time of the pages of the portfolio of the user `user_id`
+
+    With `quotes`, the validators also change with each QUOTES_TTL window (if a quote provider is configured).
+    """
+    summary = get_portfolio_summary(user_id)
+    version = summary.version if summary is not None else 0
+    last_modified = summary.updated_at if summary is not None else None
+    etag = f'{user_id}.{version}.{int(last_modified.timestamp() * 1000000) if last_modified else 0}'
+
+    if quotes and get_quote_cache() is not None:
+        ttl = max(1, int(current_app.config.get('QUOTES_TTL', 60.0)))
+        window = int(time.time()) // ttl
+        etag = f'{etag}.{window}'
+        window_start = datetime.utcfromtimestamp(window * ttl)
+        last_modified = max(last_modified, window_start) if last_modified else window_start
+    return etag, last_modified
+
+
+def conditional_portfolio(quotes=False):
+    """
+    Decorator for the views of the pages of the current user's portfolio
+    that answers the conditional GET requests (304 Not Modified) without
+    calling the view, and adds the validators to the responses of the view
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if '_flashes' in session:
+                return view(*args, **kwargs)
+
+            etag, last_modified = get_portfolio_validators(current_user.id, quotes=quotes)
+            if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.private = True
+            response.cache_control.no_cache = True
+            response.vary.add('Cookie')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,90 @@
+"""
+Streaming export of stocks as CSV or NDJSON (newline-delimited JSON).
+
+The rows are read with `yield_per`, which fetches them from the database in
+batches (with a server-side cursor on PostgreSQL) instead of loading the
+whole result, and are encoded by generators that yield the output a batch
+of lines at a time. The memory used is the same for 10 rows or 10 million
+rows, and the first bytes are sent before the query has finished.
+
+The exported files use the same columns and units (purchase price in
+dollars) as the files read by 'flask stocks import'.
+"""
+import csv
+import io
+import json
+
+from sqlalchemy import select
+
+from project import database
+from project.models import Stock
+
+EXPORT_COLUMNS = ('stock_symbol', 'number_of_shares', 'purchase_price')
+
+
+def iter_stock_rows(query=None, batch_size=1000, user_id=None):
+    """
+    Yield (stock_symbol, number_of_shares, purchase_price in cents) rows of all
+    stocks, or of the stocks owned by `user_id`, ordered by id
+
+    Only `batch_size` rows are fetched from the database at a time.
+    """
+    if query is None:
+        query = select(Stock.stock_symbol, Stock.number_of_shares, Stock.purchase_price).order_by(Stock.id)
+        if user_id is not None:
+            query = query.where(Stock.user_id == user_id)
+    yield from database.session.execute(query.execution_options(yield_per=batch_size))
+
+
+def generate_csv(rows, lines_per_chunk=500):
+    """
+    Yield the CSV lines for `rows`, starting with the header, in chunks of `lines_per_chunk` lines
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(EXPORT_COLUMNS)
+    # Send the header straight away, before the first row is fetched
+    yield _flush(buffer)
+
+    for count, (stock_symbol, number_of_shares, purchase_price) in enumerate(rows, start=1):
+        writer.writerow((stock_symbol, number_of_shares, _format_dollars(purchase_price)))
+        if count % lines_per_chunk == 0:
+            yield _flush(buffer)
+
+    chunk = _flush(buffer)
+    if chunk:
+        yield chunk
+
+
+def generate_ndjson(rows, lines_per_chunk=500):
+    """
+    Yield one JSON object per line for `rows`, in chunks of `lines_per_chunk` lines
+    """
+    lines = []
+    for stock_symbol, number_of_shares, purchase_price in rows:
+        lines.append(json.dumps({'stock_symbol': stock_symbol,
+                                 'number_of_shares': number_of_shares,
+                                 'purchase_price': purchase_price / 100}))
+        if len(lines) == lines_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (generate_csv, 'text/csv'),
+    'ndjson': (generate_ndjson, 'application/x-ndjson'),
+}
+
+
+def _flush(buffer):
+    chunk = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
+
+
+def _format_dollars(cents):
+    return f'{cents / 100:.2f}'
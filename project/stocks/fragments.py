@@ -0,0 +1,199 @@
+"""
+Cache of the rendered rows of the stocks table.
+
+Rendering the rows of a large page of the stocks table is most of the cost
+of the stocks page, so the rendered HTML of the rows (and the cursors of
+the pages before and after it) is cached, keyed by:
+
+    * the owner of the stocks and the version of their portfolio (see
+      project/stocks/conditional.py), which changes with every write
+    * the page (per_page and the after / before cursor)
+    * a digest of the market prices of the portfolio, which the market
+      values and the weights of the rows depend on
+
+A repeated view of the same page finds its rows with one lookup, without
+querying or rendering them again.
+
+As the version of the portfolio is part of the key, a cached page is
+never shown after the stocks changed. The pages of a user are also removed
+from the cache when a change of their stocks is committed (by
+`update_summaries()`, which every write path calls: 'Add a Stock', 'flask
+stocks create', 'flask stocks create_default_set' and 'flask stocks
+import'), so they don't take up the budget of the cache until they are
+evicted.
+
+The cache is configured by the Flask application:
+    * STOCKS_FRAGMENT_CACHE - 'memory' (an LRU cache in each process, the
+      default), 'redis' (shared by every process) or 'none' (always render)
+    * STOCKS_FRAGMENT_CACHE_BYTES - maximum size of the rendered HTML in the
+      'memory' cache (default: 16 MB; use Redis' maxmemory for the 'redis' cache)
+    * STOCKS_FRAGMENT_CACHE_SIZE - maximum number of pages in the 'memory' cache (default: 1024)
+    * STOCKS_FRAGMENT_CACHE_TTL - seconds that a page is cached (default: 300)
+    * STOCKS_FRAGMENT_CACHE_REDIS_URL - Redis database of the 'redis' cache (default: redis://localhost:6379/0)
+
+With the 'redis' backend, only the pages cached by the process that
+committed the change are removed when the stocks change; the others expire
+(they can't be shown anymore, as their key has the old version).
+"""
+import hashlib
+import threading
+
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from project import database
+from project.cache import TTLCache, RedisCache, MISSING
+
+STOCK_FRAGMENT_BACKENDS = ('memory', 'redis', 'none')
+
+
+class FragmentCache:
+    """
+    Class that caches rendered fragments of pages by owner, so every
+    fragment of an owner can be removed at once
+
+    The fragments are stored in `cache` (a `TTLCache` or a `RedisCache`);
+    the keys of each owner's fragments are kept in this process.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        # owner -> keys of their fragments
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner, key):
+        return self.cache.get(f'{owner}:{key}')
+
+    def set(self, owner, key, fragment):
+        self.cache.set(f'{owner}:{key}', fragment)
+        with self._lock:
+            known_keys = self._keys.get(owner, set())
+        # The keys of the fragments that were evicted (or expired) are forgotten,
+        # checked with one lookup (one round trip to Redis) for all of them
+        keys = self.cache.existing(known_keys) if known_keys else set()
+        keys.add(f'{owner}:{key}')
+        with self._lock:
+            # (with the keys added by other threads in the meantime)
+            self._keys[owner] = keys | (self._keys.get(owner, set()) - known_keys)
+
+    def invalidate(self, owner):
+        """
+        Remove every fragment of `owner`
+        """
+        with self._lock:
+            keys = self._keys.pop(owner, ())
+        for key in keys:
+            self.cache.delete(key)
+
+    def clear(self):
+        with self._lock:
+            self._keys.clear()
+        self.cache.clear()
+
+    def stats(self):
+        return self.cache.stats()
+
+
+def create_fragment_cache(config):
+    """
+    Create the fragment cache selected by the configuration, or None if it is disabled
+    """
+    backend = config.get('STOCKS_FRAGMENT_CACHE', 'memory')
+    ttl = config.get('STOCKS_FRAGMENT_CACHE_TTL', 300.0)
+    if backend == 'memory':
+        return FragmentCache(TTLCache(maxsize=config.get('STOCKS_FRAGMENT_CACHE_SIZE', 1024),
+                                      ttl=ttl,
+                                      maxbytes=config.get('STOCKS_FRAGMENT_CACHE_BYTES', 16 * 1024 * 1024),
+                                      sizeof=_fragment_size))
+    if backend == 'redis':
+        return FragmentCache(RedisCache(config.get('STOCKS_FRAGMENT_CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+                                        prefix='stock-rows:', ttl=ttl))
+    if backend == 'none':
+        return None
+    raise ValueError(f'Invalid stocks fragment cache backend ({backend}), '
+                     f'expected one of: {", ".join(STOCK_FRAGMENT_BACKENDS)}')
+
+
+def get_fragment_cache():
+    """
+    Return the fragment cache of the current Flask application (None if it is disabled)
+
+    The cache is created the first time it is used.
+    """
+    if 'stocks_fragment_cache' not in current_app.extensions:
+        current_app.extensions['stocks_fragment_cache'] = create_fragment_cache(current_app.config)
+    return current_app.extensions['stocks_fragment_cache']
+
+
+def stock_rows_key(summary, per_page, after, before, prices):
+    """
+    Return the key of the rows of a page of the stocks table of the owner of
+    `summary` (their `PortfolioSummary`, or None), valued at `prices`
+    """
+    version = f'{summary.version}.{summary.updated_at.timestamp()}' if summary is not None else '0'
+    # The digest is the same in every process (unlike hash()), so the 'redis' cache is shared
+    digest = hashlib.blake2b(repr(sorted(prices.items())).encode(), digest_size=8).hexdigest()
+    return f'{version}:{per_page}:{after}:{before}:{digest}'
+
+
+def get_stock_rows(owner, key, render):
+    """
+    Return the cached rows of the stocks table of `owner` for `key`, or
+    the rows returned by `render()` (which are then cached)
+
+    The rows are a dictionary with the rendered HTML ('html') and the cursors
+    of the pages after and before them ('next_cursor', 'prev_cursor').
+    """
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is None:
+        return render()
+    rows = fragment_cache.get(owner, key)
+    if rows is MISSING:
+        rows = render()
+        fragment_cache.set(owner, key, rows)
+    return rows
+
+
+def _fragment_size(rows):
+    return len(rows['html'])
+
+
+# ----------------
+# Invalidation
+# ----------------
+
+def record_changed_portfolios(user_ids):
+    """
+    Remove the cached rows of the users `user_ids` (or of every user, for
+    None) when the current transaction is committed
+    """
+    database.session.info.setdefault('changed_portfolio_ids', set()).update(user_ids)
+
+
+def _invalidate_changed_portfolios(session):
+    user_ids = session.info.pop('changed_portfolio_ids', ())
+    if not user_ids or not has_app_context():
+        return
+    fragment_cache = get_fragment_cache()
+    if fragment_cache is None:
+        return
+    if None in user_ids:
+        fragment_cache.clear()
+        return
+    for user_id in user_ids:
+        fragment_cache.invalidate(user_id)
+
+
+def _discard_changed_portfolios(session, previous_transaction):
+    session.info.pop('changed_portfolio_ids', None)
+
+
+def register_fragment_cache_invalidation():
+    """
+    Remove the cached rows of the portfolios whose changes are committed (once per process)
+    """
+    if not event.contains(Session, 'after_commit', _invalidate_changed_portfolios):
+        event.listen(Session, 'after_commit', _invalidate_changed_portfolios)
+        event.listen(Session, 'after_soft_rollback', _discard_changed_portfolios)
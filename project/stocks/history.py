@@ -0,0 +1,257 @@
+"""
+Store of the daily price history (closing prices) of each stock symbol.
+
+The history is kept out of the relational database, in one binary file per
+symbol made of fixed-width records (12 bytes each), sorted by date:
+
+    day   - int32, days since 1970-01-01
+    close - int64, closing price in cents (the same as `Stock.purchase_price`)
+
+The files are memory-mapped and read as NumPy arrays without copying them,
+so reading years of history for thousands of symbols only touches the pages
+of the files that are used, and none of it is held in the Python heap:
+
+    * `PriceHistoryStore.read()` - the records between two dates, found by
+      binary search on the (sorted) days, as a view of the memory-mapped file
+    * `PriceHistoryStore.append()` - adds records at the end of a file; only
+      the records after the last stored day are written, so loading the same
+      file twice doesn't duplicate the history
+
+A record is always written whole or not at all as far as readers are
+concerned: a trailing partial record (e.g. if the process was stopped while
+appending) is ignored when the file is read, and overwritten by the next append.
+
+The directory of the store is set with PRICE_HISTORY_DIR (default: the
+'price_history' directory in the instance folder). The history is loaded
+from CSV files with 'flask stocks load-prices'.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+import numpy as np
+from flask import current_app
+
+from .importer import ImportResult
+
+# Fixed-width records, packed (no padding), little-endian
+RECORD_DTYPE = np.dtype([('day', '<i4'), ('close', '<i8')])
+
+FILE_EXTENSION = '.bin'
+
+
+class PriceHistoryError(ValueError):
+    """
+    Raised when price history can't be stored (e.g. an invalid stock symbol)
+    """
+
+
+class PriceSeries:
+    """
+    Class that holds the price history of a symbol between two dates
+
+    `days` (int32, days since 1970-01-01) and `closes` (int64, cents) are
+    views of the memory-mapped file, not copies; `dates` converts the days
+    to numpy.datetime64 values (a copy).
+    """
+
+    def __init__(self, symbol, records):
+        self.symbol = symbol
+        self.records = records
+        self.days = records['day']
+        self.closes = records['close']
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def dates(self):
+        return self.days.astype('datetime64[D]')
+
+
+def to_day(value):
+    """
+    Return the number of days since 1970-01-01 of `value` (a date, an ISO date string or a numpy.datetime64)
+    """
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        value = date.fromisoformat(value)
+    return int(np.datetime64(value, 'D').astype(np.int64))
+
+
+class PriceHistoryStore:
+    """
+    Class that stores the daily closing prices of each stock symbol in its own memory-mapped file
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        # Appends to the same file are serialized (readers never need the lock)
+        self._lock = threading.Lock()
+
+    def path(self, symbol):
+        # The symbol becomes a file name, so only the symbols accepted by StockModel are allowed
+        if not symbol or not symbol.isalpha() or not symbol.isascii() or len(symbol) > 5:
+            raise PriceHistoryError(f'Invalid stock symbol ({symbol})')
+        return os.path.join(self.directory, symbol.upper() + FILE_EXTENSION)
+
+    def symbols(self):
+        """
+        Return the (sorted) symbols that have price history
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-len(FILE_EXTENSION)] for name in os.listdir(self.directory)
+                      if name.endswith(FILE_EXTENSION))
+
+    def __contains__(self, symbol):
+        return os.path.exists(self.path(symbol))
+
+    def _map(self, symbol):
+        """
+        Return every record of `symbol` as a read-only memory-mapped array (empty if there are none)
+        """
+        path = self.path(symbol)
+        try:
+            count = os.path.getsize(path) // RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            count = 0
+        if count == 0:
+            # (a file of length 0 can't be memory-mapped)
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.memmap(path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+
+    def read(self, symbol, start=None, end=None):
+        """
+        Return the `PriceSeries` of `symbol` from `start` to `end` (both included, default: all of it)
+
+        The first and last records are found by binary search on the days,
+        which reads O(log n) records of the file.
+        """
+        records = self._map(symbol)
+        days = records['day']
+        low = 0 if start is None else bisect_left(days, to_day(start))
+        high = len(records) if end is None else bisect_right(days, to_day(end))
+        return PriceSeries(symbol.upper(), records[low:high])
+
+    def last_day(self, symbol):
+        """
+        Return the last day (days since 1970-01-01) stored for `symbol`, or None if there are none
+        """
+        records = self._map(symbol)
+        return int(records['day'][-1]) if len(records) else None
+
+    def append(self, symbol, days, closes):
+        """
+        Append the closing prices `closes` (in cents) of the days `days` to the history of `symbol`
+
+        The records are sorted by day (the last one is kept for a day given
+        more than once), and only the ones after the last stored day are
+        written. Returns the number of records written.
+        """
+        if isinstance(days, np.ndarray) and days.dtype.kind == 'M':
+            days = days.astype('datetime64[D]').astype(np.int64)
+        elif not isinstance(days, np.ndarray):
+            days = [to_day(day) for day in days]
+        days = np.asarray(days, dtype=np.int64)
+        closes = np.asarray(closes, dtype=np.int64)
+        if days.shape != closes.shape:
+            raise PriceHistoryError('The number of days and closing prices are different')
+
+        # Sort by day, keeping the last price given for each day
+        order = np.argsort(days, kind='stable')
+        days, closes = days[order], closes[order]
+        last_of_day = np.append(days[1:] != days[:-1], True) if len(days) else np.empty(0, dtype=bool)
+        days, closes = days[last_of_day], closes[last_of_day]
+
+        path = self.path(symbol)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            last_day = self.last_day(symbol)
+            if last_day is not None:
+                days, closes = days[days > last_day], closes[days > last_day]
+            if not len(days):
+                return 0
+
+            records = np.empty(len(days), dtype=RECORD_DTYPE)
+            records['day'] = days
+            records['close'] = closes
+            with open(path, 'r+b' if os.path.exists(path) else 'wb') as file:
+                # Start after the last whole record (dropping a partial record, if any)
+                file.seek(os.path.getsize(path) // RECORD_DTYPE.itemsize * RECORD_DTYPE.itemsize)
+                file.truncate()
+                file.write(records.tobytes())
+        return len(records)
+
+
+def load_prices(store, rows, symbol=None, batch_size=100000, max_errors=100):
+    """
+    Append the prices in `rows` (dictionaries with 'date', 'close' in dollars
+    and, unless `symbol` is given, 'symbol' keys) to the price history `store`
+
+    The rows are buffered per symbol and appended in batches of `batch_size`
+    rows, so the memory used doesn't depend on the size of the file. The rows
+    of a batch can be in any order, but as the history is append-only, a row
+    dated on or before a day of the symbol written by an earlier batch can't
+    be stored anymore: it is reported as an invalid row (sort the file by
+    date), rather than dropped as if it was already stored.
+    Returns an `ImportResult` describing the load.
+    """
+    result = ImportResult(max_errors=max_errors)
+    start = time.perf_counter()
+    buffers = {}
+    buffered = 0
+    # stock symbol -> last day written by the earlier batches of this load
+    written_through = {}
+
+    for row_number, row in enumerate(rows, start=1):
+        result.rows_read += 1
+        try:
+            row = {key.strip().lower(): value for key, value in row.items() if key}
+            row_symbol = (symbol or row['symbol']).strip().upper()
+            store.path(row_symbol)
+            day = to_day(row['date'].strip())
+            close = int(round(float(row['close']) * 100))
+        except (KeyError, ValueError, AttributeError, TypeError) as e:
+            result.add_error(row_number, f'Missing column {e}' if isinstance(e, KeyError) else str(e))
+            continue
+
+        if row_symbol in written_through and day <= written_through[row_symbol]:
+            result.add_error(row_number, f'Out of order: prices of {row_symbol} through '
+                                         f'{np.datetime64(written_through[row_symbol], "D")} were already written')
+            continue
+
+        days, closes = buffers.setdefault(row_symbol, ([], []))
+        days.append(day)
+        closes.append(close)
+        buffered += 1
+        if buffered >= batch_size:
+            result.rows_imported += _append_buffers(store, buffers, written_through)
+            buffered = 0
+
+    result.rows_imported += _append_buffers(store, buffers, written_through)
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _append_buffers(store, buffers, written_through):
+    count = 0
+    for symbol, (days, closes) in buffers.items():
+        count += store.append(symbol, np.asarray(days, dtype=np.int64), closes)
+        written_through[symbol] = max(written_through.get(symbol, days[0]), max(days))
+    buffers.clear()
+    return count
+
+
+def get_price_history():
+    """
+    Return the price history store of the current Flask application (PRICE_HISTORY_DIR)
+    """
+    if 'price_history' not in current_app.extensions:
+        directory = current_app.config.get('PRICE_HISTORY_DIR',
+                                           os.path.join(current_app.instance_path, 'price_history'))
+        current_app.extensions['price_history'] = PriceHistoryStore(directory)
+    return current_app.extensions['price_history']
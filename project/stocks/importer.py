@@ -0,0 +1,271 @@
+"""
+Bulk import of stocks from CSV or JSON files.
+
+The rows are streamed from the file one at a time, validated with the same
+`StockModel` used by the 'Add a Stock' form, and the valid rows are written
+with bulk INSERT statements in batches of `batch_size` rows, one transaction
+per batch. Invalid rows are reported (with their row number) without
+stopping the import.
+
+Only one batch of rows is held in memory at a time, so the memory used does
+not depend on the size of the file.
+
+Supported file formats:
+    * CSV (.csv) with a header row: stock_symbol,number_of_shares,purchase_price
+    * JSON (.json): an array of objects with the same keys
+    * NDJSON (.ndjson, .jsonl): one JSON object per line, with the same keys
+"""
+import csv
+import json
+import time
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+
+from project import database
+from project.models import Stock
+from .forms import StockModel
+from .summary import update_summaries
+
+
+class ImportResult:
+    """
+    Class that summarizes a bulk import
+
+    The following attributes are available:
+        * rows_read - number of rows read from the file
+        * rows_imported - number of valid rows written to the database
+        * error_count - number of invalid rows
+        * errors - (row number, error message) of the first `max_errors` invalid rows
+        * elapsed - time taken by the import (seconds)
+    """
+
+    def __init__(self, max_errors=100):
+        self.max_errors = max_errors
+        self.rows_read = 0
+        self.rows_imported = 0
+        self.error_count = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, row_number, message):
+        self.error_count += 1
+        # Only the first errors are kept, so that a bad file can't use unbounded memory
+        if len(self.errors) < self.max_errors:
+            self.errors.append((row_number, message))
+
+
+def read_csv_rows(file):
+    """
+    Yield one dictionary per row of a CSV file (the first row holds the column names)
+    """
+    yield from csv.DictReader(file)
+
+
+def read_ndjson_rows(file):
+    """
+    Yield one dictionary per line of a newline-delimited JSON file
+
+    A line that is not valid JSON is yielded as the `ValueError` raised when
+    decoding it, so that it is reported as an invalid row.
+    """
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                yield e
+
+
+def read_json_rows(file, chunk_size=65536, max_row_size=1048576):
+    """
+    Yield one dictionary per object of a JSON array
+
+    The file is decoded incrementally, one chunk at a time, so the whole array
+    is never loaded into memory.
+
+    An element that is not valid JSON (or is longer than `max_row_size`
+    characters) is yielded as a `ValueError`, so that it is reported as an
+    invalid row, and the reading resumes after the end of the element.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    end_of_file = False
+    # Where the end of the current element is searched from, and the state of the search
+    scan = _ElementScan()
+    while True:
+        # Skip the whitespace, commas and brackets that separate the objects
+        stripped = buffer.lstrip(' \t\r\n,[]')
+        if len(stripped) != len(buffer):
+            buffer = stripped
+            scan = _ElementScan()
+        if not buffer:
+            if end_of_file:
+                return
+            chunk = file.read(chunk_size)
+            end_of_file = not chunk
+            buffer += chunk
+            continue
+
+        try:
+            row, index = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            # Either the element is incomplete (so more of the file is read), or it is invalid:
+            # then it ends before the end of the buffer (or the file ends, or it is too long)
+            end = scan.find_end(buffer)
+            if end is None and not end_of_file and len(buffer) <= max_row_size:
+                chunk = file.read(chunk_size)
+                end_of_file = not chunk
+                buffer += chunk
+                continue
+
+            if end is not None:
+                yield ValueError(f'Invalid JSON: {e.msg}')
+                buffer = buffer[end:]
+            elif end_of_file:
+                yield ValueError(f'Invalid JSON: {e.msg}')
+                return
+            else:
+                yield ValueError(f'Row is longer than {max_row_size} characters')
+                # Skip the rest of the element, without holding it in memory
+                while end is None and buffer:
+                    buffer = file.read(chunk_size)
+                    scan.position = 0
+                    end = scan.find_end(buffer)
+                buffer = buffer[end:] if end is not None else ''
+                end_of_file = end is None
+            scan = _ElementScan()
+            continue
+
+        buffer = buffer[index:]
+        scan = _ElementScan()
+        yield row
+
+
+class _ElementScan:
+    """
+    Class that finds the end of an element of a JSON array (the ',' or ']'
+    after it, or the '}' that closes it), outside of strings
+
+    The search resumes where it stopped when more of the element is read.
+    """
+
+    def __init__(self):
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+
+    def find_end(self, text):
+        """
+        Return the index after the end of the element in `text`, or None if it doesn't end in `text`
+        """
+        for index in range(self.position, len(text)):
+            character = text[index]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif character == '\\':
+                    self.escape = True
+                elif character == '"':
+                    self.in_string = False
+            elif character == '"':
+                self.in_string = True
+            elif character == '{':
+                self.depth += 1
+            elif character == '}':
+                self.depth -= 1
+                if self.depth <= 0:
+                    return index + 1
+            elif character in ',]' and self.depth <= 0:
+                return index
+        self.position = len(text)
+        return None
+
+
+def get_row_reader(filename, file_format=None):
+    """
+    Return the row reader for `file_format` ('csv', 'json' or 'ndjson'), by default based on the file extension
+    """
+    if file_format is None:
+        extension = filename.rsplit('.', 1)[-1].lower()
+        file_format = {'jsonl': 'ndjson'}.get(extension, extension)
+    readers = {'csv': read_csv_rows, 'json': read_json_rows, 'ndjson': read_ndjson_rows}
+    if file_format not in readers:
+        raise ValueError(f'Unsupported file format ({file_format}), expected one of: csv, json, ndjson')
+    return readers[file_format]
+
+
+def import_stocks(rows, user_id, batch_size=1000, max_errors=100):
+    """
+    Validate and insert `rows` (an iterable of dictionaries) into the stocks table,
+    owned by the user `user_id`
+
+    Returns an `ImportResult` describing the import.
+    """
+    result = ImportResult(max_errors=max_errors)
+    start = time.perf_counter()
+    batch = []
+
+    for row_number, row in enumerate(rows, start=1):
+        result.rows_read += 1
+        try:
+            if isinstance(row, ValueError):
+                raise row
+            batch.append(validate_stock_row(row, user_id))
+        except (ValueError, TypeError) as e:
+            result.add_error(row_number, format_error(e))
+            continue
+
+        if len(batch) >= batch_size:
+            result.rows_imported += insert_stocks(batch)
+            batch = []
+
+    if batch:
+        result.rows_imported += insert_stocks(batch)
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def validate_stock_row(row, user_id):
+    """
+    Return the column values of the stock in `row` (a dictionary with the
+    fields of `StockModel`), owned by the user `user_id`
+
+    Raises ValueError (or TypeError) if the row is invalid.
+    """
+    if not isinstance(row, dict):
+        raise TypeError('Row must be an object with the stock data')
+    stock_data = StockModel(**row)
+    return {'stock_symbol': stock_data.stock_symbol,
+            'number_of_shares': stock_data.number_of_shares,
+            'purchase_price': Stock._convert_price_to_cents(stock_data.purchase_price),
+            'user_id': user_id}
+
+
+def insert_stocks(rows):
+    """
+    Insert `rows` (dictionaries of column values) with one bulk INSERT and commit
+    them, together with the totals of the rows in the owners' portfolio summaries
+
+    No `Stock` objects are created; the rows are passed straight to the database driver.
+    """
+    database.session.execute(insert(Stock), rows)
+    update_summaries(rows)
+    database.session.commit()
+    return len(rows)
+
+
+def format_error(error):
+    """
+    Return the message of the validation `error` of a row
+    """
+    if isinstance(error, ValidationError):
+        return '; '.join(f'{".".join(str(field) for field in item["loc"])}: {item["msg"]}'
+                         for item in error.errors())
+    return str(error)
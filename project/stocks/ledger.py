@@ -0,0 +1,418 @@
+"""
+Ledger of the trades of each user (buys, sells and splits) with incremental lot accounting.
+
+Every trade is stored in the `transactions` table, and applied straight away
+to the open lots (`lots` table) and the holding (`holdings` table) of its
+user and stock symbol, so the positions never have to be rebuilt from the
+whole history when they are displayed:
+
+    * buy   - opens a new lot (or, with the 'average' cost method, is merged into the single lot)
+    * sell  - takes the shares from the open lots, in the order of the cost
+              method, and adds the gain (sale proceeds - cost of the shares) to
+              the realized gain of the holding
+    * split - multiplies the shares of every open lot by the split ratio
+              (fractional shares are dropped; the cost of a lot is unchanged)
+
+Cost methods (LEDGER_COST_METHOD, default: 'fifo'):
+    * fifo - the oldest lots are sold first
+    * lifo - the newest lots are sold first
+    * average - every buy is merged into one lot, so shares are sold at the average cost
+
+A buy only writes one lot and a sell only reads (and updates) the lots that
+it sells from, so the cost of a trade is O(lots touched), not O(trades). A
+split touches every open lot of the symbol with one UPDATE.
+
+The cost method of a holding is kept with the holding, as the lots depend on
+it; changing LEDGER_COST_METHOD applies to the holdings created afterwards,
+and to the existing ones once the ledger is rebuilt ('flask stocks rebuild-ledger').
+
+The ledger is kept apart from the stocks table: adding a stock (with the
+pages, the CLI or the API) doesn't record a trade. The analytics and the
+snapshots of a portfolio add up both (see project/stocks/analytics.py).
+
+All amounts are in cents, the same as `Stock.purchase_price`.
+"""
+import time
+from collections import deque
+from itertools import groupby
+from operator import itemgetter
+
+from flask import current_app
+from sqlalchemy import select, insert, update, delete, func
+
+from project import database
+from project.models import Transaction, Lot, Holding
+from .valuation import Positions
+
+COST_METHODS = ('fifo', 'lifo', 'average')
+TRADE_KINDS = ('buy', 'sell', 'split')
+
+# Number of lots fetched from the database at a time when selling
+LOT_FETCH_SIZE = 32
+
+
+class LedgerError(ValueError):
+    """
+    Raised when a trade can't be applied to the ledger (e.g. selling more shares than are held)
+    """
+
+
+class OpenLot:
+    """
+    Class that holds an open lot in memory (used when the ledger is rebuilt)
+    """
+    __slots__ = ('quantity', 'cost', 'transaction_id')
+
+    def __init__(self, quantity, cost, transaction_id=None):
+        self.quantity = quantity
+        self.cost = cost
+        self.transaction_id = transaction_id
+
+
+def take_shares(lots, quantity):
+    """
+    Take `quantity` shares from `lots` (an iterable of lots, in the order they are sold from)
+
+    A lot that is partly sold is updated in place (its cost is reduced in
+    proportion to the shares taken). Returns the cost of the shares taken and
+    the list of lots that were emptied (to be removed by the caller).
+
+    The lots are only iterated until enough shares are taken, so a database
+    result is only read as far as the lots that are touched.
+    """
+    cost = 0
+    emptied = []
+    remaining = quantity
+    lots = iter(lots)
+    while remaining > 0:
+        lot = next(lots, None)
+        if lot is None:
+            raise LedgerError(f'Not enough shares to sell ({quantity - remaining} of {quantity} available)')
+        if lot.quantity <= remaining:
+            remaining -= lot.quantity
+            cost += lot.cost
+            emptied.append(lot)
+        else:
+            taken = lot.cost * remaining // lot.quantity
+            lot.quantity -= remaining
+            lot.cost -= taken
+            cost += taken
+            remaining = 0
+    return cost, emptied
+
+
+class LotBook:
+    """
+    Class that holds the open lots of one stock symbol in memory, in the order that they were opened
+
+    This is the same accounting as `record_trade()`, used to replay the
+    trades when the ledger is rebuilt without a database round trip per trade.
+    """
+    __slots__ = ('method', 'lots', 'shares', 'cost_basis', 'realized_gain')
+
+    def __init__(self, method='fifo'):
+        self.method = method
+        self.lots = deque()
+        self.shares = 0
+        self.cost_basis = 0
+        self.realized_gain = 0
+
+    def buy(self, quantity, price, transaction_id=None):
+        if self.method == 'average':
+            if self.lots:
+                lot = self.lots[0]
+                lot.quantity += quantity
+                lot.cost += quantity * price
+            else:
+                self.lots.append(OpenLot(quantity, quantity * price))
+        else:
+            self.lots.append(OpenLot(quantity, quantity * price, transaction_id))
+        self.shares += quantity
+        self.cost_basis += quantity * price
+
+    def sell(self, quantity, price):
+        if quantity > self.shares:
+            raise LedgerError(f'Not enough shares to sell ({self.shares} of {quantity} available)')
+        lots = reversed(self.lots) if self.method == 'lifo' else self.lots
+        cost, emptied = take_shares(lots, quantity)
+        # The emptied lots are always at the end that the shares are taken from
+        remove = self.lots.pop if self.method == 'lifo' else self.lots.popleft
+        for _ in emptied:
+            remove()
+        self.shares -= quantity
+        self.cost_basis -= cost
+        self.realized_gain += quantity * price - cost
+
+    def split(self, split_to, split_from):
+        for lot in self.lots:
+            lot.quantity = lot.quantity * split_to // split_from
+        self.shares = sum(lot.quantity for lot in self.lots)
+
+    def apply(self, kind, quantity, price, split_to, split_from, transaction_id=None):
+        """
+        Apply one trade (with the columns of the `transactions` table) to the lots
+        """
+        if kind == 'buy':
+            self.buy(quantity, price, transaction_id)
+        elif kind == 'sell':
+            self.sell(quantity, price)
+        elif kind == 'split':
+            self.split(split_to, split_from)
+        else:
+            raise LedgerError(f'Unknown kind of trade ({kind})')
+
+
+def get_cost_method():
+    """
+    Return the cost method used for new holdings (LEDGER_COST_METHOD)
+    """
+    method = current_app.config.get('LEDGER_COST_METHOD', 'fifo')
+    if method not in COST_METHODS:
+        raise LedgerError(f'Unknown cost method ({method}), expected one of: {", ".join(COST_METHODS)}')
+    return method
+
+
+# ----------------------
+# Incremental updates
+# ----------------------
+
+def record_trade(user_id, stock_symbol, kind, quantity=None, price=None, split_to=None, split_from=None,
+                 traded_at=None):
+    """
+    Add a trade to the ledger of the user `user_id` and apply it to their open lots and holding
+
+    The changes are committed together with the caller's transaction.
+    Returns the new `Transaction`.
+    """
+    _check_trade(kind, quantity, price, split_to, split_from)
+
+    # The holding row is locked (on the databases that support it), so two
+    # trades of the same symbol are applied one after the other
+    holding = database.session.scalars(select(Holding)
+                                       .where(Holding.user_id == user_id, Holding.stock_symbol == stock_symbol)
+                                       .with_for_update()).first()
+    if holding is None:
+        if kind != 'buy':
+            raise LedgerError(f'No shares of {stock_symbol} are held')
+        holding = Holding(user_id=user_id, stock_symbol=stock_symbol, shares=0, cost_basis=0,
+                          realized_gain=0, lot_count=0, method=get_cost_method())
+        database.session.add(holding)
+
+    transaction = Transaction(user_id=user_id, stock_symbol=stock_symbol, kind=kind, quantity=quantity,
+                              price=price, split_to=split_to, split_from=split_from, traded_at=traded_at)
+    database.session.add(transaction)
+    # (the ID of the transaction is needed for the lot that it opens)
+    database.session.flush()
+
+    if kind == 'buy':
+        _apply_buy(holding, transaction)
+    elif kind == 'sell':
+        _apply_sell(holding, transaction)
+    else:
+        _apply_split(holding, transaction)
+    return transaction
+
+
+def _check_trade(kind, quantity, price, split_to, split_from):
+    if kind not in TRADE_KINDS:
+        raise LedgerError(f'Unknown kind of trade ({kind}), expected one of: {", ".join(TRADE_KINDS)}')
+    if kind == 'split':
+        if not split_to or not split_from or split_to < 0 or split_from < 0:
+            raise LedgerError('The ratio of a split must be two positive numbers (e.g. 2:1)')
+    else:
+        if quantity is None or quantity <= 0:
+            raise LedgerError('The number of shares must be positive')
+        if price is None or price < 0:
+            raise LedgerError('The price must not be negative')
+
+
+def _lots_of(holding):
+    return (Lot.user_id == holding.user_id, Lot.stock_symbol == holding.stock_symbol)
+
+
+def _apply_buy(holding, transaction):
+    cost = transaction.quantity * transaction.price
+    lot = None
+    if holding.method == 'average':
+        lot = database.session.scalars(select(Lot).where(*_lots_of(holding)).limit(1)).first()
+    if lot is None:
+        database.session.add(Lot(user_id=holding.user_id, stock_symbol=holding.stock_symbol,
+                                 quantity=transaction.quantity, cost=cost,
+                                 transaction_id=None if holding.method == 'average' else transaction.id))
+        holding.lot_count += 1
+    else:
+        lot.quantity += transaction.quantity
+        lot.cost += cost
+    holding.shares += transaction.quantity
+    holding.cost_basis += cost
+
+
+def _apply_sell(holding, transaction):
+    if transaction.quantity > holding.shares:
+        raise LedgerError(f'Not enough shares of {holding.stock_symbol} to sell '
+                          f'({holding.shares} of {transaction.quantity} available)')
+
+    order = Lot.id.desc() if holding.method == 'lifo' else Lot.id
+    # The lots are fetched a few at a time, and only until enough shares are taken
+    lots = database.session.scalars(select(Lot)
+                                    .where(*_lots_of(holding))
+                                    .order_by(order)
+                                    .execution_options(yield_per=LOT_FETCH_SIZE))
+    try:
+        cost, emptied = take_shares(lots, transaction.quantity)
+    finally:
+        lots.close()
+
+    for lot in emptied:
+        database.session.delete(lot)
+    holding.lot_count -= len(emptied)
+    holding.shares -= transaction.quantity
+    holding.cost_basis -= cost
+    holding.realized_gain += transaction.quantity * transaction.price - cost
+
+
+def _apply_split(holding, transaction):
+    database.session.execute(update(Lot)
+                             .where(*_lots_of(holding))
+                             .values(quantity=Lot.quantity * transaction.split_to // transaction.split_from)
+                             .execution_options(synchronize_session='fetch'))
+    # (fractional shares are dropped per lot, so the total is summed again)
+    holding.shares = database.session.scalar(select(func.coalesce(func.sum(Lot.quantity), 0))
+                                             .where(*_lots_of(holding)))
+
+
+# ----------------------
+# Rebuild
+# ----------------------
+
+class RebuildResult:
+    """
+    Class that summarizes a rebuild of the ledger
+
+    The following attributes are available:
+        * trades - number of trades replayed
+        * holdings - number of holdings written
+        * lots - number of open lots written
+        * elapsed - time taken by the rebuild (seconds)
+    """
+
+    def __init__(self):
+        self.trades = 0
+        self.holdings = 0
+        self.lots = 0
+        self.elapsed = 0.0
+
+    @property
+    def trades_per_second(self):
+        return self.trades / self.elapsed if self.elapsed else 0.0
+
+
+def rebuild_ledger(method=None, user_id=None, batch_size=10000):
+    """
+    Replace the open lots and holdings (of every user, or of `user_id`) by
+    replaying all of their trades with the cost method `method`
+
+    The trades are streamed in (user, symbol, ID) order, read from the
+    transactions index, as plain rows in batches of `batch_size`. The lots of
+    one symbol are kept in memory (`LotBook`) while its trades are replayed,
+    then the lots and holdings are written with bulk INSERT statements. The
+    rebuild is one transaction, so the old lots are kept if a trade can't be replayed.
+    """
+    method = method or get_cost_method()
+    if method not in COST_METHODS:
+        raise LedgerError(f'Unknown cost method ({method}), expected one of: {", ".join(COST_METHODS)}')
+
+    result = RebuildResult()
+    start = time.perf_counter()
+
+    delete_lots = delete(Lot)
+    delete_holdings = delete(Holding)
+    query = (select(Transaction.user_id, Transaction.stock_symbol, Transaction.kind, Transaction.quantity,
+                    Transaction.price, Transaction.split_to, Transaction.split_from, Transaction.id)
+             .order_by(Transaction.user_id, Transaction.stock_symbol, Transaction.id))
+    if user_id is not None:
+        delete_lots = delete_lots.where(Lot.user_id == user_id)
+        delete_holdings = delete_holdings.where(Holding.user_id == user_id)
+        query = query.where(Transaction.user_id == user_id)
+
+    try:
+        database.session.execute(delete_lots)
+        database.session.execute(delete_holdings)
+
+        lot_rows = []
+        holding_rows = []
+        # (executed on the connection, as Core rows, which skips the ORM's per-row processing)
+        trades = database.session.connection().execute(query.execution_options(yield_per=batch_size))
+        for (trade_user_id, stock_symbol), symbol_trades in groupby(trades, key=itemgetter(0, 1)):
+            book = LotBook(method)
+            for trade in symbol_trades:
+                result.trades += 1
+                try:
+                    book.apply(*trade[2:])
+                except LedgerError as e:
+                    raise LedgerError(f'Trade {trade[7]} ({trade[2]} {stock_symbol}): {e}') from e
+
+            lot_rows.extend({'user_id': trade_user_id, 'stock_symbol': stock_symbol, 'quantity': lot.quantity,
+                             'cost': lot.cost, 'transaction_id': lot.transaction_id} for lot in book.lots)
+            holding_rows.append({'user_id': trade_user_id, 'stock_symbol': stock_symbol, 'shares': book.shares,
+                                 'cost_basis': book.cost_basis, 'realized_gain': book.realized_gain,
+                                 'lot_count': len(book.lots), 'method': method})
+            if len(lot_rows) >= batch_size or len(holding_rows) >= batch_size:
+                result.lots += _insert_rows(Lot, lot_rows)
+                result.holdings += _insert_rows(Holding, holding_rows)
+
+        result.lots += _insert_rows(Lot, lot_rows)
+        result.holdings += _insert_rows(Holding, holding_rows)
+        database.session.commit()
+    except Exception:
+        database.session.rollback()
+        raise
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _insert_rows(model, rows):
+    # One bulk INSERT (executemany), then the buffer is reused for the next batch
+    count = len(rows)
+    if rows:
+        database.session.execute(insert(model), rows)
+        rows.clear()
+    return count
+
+
+# ----------------------
+# Profit and loss
+# ----------------------
+
+class LedgerPositions:
+    """
+    Class that holds the holdings of a user as `Positions` (for valuation) and their realized gains
+
+    Valuing `positions` against market prices gives the unrealized gain of
+    each holding (market value - cost basis of the shares still held).
+    """
+
+    def __init__(self, positions, realized_gain):
+        self.positions = positions
+        self.realized_gain = realized_gain
+
+    @property
+    def total_realized_gain(self):
+        return sum(self.realized_gain)
+
+
+def load_ledger_positions(user_id):
+    """
+    Load the holdings of the user `user_id` (including the ones sold completely, for their realized gain)
+    """
+    rows = database.session.execute(select(Holding.stock_symbol, Holding.shares, Holding.cost_basis,
+                                           Holding.realized_gain)
+                                    .where(Holding.user_id == user_id)
+                                    .order_by(Holding.stock_symbol)).all()
+    positions = Positions(symbols=[row[0] for row in rows],
+                          number_of_shares=[row[1] for row in rows],
+                          # Average cost per share (used for symbols without a market price)
+                          purchase_price=[row[2] // row[1] if row[1] else 0 for row in rows],
+                          cost_basis=[row[2] for row in rows])
+    return LedgerPositions(positions, [row[3] for row in rows])
@@ -0,0 +1,74 @@
+"""
+Keyset (cursor) pagination for the stocks listing.
+
+Instead of skipping rows with OFFSET (which makes the database walk over
+every skipped row), each page is selected with a range condition on an
+indexed, unique column (the primary key):
+
+    next page:     WHERE id > :after  ORDER BY id ASC  LIMIT :per_page + 1
+    previous page: WHERE id < :before ORDER BY id DESC LIMIT :per_page + 1
+
+Fetching one extra row tells us whether another page exists in that
+direction, so no COUNT(*) query is needed either.
+"""
+
+
+class KeysetPage:
+    """
+    Class that represents one page of results selected with keyset pagination
+
+    The following attributes are available:
+        * items - the rows on this page (in ascending key order)
+        * next_cursor - key to pass as `after` to get the next page (or None)
+        * prev_cursor - key to pass as `before` to get the previous page (or None)
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(query, key_column, per_page, after=None, before=None, key=None):
+    """
+    Return a `KeysetPage` for `query`, ordered by `key_column`
+
+    `after` selects the page that follows the given key and `before` selects
+    the page that precedes it; if neither is given the first page is returned.
+    `key` extracts the key value from a returned item (defaults to `item.id`).
+    """
+    if key is None:
+        def key(item):
+            return item.id
+
+    if before is not None:
+        # Walk backwards from the cursor, then flip the rows back into ascending order
+        rows = query.filter(key_column < before).order_by(key_column.desc()).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        next_cursor = key(items[-1]) if items else None
+        prev_cursor = key(items[0]) if items and has_more else None
+    else:
+        if after is not None:
+            query = query.filter(key_column > after)
+        rows = query.order_by(key_column).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = rows[:per_page]
+        next_cursor = key(items[-1]) if items and has_more else None
+        prev_cursor = key(items[0]) if items and after is not None else None
+
+    return KeysetPage(items, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -0,0 +1,353 @@
+"""
+Market data (stock quotes) for the stocks blueprint.
+
+Quotes are read through a `QuoteCache`, which wraps a `QuoteProvider` with
+an LRU cache where every symbol has its own time-to-live. Symbols that the
+provider does not know are cached as well (negative caching), so repeated
+lookups of a bad symbol don't reach the provider either. The result is at
+most one upstream call per symbol per TTL window.
+
+Symbols that are not cached are fetched in one call to the provider, which
+(for HttpQuoteProvider) splits them into batches that are requested in
+parallel on a bounded thread pool. Concurrent lookups of the same symbol
+are coalesced (single-flight): the first lookup fetches the quote and the
+others wait for its result instead of calling the provider again.
+
+The provider is selected by the configuration of the Flask application:
+    * QUOTES_FILE - JSON file mapping stock symbols to prices in dollars (StubQuoteProvider)
+    * QUOTES_API_URL - HTTP endpoint returning the quotes for a batch of symbols (HttpQuoteProvider)
+    * QUOTES_BATCH_SIZE - maximum number of symbols per HTTP request (default: 50)
+    * QUOTES_MAX_WORKERS - maximum number of concurrent HTTP requests (default: 8)
+
+If neither is set, no market data is available and positions are valued
+at their purchase price.
+
+All prices are in cents, the same as `Stock.purchase_price`.
+"""
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+
+from project.cache import TTLCache, MISSING
+
+# Quotes are also fetched outside of a request (e.g. on the provider's thread pool),
+# so log to a child of the application's logger rather than to `current_app.logger`
+logger = logging.getLogger(__name__)
+
+
+class QuoteProviderError(Exception):
+    """
+    Raised when a quote provider is unavailable (as opposed to a symbol being unknown)
+    """
+
+
+class QuoteProvider:
+    """
+    Interface for a source of stock quotes
+
+    Sub-classes must implement `get_quote()`, which returns the price (in cents)
+    of a stock symbol, returns None if the symbol is unknown, or raises
+    `QuoteProviderError` if the quote could not be retrieved.
+    """
+
+    def get_quote(self, symbol):
+        raise NotImplementedError
+
+    def get_quotes(self, symbols):
+        """
+        Return a dictionary of stock symbol -> price (in cents, or None if unknown)
+
+        Symbols whose quote could not be retrieved are left out of the dictionary.
+        """
+        quotes = {}
+        for symbol in symbols:
+            try:
+                quotes[symbol] = self.get_quote(symbol)
+            except QuoteProviderError as e:
+                logger.warning(f'Quote provider error: {e}')
+        return quotes
+
+
+class StubQuoteProvider(QuoteProvider):
+    """
+    Quote provider that reads the prices from a local JSON file, so the
+    application (and the tests) can run offline
+
+    The file maps stock symbols to prices in dollars (e.g. {"AAPL": 172.5}) and
+    is re-read whenever it is modified.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.calls = 0
+        self._prices = {}
+        self._modified = None
+
+    def get_quote(self, symbol):
+        self.calls += 1
+        return self._load().get(symbol.upper())
+
+    def _load(self):
+        try:
+            modified = os.stat(self.filename).st_mtime_ns
+            if modified != self._modified:
+                # (a file that is malformed, e.g. half-written, is read again on the next quote)
+                with open(self.filename) as quotes_file:
+                    self._prices = {symbol.upper(): None if price is None else int(round(float(price) * 100))
+                                    for symbol, price in json.load(quotes_file).items()}
+                self._modified = modified
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            raise QuoteProviderError(f'Unable to read quotes file ({self.filename})') from e
+        return self._prices
+
+
+class HttpQuoteProvider(QuoteProvider):
+    """
+    Quote provider that requests the quotes from an HTTP endpoint in batches
+
+    GET <url>?symbols=AAPL,HD is expected to return {"AAPL": 172.5, "HD": null},
+    where unknown symbols have a null price (or are left out).
+
+    The batches are requested in parallel on a thread pool of `max_workers`
+    threads, sharing one `requests.Session` whose connection pool keeps a
+    connection open per worker.
+    """
+
+    def __init__(self, url, timeout=5.0, batch_size=50, max_workers=8, session=None):
+        self.url = url
+        self.timeout = timeout
+        self.batch_size = max(1, batch_size)
+        self.max_workers = max(1, max_workers)
+        self.session = session or self._create_session(self.max_workers)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @staticmethod
+    def _create_session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get_quote(self, symbol):
+        quotes = self._get_batch([symbol])
+        return quotes.get(symbol)
+
+    def get_quotes(self, symbols):
+        symbols = list(symbols)
+        batches = [symbols[index:index + self.batch_size] for index in range(0, len(symbols), self.batch_size)]
+        if len(batches) == 1 or self.max_workers == 1:
+            results = map(self._get_batch_or_log, batches)
+        else:
+            results = self._get_executor().map(self._get_batch_or_log, batches)
+
+        quotes = {}
+        for batch_quotes in results:
+            quotes.update(batch_quotes)
+        return quotes
+
+    def close(self):
+        """
+        Shut down the thread pool and close the pooled connections
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.session.close()
+
+    def _get_executor(self):
+        # The thread pool is only created once a request needs more than one batch
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='quotes')
+            return self._executor
+
+    def _get_batch_or_log(self, symbols):
+        try:
+            return self._get_batch(symbols)
+        except QuoteProviderError as e:
+            logger.warning(f'Quote provider error: {e}')
+            return {}
+
+    def _get_batch(self, symbols):
+        try:
+            response = self.session.get(self.url, params={'symbols': ','.join(symbols)}, timeout=self.timeout)
+            response.raise_for_status()
+            prices = response.json()
+            quotes = {}
+            for symbol in symbols:
+                price = prices.get(symbol)
+                quotes[symbol] = None if price is None else int(round(float(price) * 100))
+        except (requests.RequestException, ValueError, TypeError, AttributeError) as e:
+            raise QuoteProviderError(f'Unable to retrieve quotes for {",".join(symbols)}') from e
+        return quotes
+
+
+class QuoteCache:
+    """
+    Class that caches the quotes returned by a `QuoteProvider`
+
+    Known symbols are cached for `ttl` seconds and unknown symbols for
+    `negative_ttl` seconds. Quotes that could not be retrieved (provider
+    errors) are not cached, so they are retried on the next lookup.
+    """
+
+    def __init__(self, provider, ttl=60.0, negative_ttl=300.0, maxsize=1024, cache=None):
+        self.provider = provider
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.cache = cache if cache is not None else TTLCache(maxsize=maxsize, ttl=ttl)
+        # Number of symbols requested from the provider
+        self.upstream_calls = 0
+        # stock symbol -> Future for the fetches that are in progress (single-flight)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    def get_price(self, symbol):
+        """
+        Return the price (in cents) of `symbol`, or None if it is unknown or unavailable
+        """
+        return self.get_prices([symbol]).get(symbol.upper())
+
+    def get_prices(self, symbols):
+        """
+        Return a dictionary of stock symbol -> price (in cents) for the known symbols in `symbols`
+        """
+        prices = {}
+        missing = []
+        for symbol in {symbol.upper() for symbol in symbols}:
+            price = self.cache.get(symbol)
+            if price is MISSING:
+                missing.append(symbol)
+            elif price is not None:
+                prices[symbol] = price
+
+        if missing:
+            for symbol, price in self._fetch(missing).items():
+                if price is not None:
+                    prices[symbol] = price
+        return prices
+
+    def is_known(self, symbol):
+        """
+        Return False if the provider reports that `symbol` does not exist
+
+        Returns True when the provider is unavailable, as the symbol can't be checked.
+        """
+        return symbol.upper() not in self.unknown_symbols([symbol])
+
+    def unknown_symbols(self, symbols):
+        """
+        Return the set of the symbols in `symbols` that the provider reports do not exist
+
+        The symbols that aren't cached are fetched together (one call of the
+        provider); the symbols that could not be retrieved are not unknown.
+        """
+        unknown = set()
+        missing = []
+        for symbol in {symbol.upper() for symbol in symbols}:
+            price = self.cache.get(symbol)
+            if price is MISSING:
+                missing.append(symbol)
+            elif price is None:
+                unknown.add(symbol)
+
+        if missing:
+            unknown.update(symbol for symbol, price in self._fetch(missing).items() if price is None)
+        return unknown
+
+    def stats(self):
+        stats = self.cache.stats()
+        stats['upstream_calls'] = self.upstream_calls
+        return stats
+
+    def _fetch(self, symbols):
+        """
+        Fetch `symbols` from the provider and cache the results
+
+        A symbol that another thread is already fetching is not requested
+        again; its result is taken from that fetch instead. Symbols that could
+        not be retrieved are left out of the returned dictionary.
+        """
+        owned = []
+        waiting = {}
+        with self._lock:
+            for symbol in symbols:
+                future = self._in_flight.get(symbol)
+                if future is None:
+                    self._in_flight[symbol] = Future()
+                    owned.append(symbol)
+                else:
+                    waiting[symbol] = future
+
+        fetched = {}
+        if owned:
+            quotes = {}
+            try:
+                with self._lock:
+                    self.upstream_calls += len(owned)
+                quotes = self.provider.get_quotes(owned)
+                for symbol, price in quotes.items():
+                    self.cache.set(symbol, price, ttl=self.ttl if price is not None else self.negative_ttl)
+                fetched.update(quotes)
+            finally:
+                # Release the waiting threads (also when the provider failed)
+                with self._lock:
+                    for symbol in owned:
+                        self._in_flight.pop(symbol).set_result(quotes.get(symbol, MISSING))
+
+        for symbol, future in waiting.items():
+            price = future.result()
+            if price is not MISSING:
+                fetched[symbol] = price
+        return fetched
+
+
+def create_quote_provider(config):
+    """
+    Create the quote provider selected by the application configuration (or None)
+    """
+    if config.get('QUOTES_FILE'):
+        return StubQuoteProvider(config['QUOTES_FILE'])
+    if config.get('QUOTES_API_URL'):
+        return HttpQuoteProvider(config['QUOTES_API_URL'],
+                                 timeout=config.get('QUOTES_TIMEOUT', 5.0),
+                                 batch_size=config.get('QUOTES_BATCH_SIZE', 50),
+                                 max_workers=config.get('QUOTES_MAX_WORKERS', 8))
+    return None
+
+
+def get_quote_cache():
+    """
+    Return the quote cache of the current Flask application, or None if no
+    quote provider is configured
+
+    The cache is created the first time it is used and then shared by every
+    request handled by this process.
+    """
+    if 'quote_cache' not in current_app.extensions:
+        provider = create_quote_provider(current_app.config)
+        quote_cache = None
+        if provider is not None:
+            quote_cache = QuoteCache(provider,
+                                     ttl=current_app.config.get('QUOTES_TTL', 60.0),
+                                     negative_ttl=current_app.config.get('QUOTES_NEGATIVE_TTL', 300.0),
+                                     maxsize=current_app.config.get('QUOTES_CACHE_SIZE', 1024))
+        current_app.extensions['quote_cache'] = quote_cache
+    return current_app.extensions['quote_cache']
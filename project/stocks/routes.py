@@ -1,63 +1,83 @@
+import json
 import click
-from flask import current_app, render_template, request, session, flash, redirect, url_for
-from pydantic import BaseModel, validator, ValidationError
+from flask import current_app, render_template, request, session, flash, redirect, url_for, Response, \
+    stream_with_context, jsonify
+from flask_login import login_required, current_user
+from markupsafe import Markup
+from pydantic import ValidationError
+from sqlalchemy import func
 from . import stocks_blueprint
-from project.models import Stock
+from .forms import StockModel
+from project.models import Stock, User
 from project import database
+from .pagination import KeysetPage, keyset_paginate
+from .valuation import Positions, value_positions, load_positions
+from .quotes import get_quote_cache
+from .importer import get_row_reader, import_stocks
+from .exporter import EXPORT_FORMATS, iter_stock_rows
+from .ledger import COST_METHODS, TRADE_KINDS, LedgerError, record_trade, rebuild_ledger, load_ledger_positions
+from .summary import add_stocks, rebuild_summaries, get_portfolio_summary, load_position_summaries
+from .history import get_price_history, load_prices, to_day
+from .analytics import analyze_portfolio, get_portfolio_symbols
+from .snapshots import take_snapshots, load_snapshots, run_snapshot_scheduler
+from .streaming import get_quote_publisher, stream_position_values
+from .conditional import conditional_portfolio
+from .fragments import get_stock_rows, stock_rows_key
 
 
 # --------------------------------------------------------------------
 # Request Callbacks
 # teardown_appcontext callback is not available at the blueprint-level
+# These are only logged when debugging the request lifecycle
+# (LOG_REQUEST_CALLBACKS), as the access log already has one record per request
 # --------------------------------------------------------------------
 @stocks_blueprint.before_request
 def stocks_before_request():
-    current_app.logger.info('Calling before_request() for the stocks blueprint...')
+    if current_app.config.get('LOG_REQUEST_CALLBACKS', False):
+        current_app.logger.info('Calling before_request() for the stocks blueprint...')
 
 
 @stocks_blueprint.after_request
 def stocks_after_request(response):
-    current_app.logger.info('Calling after_request() for the stocks blueprint...')
+    if current_app.config.get('LOG_REQUEST_CALLBACKS', False):
+        current_app.logger.info('Calling after_request() for the stocks blueprint...')
     return response
 
 
 @stocks_blueprint.teardown_request
 def stocks_teardown_request(error=None):
-    current_app.logger.info('Calling teardown_request() for the stocks blueprint...')
-
-
-# --------------
-# Helper Classes
-# --------------
-
-class StockModel(BaseModel):
-    """Class for parsing new stock data from a form."""
-    stock_symbol: str
-    number_of_shares: int
-    purchase_price: float
-
-    @validator('stock_symbol')
-    def stock_symbol_check(cls, value):
-        if not value.isalpha() or len(value) > 5:
-            raise ValueError('Stock symbol must be 1-5 characters')
-        return value.upper()
+    if current_app.config.get('LOG_REQUEST_CALLBACKS', False):
+        current_app.logger.info('Calling teardown_request() for the stocks blueprint...')
 
 
 # -------------
 # CLI Commands
 # -------------
 
+def _get_owner_id(email):
+    """
+    Return the ID of the user with the email given with the --owner option
+    """
+    if email is None:
+        return None
+    user = User.query.filter(func.lower(User.email) == email.lower()).first()
+    if user is None:
+        raise click.BadParameter(f'No user with the email {email}', param_hint='--owner')
+    return user.id
+
+
 @stocks_blueprint.cli.command('create_default_set')
-def create_default_set():
+@click.option('--owner', required=True, help='Email of the user that owns the stocks')
+def create_default_set(owner):
     """
     Create three new stocks and add them to the database
     """
-    stock1 = Stock('HD', '25', '247.29')
-    stock2 = Stock('TWTR', '230', '31.89')
-    stock3 = Stock('DIS', '65', '118.77')
-    database.session.add(stock1)
-    database.session.add(stock2)
-    database.session.add(stock3)
+    owner_id = _get_owner_id(owner)
+    stock1 = Stock('HD', '25', '247.29', owner_id)
+    stock2 = Stock('TWTR', '230', '31.89', owner_id)
+    stock3 = Stock('DIS', '65', '118.77', owner_id)
+    # The stocks and the owner's portfolio summary are written in one transaction
+    add_stocks([stock1, stock2, stock3])
     database.session.commit()
 
 
@@ -65,15 +85,233 @@ def create_default_set():
 @click.argument('symbol')
 @click.argument('number_of_shares')
 @click.argument('purchase_price')
-def create(symbol, number_of_shares, purchase_price):
+@click.option('--owner', required=True, help='Email of the user that owns the stock')
+def create(symbol, number_of_shares, purchase_price, owner):
     """
     Create a new stock and add it to the database
     """
-    stock = Stock(symbol, number_of_shares, purchase_price)
-    database.session.add(stock)
+    owner_id = _get_owner_id(owner)
+    stock = Stock(symbol, number_of_shares, purchase_price, owner_id)
+    add_stocks([stock])
     database.session.commit()
 
 
+@stocks_blueprint.cli.command('value')
+@click.option('--prices', 'prices_file', type=click.File('r'),
+              help='JSON file mapping stock symbols to market prices in dollars')
+@click.option('--top', default=10, show_default=True, help='Number of largest positions to list')
+@click.option('--owner', help='Email of the user whose stocks are valued (default: all users)')
+def value(prices_file, top, owner):
+    """
+    Value every stock in the database (or of one user) and print the portfolio totals
+    """
+    prices = {}
+    if prices_file is not None:
+        prices = {symbol.upper(): int(round(float(price) * 100)) for symbol, price in json.load(prices_file).items()}
+
+    valuation = value_positions(load_positions(user_id=_get_owner_id(owner)), prices)
+    click.echo(f'Positions:    {len(valuation)}')
+    click.echo(f'Cost basis:   ${valuation.total_cost_basis / 100:,.2f}')
+    click.echo(f'Market value: ${valuation.total_market_value / 100:,.2f}')
+    click.echo(f'Gain/loss:    ${valuation.total_gain / 100:,.2f} ({valuation.total_gain_percent:.2f}%)')
+
+    # Only the largest positions are turned into Python objects for printing
+    for index in valuation.market_value.argsort()[::-1][:top]:
+        click.echo(f'  {valuation.positions.symbols[index]:<5} '
+                   f'{valuation.positions.number_of_shares[index]:>10} shares  '
+                   f'${valuation.market_value[index] / 100:>15,.2f}  '
+                   f'{valuation.weight[index]:6.2f}%')
+
+
+@stocks_blueprint.cli.command('import')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'json', 'ndjson']),
+              help='File format (default: based on the file extension)')
+@click.option('--batch-size', default=1000, show_default=True, help='Number of rows inserted per transaction')
+@click.option('--max-errors', default=100, show_default=True, help='Number of invalid rows to list')
+@click.option('--owner', required=True, help='Email of the user that owns the stocks')
+def import_file(filename, file_format, batch_size, max_errors, owner):
+    """
+    Import the stocks in a CSV or JSON file into the database
+    """
+    owner_id = _get_owner_id(owner)
+    try:
+        read_rows = get_row_reader(filename, file_format)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--format')
+
+    with open(filename, newline='') as file:
+        result = import_stocks(read_rows(file), owner_id, batch_size=batch_size, max_errors=max_errors)
+
+    for row_number, message in result.errors:
+        click.echo(f'Row {row_number}: {message}', err=True)
+    if result.error_count > len(result.errors):
+        click.echo(f'... and {result.error_count - len(result.errors)} more invalid rows', err=True)
+
+    click.echo(f'Imported {result.rows_imported} of {result.rows_read} rows '
+               f'({result.error_count} invalid) in {result.elapsed:.2f}s '
+               f'({result.rows_per_second:,.0f} rows/sec)')
+
+
+@stocks_blueprint.cli.command('export')
+@click.option('--format', 'file_format', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--output', type=click.File('w'), default='-', help='Output file (default: stdout)')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Number of rows fetched from the database at a time')
+@click.option('--owner', help='Email of the user whose stocks are exported (default: all users)')
+def export(file_format, output, batch_size, owner):
+    """
+    Export every stock in the database (or of one user) as CSV or NDJSON
+    """
+    generate, _ = EXPORT_FORMATS[file_format]
+    for chunk in generate(iter_stock_rows(batch_size=batch_size, user_id=_get_owner_id(owner))):
+        output.write(chunk)
+
+
+@stocks_blueprint.cli.command('trade')
+@click.argument('kind', type=click.Choice(TRADE_KINDS))
+@click.argument('symbol')
+@click.argument('quantity')
+@click.argument('price', required=False)
+@click.option('--owner', required=True, help='Email of the user that made the trade')
+def trade(kind, symbol, quantity, price, owner):
+    """
+    Record a trade in the ledger: 'buy SYMBOL SHARES PRICE', 'sell SYMBOL SHARES PRICE' or 'split SYMBOL 2:1'
+    """
+    owner_id = _get_owner_id(owner)
+    symbol = symbol.upper()
+    try:
+        if kind == 'split':
+            split_to, _, split_from = quantity.partition(':')
+            transaction = record_trade(owner_id, symbol, kind, split_to=int(split_to), split_from=int(split_from))
+        else:
+            if price is None:
+                raise click.UsageError(f'A price is needed to {kind} shares')
+            transaction = record_trade(owner_id, symbol, kind, quantity=int(quantity),
+                                       price=Stock._convert_price_to_cents(price))
+    except ValueError as e:
+        # (LedgerError is a ValueError, the same as the errors of int())
+        database.session.rollback()
+        raise click.ClickException(str(e))
+    database.session.commit()
+    click.echo(f'Recorded {transaction!r}')
+
+
+@stocks_blueprint.cli.command('ledger')
+@click.option('--prices', 'prices_file', type=click.File('r'),
+              help='JSON file mapping stock symbols to market prices in dollars')
+@click.option('--owner', required=True, help='Email of the user whose ledger is listed')
+def ledger(prices_file, owner):
+    """
+    Print the holdings of a user with their realized and unrealized gains
+    """
+    prices = {}
+    if prices_file is not None:
+        prices = {symbol.upper(): int(round(float(price) * 100)) for symbol, price in json.load(prices_file).items()}
+
+    ledger_positions = load_ledger_positions(_get_owner_id(owner))
+    valuation = value_positions(ledger_positions.positions, prices)
+    for row, realized_gain in zip(valuation.rows(), ledger_positions.realized_gain):
+        click.echo(f'  {row["stock_symbol"]:<5} {row["number_of_shares"]:>10} shares  '
+                   f'cost ${row["cost_basis"] / 100:>13,.2f}  '
+                   f'unrealized ${row["gain"] / 100:>13,.2f}  '
+                   f'realized ${realized_gain / 100:>13,.2f}')
+    click.echo(f'Cost basis:      ${valuation.total_cost_basis / 100:,.2f}')
+    click.echo(f'Market value:    ${valuation.total_market_value / 100:,.2f}')
+    click.echo(f'Unrealized gain: ${valuation.total_gain / 100:,.2f}')
+    click.echo(f'Realized gain:   ${ledger_positions.total_realized_gain / 100:,.2f}')
+
+
+@stocks_blueprint.cli.command('rebuild-ledger')
+@click.option('--method', type=click.Choice(COST_METHODS),
+              help='Cost method of the lots (default: LEDGER_COST_METHOD)')
+@click.option('--owner', help='Email of the user whose ledger is rebuilt (default: all users)')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Number of trades fetched (and lots inserted) at a time')
+def rebuild_ledger_command(method, owner, batch_size):
+    """
+    Rebuild the open lots and holdings by replaying every trade in the ledger
+    """
+    try:
+        result = rebuild_ledger(method, user_id=_get_owner_id(owner), batch_size=batch_size)
+    except LedgerError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'Replayed {result.trades} trades into {result.holdings} holdings ({result.lots} open lots) '
+               f'in {result.elapsed:.2f}s ({result.trades_per_second:,.0f} trades/sec)')
+
+
+@stocks_blueprint.cli.command('rebuild-summary')
+@click.option('--owner', help='Email of the user whose summary is rebuilt (default: all users)')
+def rebuild_summary(owner):
+    """
+    Recompute the position and portfolio summaries from the stocks in the database
+    """
+    result = rebuild_summaries(user_id=_get_owner_id(owner))
+    click.echo(f'Rebuilt {result.positions} position summaries and {result.portfolios} portfolio summaries '
+               f'in {result.elapsed:.2f}s')
+
+
+@stocks_blueprint.cli.command('load-prices')
+@click.argument('filename', type=click.Path(exists=True, dir_okay=False))
+@click.option('--symbol', help='Stock symbol of every row (for files without a symbol column)')
+@click.option('--batch-size', default=100000, show_default=True, help='Number of rows buffered before they are written')
+@click.option('--max-errors', default=100, show_default=True, help='Number of invalid rows to list')
+def load_prices_command(filename, symbol, batch_size, max_errors):
+    """
+    Load daily closing prices from a CSV file (columns: symbol, date, close) into the price history
+    """
+    store = get_price_history()
+    with open(filename, newline='') as file:
+        result = load_prices(store, get_row_reader(filename, 'csv')(file), symbol=symbol,
+                             batch_size=batch_size, max_errors=max_errors)
+
+    for row_number, message in result.errors:
+        click.echo(f'Row {row_number}: {message}', err=True)
+    if result.error_count > len(result.errors):
+        click.echo(f'... and {result.error_count - len(result.errors)} more invalid rows', err=True)
+
+    click.echo(f'Loaded {result.rows_imported} of {result.rows_read} prices '
+               f'({result.error_count} invalid, {result.rows_read - result.error_count - result.rows_imported} '
+               f'already stored) in {result.elapsed:.2f}s ({result.rows_per_second:,.0f} rows/sec)')
+
+
+@stocks_blueprint.cli.command('snapshot')
+@click.option('--owner', help='Email of the user whose snapshots are taken (default: all users)')
+@click.option('--full', is_flag=True, help='Compute every day again (default: only the days that changed)')
+@click.option('--batch-size', type=int, help='Number of users per batch (default: SNAPSHOT_BATCH_SIZE)')
+@click.option('--workers', type=int, help='Number of worker threads (default: SNAPSHOT_WORKERS)')
+@click.option('--every', type=click.FloatRange(min=1), metavar='SECONDS',
+              help='Keep running, and take the snapshots every SECONDS seconds (run in one process only)')
+def snapshot(owner, full, batch_size, workers, every):
+    """
+    Write the daily snapshots of the value of the portfolios that changed since the last run
+    """
+    options = {'user_id': _get_owner_id(owner), 'batch_size': batch_size, 'workers': workers}
+    if every is not None:
+        # (only the first run is a full run)
+        if full:
+            take_snapshots(full=True, **options)
+        click.echo(f'Taking the snapshots every {every:g}s (press CTRL+C to quit)')
+        run_snapshot_scheduler(every, **options)
+        return
+
+    result = take_snapshots(full=full, **options)
+    click.echo(f'Wrote {result.snapshots} snapshots for {result.users} users '
+               f'({result.skipped} up to date) in {result.elapsed:.2f}s')
+
+
+# ---------------
+# Template Filters
+# ---------------
+
+@stocks_blueprint.app_template_filter('cents')
+def format_cents(amount):
+    """
+    Format an amount stored in cents as dollars (e.g. 40678 -> $406.78)
+    """
+    return f'${amount / 100:,.2f}'
+
+
 # --------------
 # Routes
 # --------------
@@ -81,10 +319,13 @@ def create(symbol, number_of_shares, purchase_price):
 @stocks_blueprint.route('/')
 def index():
     current_app.logger.info("Calling the index() function")
-    return render_template('index.html')
+    # The portfolio totals are read from the user's summary row (no aggregation)
+    portfolio_summary = get_portfolio_summary(current_user.id) if current_user.is_authenticated else None
+    return render_template('index.html', portfolio_summary=portfolio_summary)
 
 
 @stocks_blueprint.route('/add_stock', methods=['GET', 'POST'])
+@login_required
 def add_stock():
     if request.method == 'POST':
         # Print the form data to the console
@@ -99,13 +340,21 @@ def add_stock():
             )
             print(stock_data)
 
+            # Check that the stock symbol exists (the quote cache remembers unknown symbols too)
+            quote_cache = get_quote_cache()
+            if quote_cache is not None and not quote_cache.is_known(stock_data.stock_symbol):
+                flash(f'ERROR! Unknown stock symbol ({stock_data.stock_symbol}).', 'error')
+                return render_template('add_stock.html')
+
             # Save the form data to the database
             # Create a new instance of Stock
             new_stock = Stock(stock_data.stock_symbol,
                               stock_data.number_of_shares,
-                              stock_data.purchase_price)
-            # New object will then be added to the database session
-            database.session.add(new_stock)
+                              stock_data.purchase_price,
+                              current_user.id)
+            # New object will then be added to the database session,
+            # together with the update of the user's portfolio summary
+            add_stocks([new_stock])
             # Write the changes to the database
             database.session.commit()
 
@@ -122,8 +371,153 @@ def add_stock():
 
 
 @stocks_blueprint.route('/stocks/')
+@login_required
+@conditional_portfolio(quotes=True)
 def list_stocks():
-    # The query attribute is used with a modifier (e.g. filter, order_by, get)
-    # + the number of record to return (e.g. all, first)
-    stocks = Stock.query.order_by(Stock.id).all()
-    return render_template('stocks.html', stocks=stocks)
+    # Keyset pagination: the page is selected with `id > after` (or `id < before`)
+    # rather than OFFSET, so each page costs the same no matter how many rows
+    # come before it in the table. Only the stocks of the current user are listed,
+    # read with the (user_id, id) index, so the page costs the same however many
+    # stocks the other users have
+    per_page = _get_per_page()
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+
+    # Value the portfolio totals from the user's position summaries (one row
+    # per symbol) rather than from every position
+    symbol_totals = load_position_summaries(current_user.id)
+    prices = _get_market_prices(symbol_totals.symbols)
+    portfolio_valuation = value_positions(symbol_totals, prices)
+
+    def render_rows():
+        page = keyset_paginate(Stock.query.filter(Stock.user_id == current_user.id),
+                               Stock.id,
+                               per_page,
+                               after=after,
+                               before=before)
+        # Value the positions on this page in one batched pass
+        stocks = list(value_positions(Positions.from_stocks(page.items), prices).rows())
+        for row in stocks:
+            # Weight is relative to the whole portfolio, not just this page
+            row['weight'] = _percent_of(row['market_value'], portfolio_valuation.total_market_value)
+        return {'html': render_template('stock_rows.html', stocks=stocks),
+                'next_cursor': page.next_cursor,
+                'prev_cursor': page.prev_cursor}
+
+    # The rendered rows are cached until the user's stocks (the version of
+    # their portfolio summary) or the market prices change
+    key = stock_rows_key(get_portfolio_summary(current_user.id), per_page, after, before, prices)
+    rows = get_stock_rows(current_user.id, key, render_rows)
+
+    return render_template('stocks.html',
+                           rows=Markup(rows['html']),
+                           page=KeysetPage([], rows['next_cursor'], rows['prev_cursor']),
+                           per_page=per_page,
+                           portfolio=portfolio_valuation)
+
+
+@stocks_blueprint.route('/stocks/stream')
+@login_required
+def stream_quotes():
+    # Server-Sent Events with the changes of the prices of the user's
+    # positions, fed by the quote publisher shared by every stream of this process
+    publisher = get_quote_publisher()
+    if publisher is None:
+        # No market data, so there will never be an event (204 also tells the browser not to reconnect)
+        return '', 204
+    publisher.start()
+    positions = load_position_summaries(current_user.id)
+    # The stream can stay open for hours, so it isn't run with stream_with_context():
+    # the request (and its database session) ends as soon as the response starts
+    return Response(stream_position_values(publisher, positions,
+                                           keepalive=current_app.config.get('QUOTES_STREAM_KEEPALIVE', 15.0)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@stocks_blueprint.route('/stocks/export.<any(csv, ndjson):export_format>')
+@login_required
+@conditional_portfolio()
+def export_stocks(export_format):
+    # The response body is generated while it is being sent, so the rows are
+    # streamed from the database to the client without ever being held in memory.
+    # stream_with_context() keeps the request (and database session) alive until
+    # the generator is finished.
+    generate, mimetype = EXPORT_FORMATS[export_format]
+    batch_size = current_app.config.get('STOCKS_EXPORT_BATCH_SIZE', 1000)
+    rows = iter_stock_rows(batch_size=batch_size, user_id=current_user.id)
+    return Response(stream_with_context(generate(rows)),
+                    mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=stocks.{export_format}'})
+
+
+@stocks_blueprint.route('/stocks/analytics')
+@login_required
+def portfolio_analytics():
+    return render_template('analytics.html',
+                           summary=_analyze_current_portfolio().to_dict(),
+                           max_correlation_symbols=current_app.config.get('ANALYTICS_MAX_CORRELATION_TABLE', 20))
+
+
+@stocks_blueprint.route('/stocks/analytics.json')
+@login_required
+def portfolio_analytics_json():
+    return jsonify(_analyze_current_portfolio().to_dict())
+
+
+@stocks_blueprint.route('/stocks/history.json')
+@login_required
+def portfolio_history_json():
+    """
+    Return the daily values of the current user's portfolio (from the
+    snapshots) between the 'start' and 'end' dates of the query string
+    """
+    days, values = load_snapshots(current_user.id,
+                                  start=request.args.get('start', type=to_day),
+                                  end=request.args.get('end', type=to_day))
+    return jsonify({'dates': [day.isoformat() for day in days], 'values': (values / 100).tolist()})
+
+
+def _analyze_current_portfolio():
+    """
+    Compute the analytics of the current user's portfolio over the price
+    history between the 'start' and 'end' dates of the query string
+    (ISO dates, default: all of the history)
+    """
+    window = request.args.get('window', current_app.config.get('ANALYTICS_WINDOW', 21), type=int)
+    benchmark = request.args.get('benchmark', current_app.config.get('ANALYTICS_BENCHMARK', 'SPY')).upper()
+    return analyze_portfolio(current_user.id,
+                             get_price_history(),
+                             get_portfolio_symbols(current_user.id),
+                             start=request.args.get('start', type=to_day),
+                             end=request.args.get('end', type=to_day),
+                             benchmark=benchmark if benchmark.isalpha() and len(benchmark) <= 5 else None,
+                             window=max(2, window))
+
+
+def _get_per_page():
+    """
+    Return the page size requested in the query string, limited to the
+    configured maximum (STOCKS_MAX_PER_PAGE)
+    """
+    default_per_page = current_app.config.get('STOCKS_PER_PAGE', 20)
+    max_per_page = current_app.config.get('STOCKS_MAX_PER_PAGE', 100)
+    per_page = request.args.get('per_page', default_per_page, type=int)
+    return max(1, min(per_page, max_per_page))
+
+
+def _get_market_prices(symbols):
+    """
+    Return the current market prices (stock symbol -> price in cents) of `symbols`
+
+    The prices are read through the quote cache; if no quote provider is
+    configured, every position is valued at its purchase price.
+    """
+    quote_cache = get_quote_cache()
+    if quote_cache is None:
+        return {}
+    return quote_cache.get_prices(symbols)
+
+
+def _percent_of(amount, total):
+    return amount * 100.0 / total if total else 0.0
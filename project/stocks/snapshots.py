@@ -0,0 +1,335 @@
+"""
+Daily snapshots of the value of the portfolio of each user.
+
+The value of a portfolio on a past day needs the shares held on that day
+and the closing prices of that day, so rather than revaluing every day of
+the price history when a chart of the value is shown, the value at the end
+of each day is written once to the portfolio_snapshots table, and a chart
+is a range read of one user's rows (`load_snapshots()`).
+
+The snapshots are written incrementally: the snapshot_states table records,
+for each user, the last day with a snapshot and the trades and positions
+that were included, so a run only computes:
+
+    * the days after the last snapshot, when there are new closing prices
+    * the days from the first new trade, when the user recorded trades
+      (trades can be backdated)
+    * every day, for a user whose stocks changed (the current positions of
+      the stocks table are held on every day, see project/stocks/analytics.py)
+
+Users with nothing new are skipped without loading anything. The users to
+update are split into batches of SNAPSHOT_BATCH_SIZE users (default: 100),
+which are valued on a pool of SNAPSHOT_WORKERS threads (default: 4; the
+price history is memory-mapped, and NumPy and the database driver release
+the GIL), while the snapshots are written by the calling thread, one
+transaction per batch. (On SQLite, where the writes are the largest part of
+a full run and readers and the writer wait on each other, set
+SNAPSHOT_WORKERS to 0 to value the users on the calling thread.)
+
+The snapshots are taken by:
+    * 'flask stocks snapshot' - e.g. from a daily cron job after the closing
+      prices are loaded (recommended in production)
+    * 'flask stocks snapshot --every SECONDS' - takes the snapshots every
+      SECONDS seconds, in the foreground of its own process (e.g. a service
+      next to the web server), for deployments without cron. The web server
+      processes never take snapshots, so one such process is enough
+
+The snapshots and the states are written with upserts on their primary keys
+(user, day) and (user), so a run that overlaps another one (e.g. a manual
+run while the scheduled one is writing) writes the same rows again rather
+than adding duplicates or failing.
+
+Changes that can't be detected (e.g. older closing prices loaded for a
+symbol after the snapshots were taken) are included with 'flask stocks
+snapshot --full', which recomputes every day of every user.
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import select, insert, delete, func
+
+from project import database
+from project.models import Transaction, PortfolioSummary, PortfolioSnapshot, SnapshotState
+from .analytics import load_price_matrix, load_share_matrix, get_portfolio_symbols
+from .history import to_day, get_price_history
+from .summary import UPSERT_DIALECTS
+
+# The scheduler runs outside of any request, so log to a child of the application's logger
+logger = logging.getLogger(__name__)
+
+# Days of prices read before the first day to compute, so that a symbol without
+# a price on that day is valued at its last price before it (as in a full run)
+LOOKBACK_DAYS = 14
+
+EPOCH = date(1970, 1, 1)
+
+
+class SnapshotResult:
+    """
+    Class that summarizes a run of `take_snapshots()`
+
+    The following attributes are available:
+        * users - number of users whose snapshots were computed
+        * skipped - number of users whose snapshots were already up to date
+        * snapshots - number of snapshots written
+        * elapsed - time taken by the run (seconds)
+    """
+
+    def __init__(self):
+        self.users = 0
+        self.skipped = 0
+        self.snapshots = 0
+        self.elapsed = 0.0
+
+
+class SnapshotTask:
+    """
+    Class that describes the snapshots to compute for one user
+
+    `from_day` is the first day to compute (days since 1970-01-01), or None
+    to compute every day; the trades after `trades_after` (a transaction ID)
+    can move it earlier. `transaction_id`, `summary_updated_at` and
+    `last_day` are saved in the user's state once the snapshots are written.
+    """
+
+    def __init__(self, user_id, from_day, trades_after, transaction_id, summary_updated_at, last_day):
+        self.user_id = user_id
+        self.from_day = from_day
+        self.trades_after = trades_after
+        self.transaction_id = transaction_id
+        self.summary_updated_at = summary_updated_at
+        self.last_day = last_day
+
+
+def plan_snapshots(store, user_id=None, full=False):
+    """
+    Return the `SnapshotTask` of each user (or of `user_id`) whose snapshots
+    are out of date, and the number of users that are up to date
+
+    Only three small aggregate queries are run, whatever the number of users.
+    """
+    summaries = select(PortfolioSummary.user_id, PortfolioSummary.updated_at)
+    trades = select(Transaction.user_id, func.max(Transaction.id)).group_by(Transaction.user_id)
+    states = select(SnapshotState.user_id, SnapshotState.last_day,
+                    SnapshotState.transaction_id, SnapshotState.summary_updated_at)
+    if user_id is not None:
+        summaries = summaries.where(PortfolioSummary.user_id == user_id)
+        trades = trades.where(Transaction.user_id == user_id)
+        states = states.where(SnapshotState.user_id == user_id)
+    summaries = dict(database.session.execute(summaries).all())
+    trades = dict(database.session.execute(trades).all())
+    states = {row[0]: row[1:] for row in database.session.execute(states)}
+
+    # The last day with a closing price of any symbol: a user whose
+    # snapshots reach it has no new prices
+    last_days = [store.last_day(symbol) for symbol in store.symbols()]
+    last_price_day = max((day for day in last_days if day is not None), default=None)
+
+    tasks = []
+    skipped = 0
+    for task_user_id in sorted(set(summaries) | set(trades)):
+        transaction_id = trades.get(task_user_id)
+        summary_updated_at = summaries.get(task_user_id)
+        last_day, state_transaction_id, state_summary_updated_at = states.get(task_user_id, (None, None, None))
+        last_day = None if last_day is None else to_day(last_day)
+        from_day = None
+        trades_after = None
+
+        if full or task_user_id not in states or last_day is None \
+                or summary_updated_at != state_summary_updated_at:
+            # (the current positions of the stocks table are held on every day)
+            pass
+        elif transaction_id == state_transaction_id:
+            # The positions are unchanged: only the new prices change the snapshots
+            from_day = last_day + 1
+        elif transaction_id is not None and state_transaction_id is not None:
+            # Only the new trades (and prices) change the snapshots
+            from_day = last_day + 1
+            trades_after = state_transaction_id
+        # (otherwise the first trades were recorded, or the trades were removed: every day is computed again)
+
+        if from_day is not None and trades_after is None \
+                and (last_price_day is None or last_day >= last_price_day):
+            skipped += 1
+            continue
+        tasks.append(SnapshotTask(task_user_id, from_day, trades_after, transaction_id,
+                                  summary_updated_at, last_day))
+    return tasks, skipped
+
+
+def compute_snapshots(store, task):
+    """
+    Compute the snapshots of `task` from the price history `store`
+
+    Returns the first day computed (None if every day was) and the rows of
+    the portfolio_snapshots table.
+    """
+    from_day = task.from_day
+    if task.trades_after is not None:
+        # A new trade can be dated before the last snapshot
+        first_trade = database.session.scalar(select(func.min(Transaction.traded_at))
+                                              .where(Transaction.user_id == task.user_id,
+                                                     Transaction.id > task.trades_after))
+        if first_trade is not None:
+            from_day = min(from_day, to_day(first_trade))
+
+    symbols = get_portfolio_symbols(task.user_id)
+    start = None if from_day is None else from_day - LOOKBACK_DAYS
+    matrix = load_price_matrix(store, symbols, start=start)
+    shares, _ = load_share_matrix(task.user_id, matrix)
+
+    if matrix.symbols:
+        values = np.rint((shares * matrix.prices).sum(axis=1)).astype(np.int64)
+        position_counts = (shares > 0).sum(axis=1)
+    else:
+        values = position_counts = np.zeros(len(matrix.days), dtype=np.int64)
+    first = 0 if from_day is None else int(np.searchsorted(matrix.days, from_day))
+    rows = [{'user_id': task.user_id, 'day': day, 'market_value': value, 'position_count': position_count}
+            for day, value, position_count in zip(matrix.dates[first:].tolist(),
+                                                  values[first:].tolist(),
+                                                  position_counts[first:].tolist())]
+    return from_day, rows
+
+
+def take_snapshots(store=None, user_id=None, full=False, batch_size=None, workers=None):
+    """
+    Compute and write the snapshots that are out of date, of every user (or of `user_id`)
+    """
+    config = current_app.config
+    store = store or get_price_history()
+    batch_size = batch_size or config.get('SNAPSHOT_BATCH_SIZE', 100)
+    workers = config.get('SNAPSHOT_WORKERS', 4) if workers is None else workers
+    result = SnapshotResult()
+    start = time.perf_counter()
+
+    tasks, result.skipped = plan_snapshots(store, user_id, full)
+    # The planning queries are not needed by the workers, so don't hold the transaction open
+    database.session.commit()
+    batches = [tasks[index:index + batch_size] for index in range(0, len(tasks), batch_size)]
+
+    if workers and len(batches) > 1:
+        app = current_app._get_current_object()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='snapshot') as executor:
+            futures = [executor.submit(_compute_batch_in_app, app, store, batch) for batch in batches]
+            for future in as_completed(futures):
+                _write_batch(future.result(), result)
+    else:
+        for batch in batches:
+            _write_batch([(task, *compute_snapshots(store, task)) for task in batch], result)
+
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def _compute_batch_in_app(app, store, batch):
+    # Each worker thread has its own application context, and so its own database session
+    with app.app_context():
+        try:
+            computed = []
+            for task in batch:
+                computed.append((task, *compute_snapshots(store, task)))
+                # End the read transaction of each user, so it never holds up the writes of the snapshots
+                database.session.rollback()
+            return computed
+        finally:
+            database.session.remove()
+
+
+def _write_batch(computed, result):
+    """
+    Replace the snapshots of a batch of users from their first computed day, and save their states
+    """
+    now = datetime.utcnow()
+    rows = []
+    states = []
+    for task, from_day, task_rows in computed:
+        snapshots = delete(PortfolioSnapshot).where(PortfolioSnapshot.user_id == task.user_id)
+        if from_day is not None:
+            snapshots = snapshots.where(PortfolioSnapshot.day >= EPOCH + timedelta(days=from_day))
+        database.session.execute(snapshots)
+        rows.extend(task_rows)
+
+        last_day = task_rows[-1]['day'] if task_rows else None
+        if last_day is None and from_day is not None and task.last_day is not None:
+            # No new days: the snapshots before the first computed day are kept
+            last_day = EPOCH + timedelta(days=min(task.last_day, from_day - 1))
+        states.append({'user_id': task.user_id,
+                       'last_day': last_day,
+                       'transaction_id': task.transaction_id,
+                       'summary_updated_at': task.summary_updated_at,
+                       'updated_at': now})
+
+    if rows:
+        # A Core INSERT (rather than an ORM bulk insert), as there can be a row per day for each user
+        database.session.connection().execute(_upsert_statement(PortfolioSnapshot.__table__), rows)
+    database.session.connection().execute(_upsert_statement(SnapshotState.__table__), states)
+    database.session.commit()
+    result.users += len(computed)
+    result.snapshots += len(rows)
+
+
+def _upsert_statement(table):
+    """
+    Return the INSERT statement of the rows of `table` that replaces the rows
+    with the same primary key (an INSERT ... ON CONFLICT DO UPDATE), to be
+    executed with a list of rows
+
+    On other databases than PostgreSQL and SQLite, it is a plain INSERT (and
+    a concurrent run fails on the primary key, rather than writing the row twice).
+    """
+    build_insert = UPSERT_DIALECTS.get(database.session.get_bind().dialect.name)
+    if build_insert is None:
+        return insert(table)
+    statement = build_insert(table)
+    keys = [column.name for column in table.primary_key.columns]
+    return statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={column.name: statement.excluded[column.name] for column in table.columns if column.name not in keys})
+
+
+def load_snapshots(user_id, start=None, end=None):
+    """
+    Return the days (`date`) and the values (cents) of the snapshots of the
+    user `user_id` from `start` to `end` (both included, default: all of them)
+    """
+    query = (select(PortfolioSnapshot.day, PortfolioSnapshot.market_value)
+             .where(PortfolioSnapshot.user_id == user_id)
+             .order_by(PortfolioSnapshot.day))
+    if start is not None:
+        query = query.where(PortfolioSnapshot.day >= EPOCH + timedelta(days=to_day(start)))
+    if end is not None:
+        query = query.where(PortfolioSnapshot.day <= EPOCH + timedelta(days=to_day(end)))
+    rows = database.session.execute(query).all()
+    return [row[0] for row in rows], np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+
+
+# ----------------
+# Scheduler
+# ----------------
+
+def run_snapshot_scheduler(interval, max_runs=None, **options):
+    """
+    Take the snapshots (see `take_snapshots()` for the `options`) every
+    `interval` seconds, forever (or `max_runs` times)
+
+    Run by 'flask stocks snapshot --every', in one process only. An error of
+    one run is logged, and the next run is still taken.
+    """
+    runs = 0
+    while max_runs is None or runs < max_runs:
+        try:
+            result = take_snapshots(**options)
+            logger.info(f'Wrote {result.snapshots} snapshots for {result.users} users '
+                        f'({result.skipped} up to date) in {result.elapsed:.2f}s')
+        except Exception:
+            database.session.rollback()
+            logger.exception('Error while taking the portfolio snapshots')
+        finally:
+            database.session.remove()
+        runs += 1
+        if max_runs is None or runs < max_runs:
+            time.sleep(interval)
@@ -0,0 +1,233 @@
+"""
+Live quotes for the stocks page, pushed to the browser with Server-Sent Events.
+
+Every open stocks page keeps one connection to '/stocks/stream' (an
+EventSource), and is sent an event whenever the price of a symbol that the
+user holds changes, with the new price and the new values of the position
+and of the portfolio. Nothing is sent while the prices don't change, except
+a comment every QUOTES_STREAM_KEEPALIVE seconds (default: 15) so that
+proxies don't close the idle connection.
+
+The quotes of every connection of a process come from one `QuotePublisher`,
+which runs a single poll loop on a background thread: every
+QUOTES_STREAM_INTERVAL seconds (default: 5) it fetches the prices of the
+symbols held by any connected user with one call to the quote cache (see
+project/stocks/quotes.py), and hands the prices that changed to the
+subscriptions of those symbols only. However many clients are connected,
+the quote provider sees one batched request per poll (and the quote cache
+only asks it again once the quotes are older than QUOTES_TTL).
+
+A subscription holds the latest price of each of its symbols that changed
+since its client was last sent an event (not a queue of every change), so
+a slow client gets the latest prices once it catches up and never makes
+the publisher wait or use more memory.
+
+Each open connection is a response being streamed, so it holds a worker
+thread (or greenlet) of the server for as long as the page is open; serve
+the application with an asynchronous worker (e.g. gunicorn -k gevent) for
+many open pages.
+"""
+import json
+import logging
+import threading
+
+from flask import current_app
+
+from .quotes import get_quote_cache
+
+# The publisher thread has no request, so log to a child of the application's logger
+logger = logging.getLogger(__name__)
+
+# Held while the quote publisher of an application is created, so concurrent first requests share one
+_publisher_lock = threading.Lock()
+
+
+class Subscription:
+    """
+    Class that collects the price changes of a set of symbols for one client
+
+    `wait()` returns the prices (symbol -> price in cents) that changed since
+    the last call, waiting for a change if there are none.
+    """
+
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self._changes = {}
+        self._lock = threading.Lock()
+        self._changed = threading.Event()
+
+    def publish(self, prices):
+        with self._lock:
+            self._changes.update(prices)
+        self._changed.set()
+
+    def wait(self, timeout=None):
+        """
+        Return the prices that changed, or an empty dictionary after `timeout` seconds without a change
+        """
+        self._changed.wait(timeout)
+        with self._lock:
+            changes, self._changes = self._changes, {}
+            self._changed.clear()
+        return changes
+
+
+class QuotePublisher:
+    """
+    Class that polls the prices of the subscribed symbols and publishes the changes to the subscriptions
+
+    The poll loop runs on a background thread, started by `start()`; it
+    doesn't poll while there are no subscriptions.
+    """
+
+    def __init__(self, quote_cache, interval=5.0):
+        self.quote_cache = quote_cache
+        self.interval = interval
+        # Number of polls of the quote cache (one batch of symbols each)
+        self.polls = 0
+        # stock symbol -> subscriptions of the symbol
+        self._subscriptions = {}
+        # stock symbol -> last price published (in cents)
+        self._prices = {}
+        self._lock = threading.Lock()
+        self._wake_up = threading.Event()
+        self._thread = None
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for subscriptions in self._subscriptions.values()
+                        for subscription in subscriptions})
+
+    def start(self):
+        """
+        Start the poll loop thread (if it isn't running yet)
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='quote-publisher', daemon=True)
+                self._thread.start()
+
+    def subscribe(self, symbols):
+        """
+        Return a new `Subscription` to the prices of `symbols`, which already
+        holds the last prices published for them
+        """
+        subscription = Subscription(symbol.upper() for symbol in symbols)
+        with self._lock:
+            new_symbols = False
+            for symbol in subscription.symbols:
+                if symbol not in self._subscriptions:
+                    self._subscriptions[symbol] = set()
+                    new_symbols = True
+                self._subscriptions[symbol].add(subscription)
+            known = {symbol: self._prices[symbol] for symbol in subscription.symbols if symbol in self._prices}
+        if known:
+            subscription.publish(known)
+        if new_symbols:
+            # Poll the new symbols now, rather than at the end of the interval
+            self._wake_up.set()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for symbol in subscription.symbols:
+                subscriptions = self._subscriptions.get(symbol)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        # Nobody holds the symbol anymore, so it isn't polled
+                        del self._subscriptions[symbol]
+                        self._prices.pop(symbol, None)
+
+    def poll(self):
+        """
+        Fetch the prices of the subscribed symbols (in one call to the quote
+        cache) and publish the changed ones to their subscriptions
+
+        Returns the prices that changed.
+        """
+        with self._lock:
+            symbols = list(self._subscriptions)
+        if not symbols:
+            return {}
+        prices = self.quote_cache.get_prices(symbols)
+        self.polls += 1
+
+        changes = {}
+        with self._lock:
+            for symbol, price in prices.items():
+                if symbol in self._subscriptions and self._prices.get(symbol) != price:
+                    self._prices[symbol] = price
+                    changes[symbol] = price
+            # Only the subscriptions of the symbols that changed are given the new prices
+            updates = {}
+            for symbol, price in changes.items():
+                for subscription in self._subscriptions[symbol]:
+                    updates.setdefault(subscription, {})[symbol] = price
+        for subscription, subscription_prices in updates.items():
+            subscription.publish(subscription_prices)
+        return changes
+
+    def _run(self):
+        while True:
+            self._wake_up.wait(self.interval)
+            self._wake_up.clear()
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Error while polling the quotes of the stock stream')
+
+
+def get_quote_publisher():
+    """
+    Return the quote publisher of the current Flask application, or None if
+    no quote provider is configured
+    """
+    if 'quote_publisher' not in current_app.extensions:
+        with _publisher_lock:
+            if 'quote_publisher' not in current_app.extensions:
+                quote_cache = get_quote_cache()
+                current_app.extensions['quote_publisher'] = None if quote_cache is None else \
+                    QuotePublisher(quote_cache, interval=current_app.config.get('QUOTES_STREAM_INTERVAL', 5.0))
+    return current_app.extensions['quote_publisher']
+
+
+def stream_position_values(publisher, positions, keepalive=15.0):
+    """
+    Generate the Server-Sent Events of the changes of the prices of
+    `positions` (`Positions` with one aggregated position per symbol)
+
+    Each event is a JSON object with the changed symbols (price, market
+    value and gain of the position) and the totals of the portfolio; all
+    the amounts are in dollars. Symbols without a price are valued at their
+    purchase price, the same as on the stocks page.
+    """
+    symbols = [symbol.upper() for symbol in positions.symbols]
+    shares = dict(zip(symbols, positions.number_of_shares.tolist()))
+    cost_basis = dict(zip(symbols, positions.cost_basis.tolist()))
+    market_values = dict(cost_basis)
+    subscription = publisher.subscribe(symbols)
+    try:
+        # Tell the browser how long to wait before reconnecting (in milliseconds)
+        yield f'retry: {int(keepalive * 1000)}\n\n'
+        while True:
+            changes = subscription.wait(keepalive)
+            if not changes:
+                yield ': keep-alive\n\n'
+                continue
+            quotes = {}
+            for symbol, price in changes.items():
+                market_values[symbol] = shares[symbol] * price
+                quotes[symbol] = {'price': price / 100,
+                                  'market_value': market_values[symbol] / 100,
+                                  'gain': (market_values[symbol] - cost_basis[symbol]) / 100}
+            total_market_value = sum(market_values.values())
+            total_cost_basis = sum(cost_basis.values())
+            data = json.dumps({'quotes': quotes,
+                               'portfolio': {'market_value': total_market_value / 100,
+                                             'gain': (total_market_value - total_cost_basis) / 100}})
+            yield f'event: quotes\ndata: {data}\n\n'
+    finally:
+        # The client disconnected (the generator is closed)
+        publisher.unsubscribe(subscription)
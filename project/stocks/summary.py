@@ -0,0 +1,217 @@
+"""
+Materialized summaries of the portfolio of each user.
+
+Two small tables are kept up to date in the same transaction as the stocks
+that are added, so the pages that show totals read a few rows instead of
+aggregating every `Stock` row of the user on each request:
+
+    * position_summaries - one row per user and stock symbol: total shares,
+      total cost basis and number of stocks (lots)
+    * portfolio_summaries - one row per user: the totals of the whole portfolio
+
+Every path that writes stocks updates the summaries with `add_stocks()` (a
+few `Stock` objects, e.g. 'Add a Stock' and 'flask stocks create') or
+`update_summaries()` (rows of column values, e.g. the bulk import). The
+summaries are updated with one INSERT ... ON CONFLICT DO UPDATE statement
+per table, which adds the new totals to the existing ones, so concurrent
+writes for the same user never overwrite each other's totals.
+
+If the stocks are changed in any other way (e.g. directly in the database),
+the summaries are recomputed from the stocks table with
+'flask stocks rebuild-summary' (`rebuild_summaries()`).
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import select, insert, delete, func, literal, cast, BigInteger
+from sqlalchemy.dialects import postgresql, sqlite
+
+from project import database
+from project.models import Stock, PositionSummary, PortfolioSummary
+from .valuation import Positions
+from .fragments import record_changed_portfolios
+
+# Dialects that support INSERT ... ON CONFLICT DO UPDATE
+UPSERT_DIALECTS = {'postgresql': postgresql.insert, 'sqlite': sqlite.insert}
+
+
+class RebuildResult:
+    """
+    Class that summarizes a rebuild of the summaries
+
+    The following attributes are available:
+        * positions - number of position summaries written
+        * portfolios - number of portfolio summaries written
+        * elapsed - time taken by the rebuild (seconds)
+    """
+
+    def __init__(self, positions=0, portfolios=0, elapsed=0.0):
+        self.positions = positions
+        self.portfolios = portfolios
+        self.elapsed = elapsed
+
+
+def add_stocks(stocks):
+    """
+    Add `stocks` (`Stock` objects) to the session and their totals to the summaries
+
+    The changes are committed together with the caller's transaction.
+    """
+    database.session.add_all(stocks)
+    update_summaries({'user_id': stock.user_id,
+                      'stock_symbol': stock.stock_symbol,
+                      'number_of_shares': stock.number_of_shares,
+                      'purchase_price': stock.purchase_price} for stock in stocks)
+
+
+def update_summaries(rows):
+    """
+    Add the totals of `rows` (dictionaries with the columns of the stocks
+    table) to the position and portfolio summaries of their owners
+
+    The rows are first added up per user and symbol, so a batch of stocks
+    costs one row per distinct symbol.
+    """
+    positions = {}
+    for row in rows:
+        key = (row['user_id'], row['stock_symbol'])
+        totals = positions.setdefault(key, [0, 0, 0])
+        totals[0] += row['number_of_shares']
+        totals[1] += row['number_of_shares'] * row['purchase_price']
+        totals[2] += 1
+    if not positions:
+        return
+
+    portfolios = {}
+    for (user_id, _), (shares, cost_basis, lot_count) in positions.items():
+        totals = portfolios.setdefault(user_id, [0, 0, 0])
+        totals[0] += shares
+        totals[1] += cost_basis
+        totals[2] += lot_count
+
+    _upsert(PositionSummary,
+            [{'user_id': user_id, 'stock_symbol': symbol, 'number_of_shares': shares,
+              'cost_basis': cost_basis, 'lot_count': lot_count}
+             for (user_id, symbol), (shares, cost_basis, lot_count) in positions.items()],
+            keys=['user_id', 'stock_symbol'],
+            increments=['number_of_shares', 'cost_basis', 'lot_count'])
+
+    now = datetime.utcnow()
+    # Every write bumps the version of the portfolio, which invalidates the
+    # cached copies of the portfolio pages (see project/stocks/conditional.py)
+    _upsert(PortfolioSummary,
+            [{'user_id': user_id, 'position_count': 0, 'number_of_shares': shares,
+              'cost_basis': cost_basis, 'lot_count': lot_count, 'version': 1, 'updated_at': now}
+             for user_id, (shares, cost_basis, lot_count) in portfolios.items()],
+            keys=['user_id'],
+            increments=['number_of_shares', 'cost_basis', 'lot_count', 'version'],
+            replacements=['updated_at'])
+
+    # The rendered stocks tables of the users are out of date once this is committed
+    record_changed_portfolios(portfolios)
+
+    # The number of positions depends on whether the symbols are new, so it is
+    # counted again from the (small) position summaries of each user
+    portfolio_table = PortfolioSummary.__table__
+    database.session.execute(portfolio_table.update()
+                             .where(portfolio_table.c.user_id.in_(list(portfolios)))
+                             .values(position_count=select(func.count())
+                                     .select_from(PositionSummary)
+                                     .where(PositionSummary.user_id == portfolio_table.c.user_id)
+                                     .scalar_subquery()))
+
+
+def _upsert(model, rows, keys, increments, replacements=()):
+    """
+    Insert `rows` into the table of `model`, or, for the rows whose `keys`
+    already exist, add their `increments` columns to the existing values
+    """
+    table = model.__table__
+    build_insert = UPSERT_DIALECTS.get(database.session.get_bind().dialect.name)
+    if build_insert is not None:
+        statement = build_insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=keys,
+            set_={**{column: table.c[column] + statement.excluded[column] for column in increments},
+                  **{column: statement.excluded[column] for column in replacements}})
+        database.session.execute(statement)
+        return
+
+    # Other databases: UPDATE the existing rows, then INSERT the missing ones
+    for row in rows:
+        updated = database.session.execute(
+            table.update()
+            .where(*(table.c[column] == row[column] for column in keys))
+            .values(**{column: table.c[column] + row[column] for column in increments},
+                    **{column: row[column] for column in replacements}))
+        if updated.rowcount == 0:
+            database.session.execute(table.insert().values(**row))
+
+
+def rebuild_summaries(user_id=None):
+    """
+    Recompute the position and portfolio summaries (of every user, or of
+    `user_id`) from the stocks table, and commit them
+
+    The totals are computed by the database (INSERT ... SELECT with GROUP BY),
+    so no rows are loaded into Python.
+    """
+    start = time.perf_counter()
+    delete_positions = delete(PositionSummary)
+    delete_portfolios = delete(PortfolioSummary)
+    stocks = (select(Stock.user_id,
+                     Stock.stock_symbol,
+                     func.sum(Stock.number_of_shares),
+                     # (the product of two INTEGER columns would overflow on PostgreSQL)
+                     func.sum(cast(Stock.number_of_shares, BigInteger) * Stock.purchase_price),
+                     func.count())
+              .group_by(Stock.user_id, Stock.stock_symbol))
+    # (the versions start again from 0, but the new `updated_at` still changes the ETags)
+    positions = (select(PositionSummary.user_id,
+                        func.count(),
+                        func.sum(PositionSummary.lot_count),
+                        func.sum(PositionSummary.number_of_shares),
+                        func.sum(PositionSummary.cost_basis),
+                        literal(0),
+                        literal(datetime.utcnow()))
+                 .group_by(PositionSummary.user_id))
+    if user_id is not None:
+        delete_positions = delete_positions.where(PositionSummary.user_id == user_id)
+        delete_portfolios = delete_portfolios.where(PortfolioSummary.user_id == user_id)
+        stocks = stocks.where(Stock.user_id == user_id)
+        positions = positions.where(PositionSummary.user_id == user_id)
+
+    record_changed_portfolios([user_id])
+    database.session.execute(delete_positions)
+    database.session.execute(delete_portfolios)
+    position_count = database.session.execute(
+        insert(PositionSummary.__table__).from_select(
+            ['user_id', 'stock_symbol', 'number_of_shares', 'cost_basis', 'lot_count'], stocks)).rowcount
+    portfolio_count = database.session.execute(
+        insert(PortfolioSummary.__table__).from_select(
+            ['user_id', 'position_count', 'lot_count', 'number_of_shares', 'cost_basis', 'version', 'updated_at'],
+            positions)).rowcount
+    database.session.commit()
+    return RebuildResult(position_count, portfolio_count, time.perf_counter() - start)
+
+
+def get_portfolio_summary(user_id):
+    """
+    Return the `PortfolioSummary` of the user `user_id` (None if they have no stocks)
+    """
+    return database.session.get(PortfolioSummary, user_id)
+
+
+def load_position_summaries(user_id):
+    """
+    Load the position summaries of the user `user_id` as `Positions` (one aggregated position per symbol)
+    """
+    rows = database.session.execute(select(PositionSummary.stock_symbol,
+                                           PositionSummary.number_of_shares,
+                                           PositionSummary.cost_basis)
+                                    .where(PositionSummary.user_id == user_id)).all()
+    return Positions(symbols=[row[0] for row in rows],
+                     number_of_shares=[row[1] for row in rows],
+                     # Average purchase price per share (used for symbols without a market price)
+                     purchase_price=[row[2] // row[1] if row[1] else 0 for row in rows],
+                     cost_basis=[row[2] for row in rows])
@@ -0,0 +1,167 @@
+"""
+Vectorized valuation of the positions in a portfolio.
+
+Positions are loaded from the `stocks` table as column arrays (NumPy),
+never as ORM objects, and valued against a price vector keyed by stock
+symbol in a single batched pass:
+
+    cost basis   = number of shares * purchase price
+    market value = number of shares * market price
+    gain         = market value - cost basis
+    weight       = market value / total market value
+
+All amounts are in cents, the same as `Stock.purchase_price`. A position
+whose symbol has no market price is valued at its purchase price.
+"""
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import select
+
+from project import database
+from project.models import Stock
+
+
+class Positions:
+    """
+    Class that holds positions as column arrays (one array per column)
+
+    The following columns are stored:
+        * ids - primary key of each position (`None` for aggregated positions)
+        * symbols - stock symbol of each position (list of str)
+        * number_of_shares - number of shares (int64)
+        * purchase_price - purchase price per share in cents (int64)
+        * cost_basis - total purchase cost in cents (int64, defaults to shares * price)
+    """
+
+    def __init__(self, symbols, number_of_shares, purchase_price, ids=None, cost_basis=None):
+        self.symbols = list(symbols)
+        self.number_of_shares = np.asarray(number_of_shares, dtype=np.int64)
+        self.purchase_price = np.asarray(purchase_price, dtype=np.int64)
+        self.ids = None if ids is None else np.asarray(ids, dtype=np.int64)
+        if cost_basis is None:
+            cost_basis = self.number_of_shares * self.purchase_price
+        self.cost_basis = np.asarray(cost_basis, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+        Build the column arrays from (id, stock_symbol, number_of_shares, purchase_price) rows
+        """
+        rows = list(rows)
+        count = len(rows)
+        return cls(symbols=[row[1] for row in rows],
+                   number_of_shares=np.fromiter((row[2] for row in rows), dtype=np.int64, count=count),
+                   purchase_price=np.fromiter((row[3] for row in rows), dtype=np.int64, count=count),
+                   ids=np.fromiter((row[0] for row in rows), dtype=np.int64, count=count))
+
+    @classmethod
+    def from_stocks(cls, stocks):
+        """
+        Build the column arrays from `Stock` objects that were already loaded (e.g. a page of results)
+        """
+        return cls.from_rows((stock.id, stock.stock_symbol, stock.number_of_shares, stock.purchase_price)
+                             for stock in stocks)
+
+
+class Valuation:
+    """
+    Class that holds the result of valuing `Positions` (one array per metric, all in cents)
+
+    Per-position arrays: market_price, cost_basis, market_value, gain, gain_percent, weight, priced
+    Portfolio totals: total_cost_basis, total_market_value, total_gain, total_gain_percent
+    """
+
+    def __init__(self, positions, market_price, priced):
+        self.positions = positions
+        self.market_price = market_price
+        self.priced = priced
+        self.cost_basis = positions.cost_basis
+        # Unpriced positions are worth exactly what was paid for them
+        self.market_value = np.where(priced, positions.number_of_shares * market_price, self.cost_basis)
+        self.gain = self.market_value - self.cost_basis
+
+        self.total_cost_basis = int(self.cost_basis.sum())
+        self.total_market_value = int(self.market_value.sum())
+        self.total_gain = self.total_market_value - self.total_cost_basis
+        self.total_gain_percent = _percent(self.total_gain, self.total_cost_basis)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.gain_percent = np.where(self.cost_basis != 0,
+                                         self.gain * 100.0 / self.cost_basis, 0.0)
+            self.weight = np.where(self.total_market_value != 0,
+                                   self.market_value * 100.0 / self.total_market_value, 0.0)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def rows(self):
+        """
+        Yield one dictionary per position (for templates and CLI output)
+        """
+        ids = self.positions.ids
+        for index, symbol in enumerate(self.positions.symbols):
+            yield {
+                'id': None if ids is None else int(ids[index]),
+                'stock_symbol': symbol,
+                'number_of_shares': int(self.positions.number_of_shares[index]),
+                'purchase_price': int(self.positions.purchase_price[index]),
+                'market_price': int(self.market_price[index]),
+                'cost_basis': int(self.cost_basis[index]),
+                'market_value': int(self.market_value[index]),
+                'gain': int(self.gain[index]),
+                'gain_percent': float(self.gain_percent[index]),
+                'weight': float(self.weight[index]),
+                'priced': bool(self.priced[index]),
+            }
+
+
+def value_positions(positions, prices):
+    """
+    Value `positions` against `prices` (a mapping of stock symbol -> price in cents)
+
+    The symbols are factorized into integer codes so that the price lookup is
+    done once per distinct symbol and then broadcast to every position with a
+    single array indexing operation.
+    """
+    # A symbol seen for the first time gets the next code (0, 1, 2, ...); `map`
+    # keeps the per-position loop in C rather than in a Python generator
+    codes_by_symbol = defaultdict()
+    codes_by_symbol.default_factory = codes_by_symbol.__len__
+    codes = np.fromiter(map(codes_by_symbol.__getitem__, positions.symbols),
+                        dtype=np.int64, count=len(positions))
+
+    # One entry per distinct symbol; -1 marks a symbol without a market price
+    price_vector = np.fromiter((_price_or_missing(prices.get(symbol)) for symbol in codes_by_symbol),
+                               dtype=np.int64, count=len(codes_by_symbol))
+
+    position_prices = price_vector[codes]
+    priced = position_prices >= 0
+    market_price = np.where(priced, position_prices, positions.purchase_price)
+    return Valuation(positions, market_price, priced)
+
+
+def load_positions(query=None, user_id=None):
+    """
+    Load every position selected by `query` (default: all stocks, or the stocks
+    owned by `user_id`) into column arrays
+
+    The rows are read with a Core SELECT of the four needed columns, so no ORM
+    objects are created.
+    """
+    if query is None:
+        query = select(Stock.id, Stock.stock_symbol, Stock.number_of_shares, Stock.purchase_price)
+        if user_id is not None:
+            query = query.where(Stock.user_id == user_id)
+    return Positions.from_rows(database.session.execute(query))
+
+
+def _price_or_missing(price):
+    return -1 if price is None else int(price)
+
+
+def _percent(numerator, denominator):
+    return numerator * 100.0 / denominator if denominator else 0.0
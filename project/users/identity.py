@@ -0,0 +1,135 @@
+"""
+Cache of the logged in users, used by Flask-Login's `user_loader` callback.
+
+Flask-Login reloads the user (`current_user`) from the session on every
+request. Instead of querying the database each time, the columns of the
+user are cached by user id for a short time and the `User` object is
+rebuilt from them (as a detached instance, so it can still be added back
+to the database session and changed).
+
+The cache is configured by the Flask application:
+    * USER_CACHE_BACKEND - 'memory' (an LRU cache in each process, the default),
+      'redis' (shared by every process) or 'none' (always query the database)
+    * USER_CACHE_TTL - seconds that a user is cached (default: 30)
+    * USER_CACHE_SIZE - maximum number of users in the 'memory' cache (default: 1024)
+    * USER_CACHE_REDIS_URL - Redis database of the 'redis' cache (default: redis://localhost:6379/0)
+
+A user is removed from the cache when a change to it (or its deletion) is
+committed through the ORM session. Changes made with bulk UPDATE statements
+are not seen, and with the 'memory' backend only the process that made the
+change drops its entry, so the other processes can use the old values until
+the TTL runs out.
+"""
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from project import database
+from project.cache import TTLCache, RedisCache, MISSING
+from project.models import User
+
+USER_CACHE_BACKENDS = ('memory', 'redis', 'none')
+
+
+def create_user_cache(config):
+    """
+    Create the user cache selected by the configuration, or None if it is disabled
+    """
+    backend = config.get('USER_CACHE_BACKEND', 'memory')
+    ttl = config.get('USER_CACHE_TTL', 30.0)
+    if backend == 'memory':
+        return TTLCache(maxsize=config.get('USER_CACHE_SIZE', 1024), ttl=ttl)
+    if backend == 'redis':
+        return RedisCache(config.get('USER_CACHE_REDIS_URL', 'redis://localhost:6379/0'), prefix='user:', ttl=ttl)
+    if backend == 'none':
+        return None
+    raise ValueError(f'Invalid user cache backend ({backend}), expected one of: {", ".join(USER_CACHE_BACKENDS)}')
+
+
+def get_user_cache():
+    """
+    Return the user cache of the current Flask application (None if it is disabled)
+
+    The cache is created the first time it is used.
+    """
+    if 'user_cache' not in current_app.extensions:
+        current_app.extensions['user_cache'] = create_user_cache(current_app.config)
+    return current_app.extensions['user_cache']
+
+
+def load_user(user_id):
+    """
+    Return the User with the ID `user_id` (a string), or None if there is no such user
+    """
+    user_id = int(user_id)
+    user_cache = get_user_cache()
+    if user_cache is None:
+        return database.session.get(User, user_id)
+
+    # A user that is already in the session (e.g. just logged in) is used as is
+    user = database.session.identity_map.get(database.session.identity_key(User, user_id))
+    if user is not None:
+        return user
+
+    columns = user_cache.get(user_id)
+    if columns is MISSING:
+        user = database.session.get(User, user_id)
+        if user is not None:
+            user_cache.set(user_id, _get_columns(user))
+        return user
+    return _build_user(columns)
+
+
+def invalidate_user(user_id):
+    """
+    Remove the user with the ID `user_id` from the cache
+    """
+    user_cache = get_user_cache()
+    if user_cache is not None:
+        user_cache.delete(int(user_id))
+
+
+def _get_columns(user):
+    return {column.key: getattr(user, column.key) for column in User.__table__.columns}
+
+
+def _build_user(columns):
+    # Create the User without calling __init__() (which hashes the password) and
+    # mark it as loaded from the database rather than as a new user
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in columns.items():
+        setattr(user, key, value)
+    make_transient_to_detached(user)
+    return user
+
+
+# ----------------
+# Invalidation
+# ----------------
+
+def _record_changed_user(mapper, connection, target):
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(target.id)
+
+
+def _invalidate_changed_users(session):
+    if not has_app_context():
+        return
+    for user_id in session.info.pop('changed_user_ids', ()):
+        invalidate_user(user_id)
+
+
+def _discard_changed_users(session, previous_transaction):
+    session.info.pop('changed_user_ids', None)
+
+
+def register_user_cache_invalidation():
+    """
+    Remove the users from the cache when changes to them are committed (once per process)
+    """
+    if not event.contains(User, 'after_update', _record_changed_user):
+        event.listen(User, 'after_update', _record_changed_user)
+        event.listen(User, 'after_delete', _record_changed_user)
+        event.listen(Session, 'after_commit', _invalidate_changed_users)
+        event.listen(Session, 'after_soft_rollback', _discard_changed_users)
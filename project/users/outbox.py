@@ -0,0 +1,226 @@
+"""
+Durable outbox for the emails sent by the application.
+
+Instead of sending an email on a new thread during the request, the email
+is added to the `outbox` table (`queue_email()`) in the same transaction as
+the change that causes it. The outbox is drained in batches by a single
+worker, which sends each batch over one SMTP connection (`mail.connect()`):
+
+    * 'flask users send-mail' - runs the worker as its own process (recommended
+      in production, so there is one worker however many gunicorn workers there are)
+    * MAIL_OUTBOX_THREAD - also run the worker on a background thread of the
+      application, woken up whenever an email is queued (default: True, except
+      when testing)
+
+An email that fails is retried with an exponential backoff, and marked as
+'failed' after the maximum number of attempts:
+    * MAIL_OUTBOX_BATCH_SIZE - number of emails sent per batch (default: 50)
+    * MAIL_OUTBOX_MAX_ATTEMPTS - number of attempts before giving up (default: 5)
+    * MAIL_OUTBOX_RETRY_DELAY - seconds before the first retry; doubled for each
+      further retry, up to MAIL_OUTBOX_MAX_RETRY_DELAY (defaults: 30 and 3600)
+    * MAIL_OUTBOX_POLL_INTERVAL - seconds between checks for emails to retry (default: 30)
+
+A batch is claimed by the worker before it is sent (its emails are not due
+again until the claim runs out), so several workers never send the same
+email, and the emails of a worker that stopped mid-batch are sent again
+once the claim has run out.
+"""
+import logging
+import smtplib
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import select, update
+
+from project import database, mail
+from project.models import OutboxMessage
+
+# The worker thread has no request, so log to a child of the application's logger
+logger = logging.getLogger(__name__)
+
+# Seconds that a claimed batch is reserved for the worker that claimed it
+CLAIM_TIMEOUT = 300
+
+# Errors that mean the SMTP connection (rather than a single email) failed
+# (all the smtplib errors are sub-classes of OSError, so the order of the checks matters)
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class SendResult:
+    """
+    Class that counts the emails sent, retried and given up by `send_queued_emails()`
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    @property
+    def total(self):
+        return self.sent + self.retried + self.failed
+
+
+def queue_email(recipients, subject, body, sender=None):
+    """
+    Add an email to the outbox (committed together with the caller's transaction)
+    """
+    message = OutboxMessage(recipients, subject, body, sender)
+    database.session.add(message)
+    return message
+
+
+def send_queued_emails(batch_size=None, now=None):
+    """
+    Send one batch of the emails that are due, over a single SMTP connection
+    """
+    config = current_app.config
+    batch_size = batch_size or config.get('MAIL_OUTBOX_BATCH_SIZE', 50)
+    now = now or datetime.utcnow()
+    result = SendResult()
+
+    messages = _claim_batch(batch_size, now)
+    if not messages:
+        return result
+
+    try:
+        with mail.connect() as connection:
+            for index, message in enumerate(messages):
+                try:
+                    connection.send(_build_message(message))
+                except CONNECTION_ERRORS as error:
+                    # The connection is gone, so retry the rest of the batch later
+                    for unsent in messages[index:]:
+                        _record_failure(unsent, error, now, result)
+                    break
+                except Exception as error:
+                    _record_failure(message, error, now, result)
+                else:
+                    message.status = 'sent'
+                    message.sent_at = datetime.utcnow()
+                    message.claim_token = None
+                    result.sent += 1
+    except OSError as error:
+        # Connecting to (or disconnecting from) the SMTP server failed
+        for message in messages:
+            if message.status == 'pending' and message.claim_token is not None:
+                _record_failure(message, error, now, result)
+
+    database.session.commit()
+    return result
+
+
+def drain_outbox(batch_size=None, now=None):
+    """
+    Send batches of emails until there are no more emails due (or a batch couldn't be sent)
+    """
+    total = SendResult()
+    while True:
+        result = send_queued_emails(batch_size, now)
+        total.sent += result.sent
+        total.retried += result.retried
+        total.failed += result.failed
+        if not result.sent:
+            return total
+
+
+def _claim_batch(batch_size, now):
+    token = uuid.uuid4().hex
+    due = (select(OutboxMessage.id)
+           .where(OutboxMessage.status == 'pending', OutboxMessage.next_attempt_at <= now)
+           .order_by(OutboxMessage.id)
+           .limit(batch_size))
+    # The conditions are checked again by the UPDATE, so a batch claimed by another
+    # worker in the meantime is skipped
+    database.session.execute(update(OutboxMessage)
+                             .where(OutboxMessage.id.in_(due.scalar_subquery()),
+                                    OutboxMessage.status == 'pending',
+                                    OutboxMessage.next_attempt_at <= now)
+                             .values(claim_token=token,
+                                     next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT))
+                             .execution_options(synchronize_session=False))
+    database.session.commit()
+    return database.session.scalars(select(OutboxMessage)
+                                    .where(OutboxMessage.claim_token == token)
+                                    .order_by(OutboxMessage.id)).all()
+
+
+def _build_message(message):
+    return Message(subject=message.subject,
+                   body=message.body,
+                   recipients=message.recipients.split(','),
+                   sender=message.sender)
+
+
+def _record_failure(message, error, now, result):
+    config = current_app.config
+    message.attempts += 1
+    message.last_error = f'{type(error).__name__}: {error}'[:500]
+    message.claim_token = None
+    if message.attempts >= config.get('MAIL_OUTBOX_MAX_ATTEMPTS', 5):
+        message.status = 'failed'
+        result.failed += 1
+        logger.error(f'Gave up sending email {message.id} after {message.attempts} attempts: {message.last_error}')
+    else:
+        delay = min(config.get('MAIL_OUTBOX_RETRY_DELAY', 30) * 2 ** (message.attempts - 1),
+                    config.get('MAIL_OUTBOX_MAX_RETRY_DELAY', 3600))
+        message.next_attempt_at = now + timedelta(seconds=delay)
+        result.retried += 1
+        logger.warning(f'Failed to send email {message.id} (attempt {message.attempts}), '
+                       f'retrying in {delay} seconds: {message.last_error}')
+
+
+# ----------------
+# Worker thread
+# ----------------
+
+class OutboxWorker:
+    """
+    Class that drains the outbox on a background thread of the application
+
+    The thread is started the first time `notify()` is called, and then
+    drains the outbox whenever it is notified of a new email, or every
+    `poll_interval` seconds (for the emails to be retried).
+    """
+
+    def __init__(self, app, poll_interval=30.0):
+        self.app = app
+        self.poll_interval = poll_interval
+        self._wake_up = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def notify(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='outbox-worker', daemon=True)
+                self._thread.start()
+        self._wake_up.set()
+
+    def _run(self):
+        while True:
+            self._wake_up.wait(self.poll_interval)
+            self._wake_up.clear()
+            with self.app.app_context():
+                try:
+                    drain_outbox()
+                except Exception:
+                    database.session.rollback()
+                    logger.exception('Error while sending the emails in the outbox')
+                finally:
+                    database.session.remove()
+
+
+def notify_outbox_worker():
+    """
+    Wake up the outbox worker thread of the current application (if it is enabled)
+    """
+    if not current_app.config.get('MAIL_OUTBOX_THREAD', not current_app.testing):
+        return
+    if 'outbox_worker' not in current_app.extensions:
+        poll_interval = current_app.config.get('MAIL_OUTBOX_POLL_INTERVAL', 30.0)
+        current_app.extensions['outbox_worker'] = OutboxWorker(current_app._get_current_object(), poll_interval)
+    current_app.extensions['outbox_worker'].notify()
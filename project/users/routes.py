@@ -1,14 +1,36 @@
+import time
 from urllib.parse import urlparse
+import click
 from . import users_blueprint
-from flask import render_template, flash, abort, request, current_app, redirect, url_for, escape, \
-    copy_current_request_context
+from flask import render_template, flash, abort, request, current_app, redirect, url_for, escape
 from .forms import RegistrationForm, LoginForm
+from .outbox import queue_email, notify_outbox_worker, drain_outbox
 from project.models import User
-from project import database, mail
+from project.stocks.summary import get_portfolio_summary
+from project import database
+from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 from flask_login import login_user, current_user, login_required, logout_user
-from flask_mail import Message
-from threading import Thread
+
+
+# --------------
+# CLI Commands
+# --------------
+
+@users_blueprint.cli.command('send-mail')
+@click.option('--once', is_flag=True, help='Send the emails that are due and exit')
+@click.option('--interval', default=5.0, show_default=True, help='Seconds between checks for new emails')
+@click.option('--batch-size', default=50, show_default=True, help='Number of emails sent per SMTP connection')
+def send_mail(once, interval, batch_size):
+    """Send the emails in the outbox (runs until interrupted, unless --once is given)"""
+    while True:
+        result = drain_outbox(batch_size)
+        if result.total:
+            click.echo(f'Sent {result.sent} emails ({result.retried} to be retried, {result.failed} failed)')
+        if once:
+            break
+        database.session.remove()
+        time.sleep(interval)
 
 
 # --------------
@@ -39,33 +61,22 @@ def register():
         # Checks validators and the CSRF token is correct
         if form.validate_on_submit():
             try:
-                new_user = User(form.email.data, form.password.data)
+                # The email is stored in lower case (see User), so an email that
+                # only differs in case from an existing one is a duplicate
+                new_user = User(form.email.data.lower(), form.password.data)
                 database.session.add(new_user)
+
+                # Send email to the user that they have registered: the email is added to
+                # the outbox in the same transaction as the user, and sent by the outbox worker
+                queue_email(recipients=[form.email.data],
+                            subject='Registration - Flask Stock Portfolio App',
+                            body='Thanks for registering with the Flask Stock Portfolio App!')
                 database.session.commit()
+                notify_outbox_worker()
+
                 flash(f'Thanks for registering, {new_user.email}!')
                 current_app.logger.info(f'Registered new user: {form.email.data}!')
 
-                # The function that runs in the separate thread
-                # copy the request and application context
-                # to the separate thread using the @copy_current_request_context
-                @copy_current_request_context
-                def send_email(message):
-                    with current_app.app_context():
-                        mail.send(message)
-
-                # Send email to the user that they have registered - NEW!!
-                msg = Message(subject="Registration - Flask Stock Portfolio App",
-                              body="Thanks for registering with the Flask Stock Portfolio App!",
-                              recipients=[form.email.data])
-
-                # mail.send(msg)
-
-                # Create a separate thread to handle sending email in an async manner -
-                # as a background task -
-                # as sending requires communication with GMail SMTP server
-                email_thread = Thread(target=send_email, args=[msg])
-                email_thread.start()
-
                 return redirect(url_for('users.login'))
             except IntegrityError:
                 database.session.rollback()
@@ -93,8 +104,15 @@ def login():
 
     if request.method == 'POST':
         if form.validate_on_submit():
-            user = User.query.filter_by(email=form.email.data).first()
+            # Email addresses are case-insensitive (uses the index on lower(email))
+            user = User.query.filter(func.lower(User.email) == form.email.data.lower()).first()
             if user and user.is_password_correct(form.password.data):
+                # Upgrade a password hash created with a weaker setting (e.g. fewer iterations)
+                if user.password_needs_rehash():
+                    user.set_password(form.password.data)
+                    database.session.commit()
+                    current_app.logger.info(f'Upgraded password hash for user: {user.email}')
+
                 # User's credentials have been validated, so log them in
                 login_user(user, remember=form.remember_me.data)
                 flash(f'Thanks for logging in, {current_user.email}!')
@@ -135,4 +153,5 @@ def logout():
 @users_blueprint.route('/profile')
 @login_required
 def user_profile():
-    return render_template('profile.html')
+    # The portfolio totals are read from the user's summary row (no aggregation)
+    return render_template('profile.html', portfolio_summary=get_portfolio_summary(current_user.id))
@@ -1,3 +1,4 @@
+import json
 import pytest
 from project import create_app
 from flask import current_app  # <--- proxy
@@ -7,7 +8,7 @@ from project import database
 
 @pytest.fixture(scope='module')
 def new_stock():
-    stock = Stock('AAPL', '16', '406.78')
+    stock = Stock('AAPL', '16', '406.78', 17)
     return stock
 
 
@@ -51,6 +52,13 @@ def register_default_user(test_client):
     return
 
 
+@pytest.fixture(scope='function')
+def default_user_id(test_client, register_default_user):
+    # ID of the default user (e.g. to add stocks to their portfolio)
+    with test_client.application.app_context():
+        return User.query.filter_by(email='siri@email.com').first().id
+
+
 @pytest.fixture(scope='function')
 def log_in_default_user(test_client, register_default_user):
     # Log in the default user
@@ -62,3 +70,16 @@ def log_in_default_user(test_client, register_default_user):
 
     # Log out the default user
     test_client.get('/users/logout', follow_redirects=True)
+
+
+@pytest.fixture(scope='function')
+def quotes_file(test_client, tmp_path):
+    # Serve stock quotes from a local JSON file (StubQuoteProvider) instead of a market data API
+    filename = tmp_path / 'quotes.json'
+    filename.write_text(json.dumps({'AAPL': 432.17, 'HD': 300.00, 'DIS': 100.00}))
+    test_client.application.config['QUOTES_FILE'] = str(filename)
+    test_client.application.extensions.pop('quote_cache', None)
+    yield filename  # this is where the testing happens
+
+    test_client.application.config.pop('QUOTES_FILE')
+    test_client.application.extensions.pop('quote_cache', None)
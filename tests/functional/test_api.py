@@ -0,0 +1,192 @@
+"""
+This file (test_api.py) contains the functional tests for the api blueprint.
+"""
+import re
+
+from project import database
+from project.models import Stock
+from project.stocks.summary import rebuild_summaries
+from project.stocks.quotes import get_quote_cache
+
+
+def delete_api_stocks(test_client, symbols):
+    with test_client.application.app_context():
+        Stock.query.filter(Stock.stock_symbol.in_(symbols)).delete()
+        database.session.commit()
+        rebuild_summaries()
+
+
+def test_api_requires_login(test_client):
+    """
+    GIVEN a Flask application
+    WHEN the '/api/v1/stocks' endpoint is requested (GET) without logging in
+    THEN check the response is 401 Unauthorized (JSON), not a redirect to the login page
+    """
+    response = test_client.get('/api/v1/stocks')
+    assert response.status_code == 401
+    assert response.json == {'error': 'Authentication required'}
+
+
+def test_api_create_and_list_stocks(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and a logged in user
+    WHEN stocks are added with '/api/v1/stocks' (POST) and listed page by page (GET)
+    THEN check the stocks are returned with the purchase price in dollars, and the cursors walk every page
+    """
+    try:
+        for symbol in ('APIA', 'APIB', 'APIC'):
+            response = test_client.post('/api/v1/stocks',
+                                        json={'stock_symbol': symbol.lower(), 'number_of_shares': '10',
+                                              'purchase_price': '172.50'})
+            assert response.status_code == 201
+            assert response.json['stock_symbol'] == symbol
+            assert response.json['purchase_price'] == 172.5
+
+        response = test_client.get('/api/v1/stocks?per_page=2')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/json'
+        assert [stock['stock_symbol'] for stock in response.json['stocks']] == ['APIA', 'APIB']
+        assert response.json['stocks'][0] == {'id': response.json['stocks'][0]['id'], 'stock_symbol': 'APIA',
+                                              'number_of_shares': 10, 'purchase_price': 172.5}
+        assert response.json['prev_cursor'] is None
+
+        response = test_client.get(f'/api/v1/stocks?per_page=2&after={response.json["next_cursor"]}')
+        assert [stock['stock_symbol'] for stock in response.json['stocks']] == ['APIC']
+        assert response.json['next_cursor'] is None
+        assert response.json['prev_cursor'] is not None
+    finally:
+        delete_api_stocks(test_client, ['APIA', 'APIB', 'APIC'])
+
+
+def test_api_list_stocks_fields(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and a logged in user with a stock
+    WHEN the '/api/v1/stocks' endpoint is requested (GET) with a selection of fields
+    THEN check only the selected fields are returned, and an unknown field is a 400 error
+    """
+    test_client.post('/api/v1/stocks', json={'stock_symbol': 'APID', 'number_of_shares': 5, 'purchase_price': 10})
+    try:
+        response = test_client.get('/api/v1/stocks?fields=stock_symbol,number_of_shares')
+        assert response.json['stocks'] == [{'stock_symbol': 'APID', 'number_of_shares': 5}]
+
+        response = test_client.get('/api/v1/stocks?fields=stock_symbol,password')
+        assert response.status_code == 400
+        assert 'password' in response.json['error']
+    finally:
+        delete_api_stocks(test_client, ['APID'])
+
+
+def test_api_create_invalid_stock(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and a logged in user
+    WHEN an invalid stock (or a body that isn't JSON) is posted to '/api/v1/stocks' (POST)
+    THEN check the errors of each field are returned, and nothing is added
+    """
+    response = test_client.post('/api/v1/stocks',
+                                json={'stock_symbol': 'TOOLONG', 'number_of_shares': 'ten', 'purchase_price': '1'})
+    assert response.status_code == 422
+    assert {error['field'] for error in response.json['errors']} == {'stock_symbol', 'number_of_shares'}
+
+    response = test_client.post('/api/v1/stocks', data={'stock_symbol': 'AAPL'})
+    assert response.status_code == 400
+
+    assert test_client.get('/api/v1/stocks').json['stocks'] == []
+
+
+def test_api_create_stocks_batch(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and a logged in user
+    WHEN a list of stocks with invalid items is posted to '/api/v1/stocks/batch' (POST)
+    THEN check the valid stocks are added, and the invalid ones are reported with their index
+    """
+    try:
+        response = test_client.post('/api/v1/stocks/batch', json=[
+            {'stock_symbol': 'APIE', 'number_of_shares': 10, 'purchase_price': 12.5},
+            {'stock_symbol': 'APIE1', 'number_of_shares': 10, 'purchase_price': 12.5},
+            {'stock_symbol': 'APIF', 'number_of_shares': 20, 'purchase_price': 1},
+            'AAPL'])
+        assert response.status_code == 201
+        assert response.json['created'] == 2
+        assert [error['index'] for error in response.json['errors']] == [1, 3]
+
+        stocks = test_client.get('/api/v1/stocks?fields=stock_symbol').json['stocks']
+        assert stocks == [{'stock_symbol': 'APIE'}, {'stock_symbol': 'APIF'}]
+
+        response = test_client.post('/api/v1/stocks/batch', json={'stocks': [{'stock_symbol': 'APIE1'}]})
+        assert response.status_code == 422
+        assert response.json['created'] == 0
+    finally:
+        delete_api_stocks(test_client, ['APIE', 'APIF'])
+
+
+def test_api_create_stocks_batch_too_large(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application configured with a maximum batch size
+    WHEN a larger list of stocks is posted to '/api/v1/stocks/batch' (POST)
+    THEN check the request is rejected with 413, and nothing is added
+    """
+    test_client.application.config['API_MAX_BATCH_SIZE'] = 2
+    try:
+        response = test_client.post('/api/v1/stocks/batch', json=[
+            {'stock_symbol': 'APIG', 'number_of_shares': 1, 'purchase_price': 1}] * 3)
+        assert response.status_code == 413
+        assert test_client.get('/api/v1/stocks').json['stocks'] == []
+    finally:
+        test_client.application.config.pop('API_MAX_BATCH_SIZE')
+
+
+def test_api_create_stocks_batch_in_one_transaction(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and a logged in user
+    WHEN a list of 10 stocks and a list of 500 stocks are posted to '/api/v1/stocks/batch' (POST)
+    THEN check the stocks are added with the same number of queries (one INSERT and one commit for the whole list)
+    """
+    try:
+        queries = []
+        for count in (10, 500):
+            response = test_client.post('/api/v1/stocks/batch', json=[
+                {'stock_symbol': 'APIH', 'number_of_shares': index + 1, 'purchase_price': 1.25}
+                for index in range(count)])
+            assert response.status_code == 201
+            assert response.json == {'created': count, 'errors': []}
+            queries.append(re.search(r'(\d+) queries', response.headers['Server-Timing']).group(1))
+        assert queries[0] == queries[1]
+        assert len(test_client.get('/api/v1/stocks?per_page=1000').json['stocks']) == 510
+    finally:
+        delete_api_stocks(test_client, ['APIH'])
+
+
+def test_api_create_stocks_batch_unknown_symbol(test_client, log_in_default_user, quotes_file):
+    """
+    GIVEN a Flask application with a quote provider and a logged in user
+    WHEN a list of stocks with a symbol that doesn't exist is posted to '/api/v1/stocks/batch' (POST)
+    THEN check the stocks of the unknown symbol are reported, and the others are added
+    """
+    try:
+        response = test_client.post('/api/v1/stocks/batch', json=[
+            {'stock_symbol': 'AAPL', 'number_of_shares': 1, 'purchase_price': 100},
+            {'stock_symbol': 'NOPE', 'number_of_shares': 1, 'purchase_price': 100},
+            {'stock_symbol': 'HD', 'number_of_shares': 1, 'purchase_price': 100}])
+        assert response.status_code == 201
+        assert response.json == {'created': 2, 'errors': [{'index': 1, 'message': 'Unknown stock symbol (NOPE)'}]}
+    finally:
+        delete_api_stocks(test_client, ['AAPL', 'HD'])
+
+
+def test_api_create_stocks_batch_provider_down(test_client, log_in_default_user, quotes_file):
+    """
+    GIVEN a Flask application with a quote provider that is unavailable and a logged in user
+    WHEN a list of stocks is posted to '/api/v1/stocks/batch' (POST)
+    THEN check the stocks are added (their symbols can't be checked), and each symbol is requested only once
+    """
+    quotes_file.unlink()
+    try:
+        response = test_client.post('/api/v1/stocks/batch', json=[
+            {'stock_symbol': symbol, 'number_of_shares': 1, 'purchase_price': 100}
+            for symbol in ('APIJ', 'APIK', 'APIL', 'APIJ')])
+        assert response.status_code == 201
+        assert response.json == {'created': 4, 'errors': []}
+        with test_client.application.app_context():
+            assert get_quote_cache().upstream_calls == 3
+    finally:
+        delete_api_stocks(test_client, ['APIJ', 'APIK', 'APIL'])
@@ -0,0 +1,145 @@
+"""
+This file contains the functional tests for the application-level request handling
+"""
+import logging
+
+
+def get_access_records(caplog):
+    return [record for record in caplog.records if hasattr(record, 'access')]
+
+
+def test_one_access_log_record_per_request(test_client, log_in_default_user, caplog):
+    """
+    GIVEN a Flask application and the default user logged in
+    WHEN the '/stocks/' page is requested (GET)
+    THEN check one access log record is written with the route, status, queries and bytes sent
+    """
+    with caplog.at_level(logging.INFO, logger='project'):
+        response = test_client.get('/stocks/')
+
+    records = get_access_records(caplog)
+    assert len(records) == 1
+    access = records[0].access
+    assert access['route'] == '/stocks/'
+    assert access['endpoint'] == 'stocks.list_stocks'
+    assert access['status'] == 200
+    assert access['queries'] >= 2
+    assert access['bytes'] == len(response.data)
+    assert records[0].getMessage().startswith('GET /stocks/ (stocks.list_stocks) 200 ')
+    assert not any('Calling before_request()' in record.getMessage() for record in caplog.records)
+
+
+def test_access_log_sampling_and_level(test_client, caplog):
+    """
+    GIVEN a Flask application with an access log sample rate of 0
+    WHEN a valid page and a missing page are requested (GET)
+    THEN check only the client error is logged, as a warning
+    """
+    test_client.application.config['ACCESS_LOG_SAMPLE_RATE'] = 0.0
+    try:
+        with caplog.at_level(logging.INFO, logger='project'):
+            test_client.get('/users/about')
+            test_client.get('/missing-page')
+    finally:
+        test_client.application.config.pop('ACCESS_LOG_SAMPLE_RATE')
+
+    records = get_access_records(caplog)
+    assert len(records) == 1
+    assert records[0].levelno == logging.WARNING
+    assert records[0].access['status'] == 404
+
+
+def test_request_callbacks_debug_mode(test_client, caplog):
+    """
+    GIVEN a Flask application with LOG_REQUEST_CALLBACKS enabled
+    WHEN the '/stocks/' page is requested (GET)
+    THEN check the stocks blueprint callbacks are logged
+    """
+    test_client.application.config['LOG_REQUEST_CALLBACKS'] = True
+    try:
+        with caplog.at_level(logging.INFO, logger='project'):
+            test_client.get('/stocks/')
+    finally:
+        test_client.application.config.pop('LOG_REQUEST_CALLBACKS')
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert 'Calling before_request() for the stocks blueprint...' in messages
+    assert 'Calling teardown_request() for the stocks blueprint...' in messages
+
+
+def test_server_timing_header(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and the default user logged in
+    WHEN the '/stocks/' page is requested (GET)
+    THEN check the Server-Timing header has the total, database and template timings
+    """
+    response = test_client.get('/stocks/')
+    assert response.status_code == 200
+    server_timing = response.headers['Server-Timing']
+    assert server_timing.startswith('total;dur=')
+    assert 'db;dur=' in server_timing
+    assert 'tpl;dur=' in server_timing
+    assert 'hash;dur=' not in server_timing
+
+
+def test_server_timing_header_password_hashing(test_client, register_default_user):
+    """
+    GIVEN a Flask application and a registered user
+    WHEN the '/users/login' page is posted to (POST)
+    THEN check the Server-Timing header includes the password hashing time
+    """
+    response = test_client.post('/users/login',
+                                data={'email': 'siri@email.com',
+                                      'password': 'privatePassword123'})
+    assert 'hash;dur=' in response.headers['Server-Timing']
+    test_client.get('/users/logout')
+
+
+def test_metrics_endpoint(test_client):
+    """
+    GIVEN a Flask application that has handled a request
+    WHEN the '/metrics' page is requested (GET)
+    THEN check the histograms are returned in the Prometheus text format
+    """
+    test_client.application.config['METRICS_ENABLED'] = True
+    try:
+        test_client.get('/users/about')
+        response = test_client.get('/metrics')
+    finally:
+        test_client.application.config.pop('METRICS_ENABLED')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_duration_seconds_bucket{endpoint="users.about",method="GET",status="200",le="+Inf"}' in text
+    assert 'db_queries_per_request_count{endpoint="users.about"}' in text
+    assert 'template_render_seconds_sum{endpoint="users.about"}' in text
+
+
+def test_metrics_endpoint_disabled_by_default(test_client):
+    """
+    GIVEN a Flask application that isn't configured to serve its metrics
+    WHEN the '/metrics' page is requested (GET)
+    THEN check the page is not found
+    """
+    assert test_client.get('/metrics').status_code == 404
+
+
+def test_metrics_endpoint_token(test_client):
+    """
+    GIVEN a Flask application that serves its metrics with a token
+    WHEN the '/metrics' page is requested (GET) without the token, with a wrong token and with the token
+    THEN check only the request with the token is answered
+    """
+    test_client.application.config.update(METRICS_ENABLED=True, METRICS_TOKEN='scraper-token')
+    try:
+        response = test_client.get('/metrics')
+        assert response.status_code == 401
+        assert response.headers['WWW-Authenticate'] == 'Bearer'
+        assert test_client.get('/metrics', headers={'Authorization': 'Bearer wrong-token'}).status_code == 401
+        response = test_client.get('/metrics', headers={'Authorization': 'Bearer scraper-token'})
+        assert response.status_code == 200
+        assert '# TYPE http_request_duration_seconds histogram' in response.get_data(as_text=True)
+    finally:
+        test_client.application.config.pop('METRICS_ENABLED')
+        test_client.application.config.pop('METRICS_TOKEN')
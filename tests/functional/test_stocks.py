@@ -1,6 +1,20 @@
 """
 This file contains the functional tests for the stocks blueprints
 """
+import json
+import threading
+import time
+from datetime import datetime
+from project import database
+from project.models import Stock, User, PositionSummary, PortfolioSummary, Transaction, Lot, Holding, \
+    PortfolioSnapshot, SnapshotState
+from project.stocks.summary import add_stocks, rebuild_summaries
+from project.stocks.history import get_price_history
+from project.stocks.ledger import record_trade
+from project.stocks.snapshots import take_snapshots
+from project.stocks.fragments import get_fragment_cache
+from project.stocks import streaming
+from project.stocks.streaming import get_quote_publisher
 
 
 def test_index_page(test_client):
@@ -45,9 +59,9 @@ def test_about_page_has_flashed_message(test_client):
     assert b'Thanks for learning about this site!' in response.data
 
 
-def test_get_add_stock_page(test_client):
+def test_get_add_stock_page(test_client, log_in_default_user):
     """
-    GIVEN a Flask application
+    GIVEN a Flask application and the default user logged in
     WHEN the '/add_stock' page is requested (GET)
     THEN check the response is valid
     """
@@ -101,3 +115,611 @@ def test_get_add_stock_page(test_client):
 #     assert b'23' in response.data
 #     assert b'432.17' in response.data
 #     assert b'Added new stock (AAPL)!' in response.data
+
+
+def test_list_stocks_keyset_pagination(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application with more stocks in the user's portfolio than fit on one page
+    WHEN the '/stocks/' page is requested (GET) and the next/previous cursors are followed
+    THEN check each page lists only its own stocks and links to its neighbours
+    """
+    with test_client.application.app_context():
+        stocks = [Stock(symbol, '10', '100.00', default_user_id) for symbol in ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']]
+        add_stocks(stocks)
+        database.session.commit()
+        ids = [stock.id for stock in stocks]
+
+    test_client.application.config['STOCKS_PER_PAGE'] = 2
+    try:
+        response = test_client.get('/stocks/')
+        assert response.status_code == 200
+        assert b'AAA' in response.data
+        assert b'BBB' in response.data
+        assert b'CCC' not in response.data
+        assert f'after={ids[1]}'.encode() in response.data
+        assert b'Previous' not in response.data
+
+        response = test_client.get(f'/stocks/?after={ids[1]}')
+        assert response.status_code == 200
+        assert b'AAA' not in response.data
+        assert b'CCC' in response.data
+        assert b'DDD' in response.data
+        assert f'before={ids[2]}'.encode() in response.data
+        assert f'after={ids[3]}'.encode() in response.data
+
+        response = test_client.get(f'/stocks/?after={ids[3]}')
+        assert b'EEE' in response.data
+        assert b'Next' not in response.data
+
+        response = test_client.get(f'/stocks/?before={ids[2]}')
+        assert b'AAA' in response.data
+        assert b'BBB' in response.data
+        assert b'CCC' not in response.data
+        assert b'Previous' not in response.data
+    finally:
+        test_client.application.config['STOCKS_PER_PAGE'] = 20
+        with test_client.application.app_context():
+            Stock.query.filter(Stock.id.in_(ids)).delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_list_stocks_shows_portfolio_totals(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application with stocks in the user's portfolio
+    WHEN the '/stocks/' page is requested (GET)
+    THEN check the formatted prices and the portfolio total are shown
+    """
+    with test_client.application.app_context():
+        stocks = [Stock('HD', '25', '247.29', default_user_id), Stock('DIS', '10', '100.00', default_user_id)]
+        add_stocks(stocks)
+        database.session.commit()
+        ids = [stock.id for stock in stocks]
+
+    try:
+        response = test_client.get('/stocks/')
+        assert response.status_code == 200
+        assert b'$247.29' in response.data
+        assert b'Portfolio Total (cost basis $7,182.25)' in response.data
+    finally:
+        with test_client.application.app_context():
+            Stock.query.filter(Stock.id.in_(ids)).delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_post_add_stock_unknown_symbol(test_client, log_in_default_user, quotes_file):
+    """
+    GIVEN a Flask application with a quote provider configured and the default user logged in
+    WHEN the '/add_stock' page is posted to (POST) with a symbol unknown to the quote provider
+    THEN check an error message is returned and no stock is added
+    """
+    response = test_client.post('/add_stock',
+                                data={'stock_symbol': 'XYZ',
+                                      'number_of_shares': '23',
+                                      'purchase_price': '432.17'},
+                                follow_redirects=True)
+    assert response.status_code == 200
+    assert b'ERROR! Unknown stock symbol (XYZ).' in response.data
+    with test_client.application.app_context():
+        assert Stock.query.filter_by(stock_symbol='XYZ').count() == 0
+
+
+def test_list_stocks_uses_cached_quotes(test_client, log_in_default_user, default_user_id, quotes_file):
+    """
+    GIVEN a Flask application with a quote provider configured and the default user logged in
+    WHEN the '/stocks/' page is requested (GET) several times
+    THEN check the market value is shown and each symbol is fetched from the provider only once
+    """
+    with test_client.application.app_context():
+        stock = Stock('HD', '10', '247.29', default_user_id)
+        add_stocks([stock])
+        database.session.commit()
+        stock_id = stock.id
+
+    try:
+        for _ in range(3):
+            response = test_client.get('/stocks/')
+            assert response.status_code == 200
+            assert b'$3,000.00' in response.data
+
+        quote_cache = test_client.application.extensions['quote_cache']
+        assert quote_cache.provider.calls == 1
+        assert quote_cache.hits == 2
+    finally:
+        with test_client.application.app_context():
+            Stock.query.filter_by(id=stock_id).delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_export_stocks(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application with stocks in the user's portfolio
+    WHEN the '/stocks/export.csv' and '/stocks/export.ndjson' pages are requested (GET)
+    THEN check every stock is streamed in the requested format
+    """
+    with test_client.application.app_context():
+        stocks = [Stock('HD', '25', '247.29', default_user_id), Stock('DIS', '65', '118.77', default_user_id)]
+        add_stocks(stocks)
+        database.session.commit()
+        ids = [stock.id for stock in stocks]
+
+    try:
+        response = test_client.get('/stocks/export.csv')
+        assert response.status_code == 200
+        assert response.is_streamed
+        assert response.mimetype == 'text/csv'
+        assert response.headers['Content-Disposition'] == 'attachment; filename=stocks.csv'
+        assert response.get_data(as_text=True) == ('stock_symbol,number_of_shares,purchase_price\n'
+                                                   'HD,25,247.29\n'
+                                                   'DIS,65,118.77\n')
+
+        response = test_client.get('/stocks/export.ndjson')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert lines == [{'stock_symbol': 'HD', 'number_of_shares': 25, 'purchase_price': 247.29},
+                         {'stock_symbol': 'DIS', 'number_of_shares': 65, 'purchase_price': 118.77}]
+
+        assert test_client.get('/stocks/export.xml').status_code == 404
+    finally:
+        with test_client.application.app_context():
+            Stock.query.filter(Stock.id.in_(ids)).delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_stocks_pages_require_login(test_client):
+    """
+    GIVEN a Flask application and no user logged in
+    WHEN the '/stocks/', '/add_stock' and '/stocks/export.csv' pages are requested (GET)
+    THEN check the user is redirected to the login page
+    """
+    for url in ['/stocks/', '/add_stock', '/stocks/export.csv']:
+        response = test_client.get(url)
+        assert response.status_code == 302
+        assert '/users/login' in response.headers['Location']
+
+
+def test_list_stocks_only_shows_own_stocks(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application with stocks owned by the default user and by another user
+    WHEN the '/stocks/' page and the CSV export are requested (GET) by the default user
+    THEN check only the stocks of the default user are listed and exported
+    """
+    with test_client.application.app_context():
+        other_user = User('other@email.com', 'otherPassword123')
+        database.session.add(other_user)
+        database.session.commit()
+        stocks = [Stock('MINE', '10', '100.00', default_user_id), Stock('THEIR', '20', '200.00', other_user.id)]
+        add_stocks(stocks)
+        database.session.commit()
+        ids = [stock.id for stock in stocks]
+        other_user_id = other_user.id
+
+    try:
+        response = test_client.get('/stocks/')
+        assert response.status_code == 200
+        assert b'MINE' in response.data
+        assert b'THEIR' not in response.data
+        assert b'Portfolio Total (cost basis $1,000.00)' in response.data
+
+        response = test_client.get('/stocks/export.csv')
+        assert 'MINE' in response.get_data(as_text=True)
+        assert 'THEIR' not in response.get_data(as_text=True)
+    finally:
+        with test_client.application.app_context():
+            Stock.query.filter(Stock.id.in_(ids)).delete()
+            User.query.filter_by(id=other_user_id).delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_post_add_stock_owned_by_current_user(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application and the default user logged in
+    WHEN the '/add_stock' page is posted to (POST) with valid data
+    THEN check the new stock is owned by the default user
+    """
+    response = test_client.post('/add_stock',
+                                data={'stock_symbol': 'OWND',
+                                      'number_of_shares': '23',
+                                      'purchase_price': '432.17'},
+                                follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Added new stock (OWND)!' in response.data
+    with test_client.application.app_context():
+        stock = Stock.query.filter_by(stock_symbol='OWND').first()
+        assert stock.user_id == default_user_id
+        database.session.delete(stock)
+        database.session.commit()
+        rebuild_summaries()
+
+
+def test_add_stock_updates_portfolio_summary(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application and the default user logged in
+    WHEN two stocks of the same symbol are added with the '/add_stock' page (POST)
+    THEN check the position and portfolio summaries are updated and shown on the index and profile pages
+    """
+    for number_of_shares in ['10', '30']:
+        response = test_client.post('/add_stock',
+                                    data={'stock_symbol': 'SUMM',
+                                          'number_of_shares': number_of_shares,
+                                          'purchase_price': '20.00'},
+                                    follow_redirects=True)
+        assert response.status_code == 200
+
+    try:
+        with test_client.application.app_context():
+            position = database.session.get(PositionSummary, (default_user_id, 'SUMM'))
+            assert (position.number_of_shares, position.cost_basis, position.lot_count) == (40, 80000, 2)
+            portfolio = database.session.get(PortfolioSummary, default_user_id)
+            assert (portfolio.position_count, portfolio.lot_count, portfolio.cost_basis) == (1, 2, 80000)
+
+        response = test_client.get('/')
+        assert b'Your portfolio: 40 shares of\n                    1 stocks (cost basis $800.00)' in response.data
+        response = test_client.get('/users/profile')
+        assert b'Stocks: 1 (2 purchases)' in response.data
+        assert b'Cost basis: $800.00' in response.data
+        response = test_client.get('/stocks/')
+        assert b'Portfolio Total (cost basis $800.00)' in response.data
+    finally:
+        with test_client.application.app_context():
+            Stock.query.filter_by(stock_symbol='SUMM').delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_portfolio_analytics(test_client, log_in_default_user, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with stocks in the user's portfolio and their price history
+    WHEN the '/stocks/analytics' and '/stocks/analytics.json' pages are requested (GET)
+    THEN check the analytics of the portfolio and its holdings are computed against the benchmark
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path)
+    test_client.application.extensions.pop('price_history', None)
+    with test_client.application.app_context():
+        add_stocks([Stock('ANLA', '10', '100.00', default_user_id),
+                    Stock('ANLB', '5', '200.00', default_user_id),
+                    Stock('ANLC', '1', '10.00', default_user_id)])
+        database.session.commit()
+        store = get_price_history()
+        days = ['2023-01-02', '2023-01-03', '2023-01-04', '2023-01-05']
+        store.append('ANLA', days, [10000, 11000, 9900, 12100])
+        # (no price on 2023-01-04, so the price of 2023-01-03 is used)
+        store.append('ANLB', days[:2] + days[3:], [20000, 22000, 24200])
+        store.append('SPY', days, [40000, 44000, 39600, 48400])
+
+    try:
+        response = test_client.get('/stocks/analytics.json')
+        assert response.status_code == 200
+        analytics = response.get_json()
+        assert analytics['start'] == '2023-01-02'
+        assert analytics['days'] == 4
+        assert analytics['benchmark'] == 'SPY'
+        assert analytics['missing'] == ['ANLC']
+        assert [holding['stock_symbol'] for holding in analytics['holdings']] == ['ANLA', 'ANLB']
+        assert analytics['values']['values'] == [2000.0, 2200.0, 2090.0, 2420.0]
+        assert round(analytics['time_weighted_return'], 6) == 0.21
+        assert round(analytics['max_drawdown'], 6) == -0.05
+        assert round(analytics['holdings'][0]['beta'], 6) == 1.0
+        assert analytics['correlation']['symbols'] == ['ANLA', 'ANLB']
+
+        response = test_client.get('/stocks/analytics?start=2023-01-03')
+        assert response.status_code == 200
+        assert b'Portfolio Analytics' in response.data
+        assert b'From 2023-01-03 to 2023-01-05 (3 days, benchmark SPY)' in response.data
+        assert b'No price history for: ANLC' in response.data
+    finally:
+        test_client.application.config.pop('PRICE_HISTORY_DIR')
+        test_client.application.extensions.pop('price_history', None)
+        with test_client.application.app_context():
+            Stock.query.filter(Stock.stock_symbol.like('ANL%')).delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_portfolio_analytics_from_ledger(test_client, log_in_default_user, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with trades in the user's ledger and the price history of the symbol
+    WHEN the '/stocks/analytics.json' page is requested (GET)
+    THEN check the shares held follow the trades and the buys are cash flows of the returns
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path)
+    test_client.application.extensions.pop('price_history', None)
+    with test_client.application.app_context():
+        record_trade(default_user_id, 'LEDA', 'buy', quantity=10, price=10000, traded_at=datetime(2023, 1, 2))
+        record_trade(default_user_id, 'LEDA', 'buy', quantity=10, price=11000, traded_at=datetime(2023, 1, 3))
+        database.session.commit()
+        get_price_history().append('LEDA', ['2023-01-02', '2023-01-03', '2023-01-04'], [10000, 11000, 12100])
+
+    try:
+        analytics = test_client.get('/stocks/analytics.json').get_json()
+        # 10 shares, then 20 shares (the second buy isn't a gain)
+        assert analytics['values']['values'] == [1000.0, 2200.0, 2420.0]
+        assert round(analytics['time_weighted_return'], 6) == 0.21
+        assert analytics['money_weighted_return'] > 0
+    finally:
+        test_client.application.config.pop('PRICE_HISTORY_DIR')
+        test_client.application.extensions.pop('price_history', None)
+        with test_client.application.app_context():
+            for model in (Lot, Holding, Transaction):
+                model.query.filter_by(stock_symbol='LEDA').delete()
+            database.session.commit()
+
+
+def test_portfolio_stocks_and_ledger(test_client, log_in_default_user, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with a stock in the user's portfolio, a trade in their ledger and the price history
+    WHEN the analytics and the snapshots are computed, before and after another stock is added
+    THEN check the stock is held on every day, the trade from its day, and the new stock changes every snapshot
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path)
+    test_client.application.extensions.pop('price_history', None)
+    with test_client.application.app_context():
+        add_stocks([Stock('MIXA', '5', '100.00', default_user_id)])
+        record_trade(default_user_id, 'MIXB', 'buy', quantity=10, price=10000, traded_at=datetime(2023, 1, 3))
+        database.session.commit()
+        store = get_price_history()
+        store.append('MIXA', ['2023-01-02', '2023-01-03', '2023-01-04'], [10000, 10000, 11000])
+        store.append('MIXB', ['2023-01-02', '2023-01-03', '2023-01-04'], [10000, 10000, 12000])
+
+    try:
+        analytics = test_client.get('/stocks/analytics.json').get_json()
+        assert [holding['stock_symbol'] for holding in analytics['holdings']] == ['MIXA', 'MIXB']
+        assert analytics['values']['values'] == [500.0, 1500.0, 1750.0]
+
+        with test_client.application.app_context():
+            take_snapshots(user_id=default_user_id)
+        assert test_client.get('/stocks/history.json').get_json()['values'] == [500.0, 1500.0, 1750.0]
+
+        with test_client.application.app_context():
+            add_stocks([Stock('MIXA', '5', '100.00', default_user_id)])
+            database.session.commit()
+            take_snapshots(user_id=default_user_id)
+        assert test_client.get('/stocks/history.json').get_json()['values'] == [1000.0, 2000.0, 2300.0]
+    finally:
+        test_client.application.config.pop('PRICE_HISTORY_DIR')
+        test_client.application.extensions.pop('price_history', None)
+        with test_client.application.app_context():
+            for model in (PortfolioSnapshot, SnapshotState):
+                model.query.filter_by(user_id=default_user_id).delete()
+            for model in (Lot, Holding, Transaction):
+                model.query.filter_by(stock_symbol='MIXB').delete()
+            Stock.query.filter_by(stock_symbol='MIXA').delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_portfolio_history(test_client, log_in_default_user, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with snapshots of the user's portfolio
+    WHEN the '/stocks/history.json' page is requested (GET) with and without a date range
+    THEN check the daily values of the portfolio in the range are returned
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path)
+    test_client.application.extensions.pop('price_history', None)
+    with test_client.application.app_context():
+        record_trade(default_user_id, 'HSTA', 'buy', quantity=2, price=5000, traded_at=datetime(2023, 1, 2))
+        database.session.commit()
+        get_price_history().append('HSTA', ['2023-01-02', '2023-01-03', '2023-01-04'], [5000, 5500, 6000])
+        take_snapshots(user_id=default_user_id)
+
+    try:
+        history = test_client.get('/stocks/history.json').get_json()
+        assert history == {'dates': ['2023-01-02', '2023-01-03', '2023-01-04'], 'values': [100.0, 110.0, 120.0]}
+        history = test_client.get('/stocks/history.json?start=2023-01-03&end=2023-01-03').get_json()
+        assert history == {'dates': ['2023-01-03'], 'values': [110.0]}
+    finally:
+        test_client.application.config.pop('PRICE_HISTORY_DIR')
+        test_client.application.extensions.pop('price_history', None)
+        with test_client.application.app_context():
+            for model in (PortfolioSnapshot, SnapshotState):
+                model.query.filter_by(user_id=default_user_id).delete()
+            for model in (Lot, Holding, Transaction):
+                model.query.filter_by(stock_symbol='HSTA').delete()
+            database.session.commit()
+
+
+def test_stream_quotes(test_client, log_in_default_user, default_user_id, quotes_file):
+    """
+    GIVEN a Flask application with a local quote feed and a stock in the user's portfolio
+    WHEN the '/stocks/stream' page is requested (GET) and the price of the stock changes
+    THEN check the new price and position value are pushed as Server-Sent Events
+    """
+    test_client.application.config.update(QUOTES_TTL=0, QUOTES_STREAM_INTERVAL=0.01)
+    test_client.application.extensions.pop('quote_publisher', None)
+    with test_client.application.app_context():
+        add_stocks([Stock('HD', '10', '247.29', default_user_id)])
+        database.session.commit()
+
+    try:
+        response = test_client.get('/stocks/stream', buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        events = (chunk.decode() for chunk in response.response if not chunk.startswith(b':'))
+        assert next(events).startswith('retry: ')
+        data = json.loads(next(events).split('data: ', 1)[1])
+        assert data['quotes']['HD'] == {'price': 300.0, 'market_value': 3000.0, 'gain': 527.1}
+
+        quotes_file.write_text(json.dumps({'AAPL': 432.17, 'HD': 310.00, 'DIS': 100.00}))
+        data = json.loads(next(events).split('data: ', 1)[1])
+        assert data['quotes'] == {'HD': {'price': 310.0, 'market_value': 3100.0, 'gain': 627.1}}
+
+        publisher = test_client.application.extensions['quote_publisher']
+        response.close()
+        assert publisher.subscriber_count == 0
+    finally:
+        for key in ('QUOTES_TTL', 'QUOTES_STREAM_INTERVAL'):
+            test_client.application.config.pop(key)
+        test_client.application.extensions.pop('quote_publisher', None)
+        with test_client.application.app_context():
+            Stock.query.filter_by(stock_symbol='HD', user_id=default_user_id).delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_stream_quotes_without_provider(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application without a quote provider
+    WHEN the '/stocks/stream' page is requested (GET)
+    THEN check there is no stream (204 No Content, so the browser doesn't reconnect)
+    """
+    test_client.application.extensions.pop('quote_publisher', None)
+    response = test_client.get('/stocks/stream')
+    assert response.status_code == 204
+    test_client.application.extensions.pop('quote_publisher', None)
+
+
+def test_quote_publisher_shared_by_concurrent_requests(test_client, quotes_file, monkeypatch):
+    """
+    GIVEN a Flask application with a local quote feed and no quote publisher yet
+    WHEN the quote publisher is requested by 20 threads at the same time
+    THEN check every thread gets the same publisher
+    """
+    test_client.application.extensions.pop('quote_publisher', None)
+    # (a slow creation of the publisher, so the threads all ask for it before it exists)
+    get_quote_cache = streaming.get_quote_cache
+    monkeypatch.setattr(streaming, 'get_quote_cache', lambda: time.sleep(0.01) or get_quote_cache())
+    barrier = threading.Barrier(20)
+    publishers = []
+
+    def get_publisher():
+        with test_client.application.app_context():
+            barrier.wait()
+            publishers.append(get_quote_publisher())
+
+    try:
+        threads = [threading.Thread(target=get_publisher) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(publishers) == 20
+        assert len({id(publisher) for publisher in publishers}) == 1
+        assert publishers[0] is test_client.application.extensions['quote_publisher']
+    finally:
+        test_client.application.extensions.pop('quote_publisher', None)
+
+
+def test_list_stocks_not_modified(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application and a copy of the '/stocks/' page with its ETag
+    WHEN the page is requested again (GET) with If-None-Match, before and after a stock is added
+    THEN check the unchanged page is a 304 response (with only the summary queried), and the changed page is sent
+    """
+    response = test_client.get('/stocks/')
+    assert response.status_code == 200
+    etag = response.headers['ETag']
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    response = test_client.get('/stocks/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
+
+    with test_client.application.app_context():
+        add_stocks([Stock('ETAG', '10', '12.34', default_user_id)])
+        database.session.commit()
+    try:
+        response = test_client.get('/stocks/', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert b'ETAG' in response.data
+        assert response.headers['ETag'] != etag
+    finally:
+        with test_client.application.app_context():
+            Stock.query.filter_by(stock_symbol='ETAG').delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_list_stocks_with_flashed_message_is_always_sent(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and a copy of the '/stocks/' page with its ETag
+    WHEN the page is requested again (GET) with If-None-Match while a message is flashed
+    THEN check the page is sent with the message, without an ETag
+    """
+    etag = test_client.get('/stocks/').headers['ETag']
+    with test_client.session_transaction() as session:
+        session['_flashes'] = [('success', 'Flashed message')]
+
+    response = test_client.get('/stocks/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert b'Flashed message' in response.data
+    assert 'ETag' not in response.headers
+
+
+def test_export_stocks_not_modified(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application and a copy of the '/stocks/export.csv' file with its Last-Modified time
+    WHEN the file is requested again (GET) with If-Modified-Since
+    THEN check the unchanged file is a 304 response
+    """
+    response = test_client.get('/stocks/export.csv')
+    assert response.status_code == 200
+    assert response.data.startswith(b'stock_symbol')
+    response = test_client.get('/stocks/export.csv',
+                               headers={'If-None-Match': response.headers['ETag'],
+                                        'If-Modified-Since': response.headers['Last-Modified']})
+    assert response.status_code == 304
+
+
+def test_list_stocks_rows_are_cached(test_client, log_in_default_user, default_user_id):
+    """
+    GIVEN a Flask application and a user who viewed the '/stocks/' page
+    WHEN the page is requested again (GET), before and after a stock is added
+    THEN check the rows are found in the cache (without querying the stocks),
+         and are rendered again once the stock is added
+    """
+    with test_client.application.app_context():
+        get_fragment_cache().clear()
+    test_client.get('/stocks/')
+    first = test_client.get('/stocks/')
+    with test_client.application.app_context():
+        misses = get_fragment_cache().stats()['misses']
+
+    response = test_client.get('/stocks/')
+    assert response.status_code == 200
+    assert response.data == first.data
+    with test_client.application.app_context():
+        stats = get_fragment_cache().stats()
+        assert stats['hits'] >= 1
+        assert stats['misses'] == misses
+
+    with test_client.application.app_context():
+        add_stocks([Stock('FRAG', '10', '12.34', default_user_id)])
+        database.session.commit()
+        # The rows of the user were removed from the cache when the stock was committed
+        assert get_fragment_cache().stats()['size'] == 0
+    try:
+        response = test_client.get('/stocks/')
+        assert b'FRAG' in response.data
+        with test_client.application.app_context():
+            assert get_fragment_cache().stats()['misses'] == misses + 1
+    finally:
+        with test_client.application.app_context():
+            Stock.query.filter_by(stock_symbol='FRAG').delete()
+            database.session.commit()
+            rebuild_summaries()
+
+
+def test_list_stocks_without_fragment_cache(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application configured without the fragment cache
+    WHEN the '/stocks/' page is requested (GET)
+    THEN check the page is rendered
+    """
+    app = test_client.application
+    app.config['STOCKS_FRAGMENT_CACHE'] = 'none'
+    app.extensions.pop('stocks_fragment_cache', None)
+    try:
+        response = test_client.get('/stocks/')
+        assert response.status_code == 200
+        assert b'List of Stocks' in response.data
+        assert b'Portfolio Total' in response.data
+    finally:
+        app.config.pop('STOCKS_FRAGMENT_CACHE')
+        app.extensions.pop('stocks_fragment_cache', None)
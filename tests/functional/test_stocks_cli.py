@@ -0,0 +1,401 @@
+"""
+This file contains the functional tests for the CLI commands of the stocks blueprint
+"""
+from datetime import datetime
+from project import database
+from project.models import Stock, User, Transaction, Lot, Holding, PositionSummary, PortfolioSummary, \
+    PortfolioSnapshot, SnapshotState
+from project.stocks.summary import add_stocks, rebuild_summaries
+from project.stocks.history import get_price_history
+from project.stocks.ledger import record_trade
+from project.stocks.snapshots import take_snapshots, load_snapshots, run_snapshot_scheduler, _upsert_statement
+
+
+def test_import_csv(test_client, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application and a CSV file with valid and invalid rows
+    WHEN the 'flask stocks import' command is run
+    THEN check the valid rows are imported in batches and the invalid rows are reported
+    """
+    filename = tmp_path / 'stocks.csv'
+    filename.write_text('stock_symbol,number_of_shares,purchase_price\n'
+                        'IMPA,16,406.78\n'
+                        'IMPB123,25,247.29\n'
+                        'impc,abc,10\n'
+                        'impd,65,118.77\n'
+                        'IMPE,10,1.50\n')
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'import', str(filename), '--batch-size', '2', '--owner', 'siri@email.com'])
+
+    assert result.exit_code == 0
+    assert 'Imported 3 of 5 rows (2 invalid)' in result.output
+    assert 'rows/sec' in result.output
+    assert 'Row 2: stock_symbol: Stock symbol must be 1-5 characters' in result.output
+    assert 'Row 3: number_of_shares: value is not a valid integer' in result.output
+
+    with test_client.application.app_context():
+        stocks = Stock.query.filter(Stock.stock_symbol.like('IMP%')).order_by(Stock.id).all()
+        assert [stock.stock_symbol for stock in stocks] == ['IMPA', 'IMPD', 'IMPE']
+        assert {stock.user_id for stock in stocks} == {default_user_id}
+        assert stocks[0].purchase_price == 40678
+        assert stocks[1].number_of_shares == 65
+        Stock.query.filter(Stock.stock_symbol.like('IMP%')).delete(synchronize_session=False)
+        database.session.commit()
+        rebuild_summaries()
+
+
+def test_import_json(test_client, register_default_user, tmp_path):
+    """
+    GIVEN a Flask application and a JSON file containing an array of stocks, with a malformed object in the middle
+    WHEN the 'flask stocks import' command is run
+    THEN check the malformed object is reported and the other stocks are imported
+    """
+    filename = tmp_path / 'stocks.json'
+    filename.write_text('[{"stock_symbol": "JSNA", "number_of_shares": 5, "purchase_price": 12.5},'
+                        ' {"stock_symbol": "JSNX", "number_of_shares": 5 "purchase_price": 1},'
+                        ' {"stock_symbol": "JSNB", "number_of_shares": 7, "purchase_price": "99.99"}]')
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'import', str(filename), '--batch-size', '1', '--owner', 'siri@email.com'])
+
+    assert result.exit_code == 0
+    assert 'Imported 2 of 3 rows (1 invalid)' in result.output
+    assert 'Row 2: Invalid JSON' in result.output
+    with test_client.application.app_context():
+        assert Stock.query.filter(Stock.stock_symbol.like('JSN%')).count() == 2
+        Stock.query.filter(Stock.stock_symbol.like('JSN%')).delete(synchronize_session=False)
+        database.session.commit()
+        rebuild_summaries()
+
+
+def test_export_then_import_round_trip(test_client, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with stocks in the database
+    WHEN the 'flask stocks export' command is run and its output is imported again
+    THEN check the exported file can be read by 'flask stocks import'
+    """
+    with test_client.application.app_context():
+        database.session.add_all([Stock('EXPA', '25', '247.29', default_user_id),
+                                  Stock('EXPB', '65', '118.77', default_user_id)])
+        database.session.commit()
+
+    filename = tmp_path / 'stocks.ndjson'
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'export', '--format', 'ndjson', '--output', str(filename),
+                                 '--owner', 'siri@email.com'])
+    assert result.exit_code == 0
+    assert filename.read_text().count('\n') == 2
+
+    result = runner.invoke(args=['stocks', 'import', str(filename), '--owner', 'siri@email.com'])
+    assert result.exit_code == 0
+    assert 'Imported 2 of 2 rows (0 invalid)' in result.output
+
+    with test_client.application.app_context():
+        assert Stock.query.filter_by(stock_symbol='EXPA', purchase_price=24729).count() == 2
+        Stock.query.filter(Stock.stock_symbol.like('EXP%')).delete(synchronize_session=False)
+        database.session.commit()
+        rebuild_summaries()
+
+
+def test_create_unknown_owner(test_client):
+    """
+    GIVEN a Flask application
+    WHEN the 'flask stocks create' command is run with the email of a user that doesn't exist
+    THEN check an error is returned and no stock is created
+    """
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'create', 'NOUSR', '10', '1.50', '--owner', 'nobody@email.com'])
+    assert result.exit_code != 0
+    assert 'No user with the email nobody@email.com' in result.output
+    with test_client.application.app_context():
+        assert Stock.query.filter_by(stock_symbol='NOUSR').count() == 0
+
+
+def test_ledger_trades_and_rebuild(test_client, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application
+    WHEN buys, a sell and a split are recorded with 'flask stocks trade' and the ledger is rebuilt
+    THEN check the lots and holding are updated incrementally and the rebuild gives the same result
+    """
+    runner = test_client.application.test_cli_runner()
+    for args in (['buy', 'LDGA', '10', '100.00'],
+                 ['buy', 'LDGA', '10', '200.00'],
+                 ['sell', 'LDGA', '15', '250.00'],
+                 ['split', 'LDGA', '2:1']):
+        result = runner.invoke(args=['stocks', 'trade', *args, '--owner', 'siri@email.com'])
+        assert result.exit_code == 0, result.output
+
+    def get_ledger():
+        with test_client.application.app_context():
+            holding = Holding.query.filter_by(user_id=default_user_id, stock_symbol='LDGA').one()
+            lots = Lot.query.filter_by(user_id=default_user_id, stock_symbol='LDGA').order_by(Lot.id).all()
+            return ((holding.shares, holding.cost_basis, holding.realized_gain, holding.lot_count),
+                    [(lot.quantity, lot.cost) for lot in lots])
+
+    # FIFO: the 10 shares at $100 and 5 of the shares at $200 are sold
+    incremental = get_ledger()
+    assert incremental == ((10, 100000, 15 * 25000 - 10 * 10000 - 5 * 20000, 1), [(10, 100000)])
+
+    result = runner.invoke(args=['stocks', 'rebuild-ledger', '--owner', 'siri@email.com'])
+    assert result.exit_code == 0
+    assert 'Replayed 4 trades into 1 holdings (1 open lots)' in result.output
+    assert get_ledger() == incremental
+
+    prices = tmp_path / 'prices.json'
+    prices.write_text('{"LDGA": 120.00}')
+    result = runner.invoke(args=['stocks', 'ledger', '--prices', str(prices), '--owner', 'siri@email.com'])
+    assert result.exit_code == 0
+    assert 'Unrealized gain: $200.00' in result.output
+    assert 'Realized gain:   $1,750.00' in result.output
+
+    with test_client.application.app_context():
+        Lot.query.filter_by(stock_symbol='LDGA').delete()
+        Holding.query.filter_by(stock_symbol='LDGA').delete()
+        Transaction.query.filter_by(stock_symbol='LDGA').delete()
+        database.session.commit()
+
+
+def test_ledger_sell_more_than_held(test_client, default_user_id):
+    """
+    GIVEN a Flask application
+    WHEN more shares are sold with 'flask stocks trade' than are held
+    THEN check an error is returned and the trade is not recorded
+    """
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'trade', 'sell', 'LDGB', '5', '10.00', '--owner', 'siri@email.com'])
+    assert result.exit_code != 0
+    assert 'No shares of LDGB are held' in result.output
+
+    runner.invoke(args=['stocks', 'trade', 'buy', 'LDGB', '5', '10.00', '--owner', 'siri@email.com'])
+    result = runner.invoke(args=['stocks', 'trade', 'sell', 'LDGB', '6', '10.00', '--owner', 'siri@email.com'])
+    assert result.exit_code != 0
+    assert 'Not enough shares of LDGB to sell (5 of 6 available)' in result.output
+
+    with test_client.application.app_context():
+        assert Transaction.query.filter_by(stock_symbol='LDGB').count() == 1
+        Lot.query.filter_by(stock_symbol='LDGB').delete()
+        Holding.query.filter_by(stock_symbol='LDGB').delete()
+        Transaction.query.filter_by(stock_symbol='LDGB').delete()
+        database.session.commit()
+
+
+def test_create_updates_summary_and_rebuild(test_client, default_user_id):
+    """
+    GIVEN a Flask application
+    WHEN stocks are created with 'flask stocks create' and 'flask stocks create_default_set',
+         and the summaries are recomputed with 'flask stocks rebuild-summary' after a stock is deleted
+    THEN check the portfolio summary is updated with each command and matches the stocks after the rebuild
+    """
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['stocks', 'create', 'HD', '5', '200.00', '--owner', 'siri@email.com'])
+    assert result.exit_code == 0
+    result = runner.invoke(args=['stocks', 'create_default_set', '--owner', 'siri@email.com'])
+    assert result.exit_code == 0
+
+    with test_client.application.app_context():
+        portfolio = database.session.get(PortfolioSummary, default_user_id)
+        assert (portfolio.position_count, portfolio.lot_count) == (3, 4)
+        assert portfolio.cost_basis == 5 * 20000 + 25 * 24729 + 230 * 3189 + 65 * 11877
+        assert database.session.get(PositionSummary, (default_user_id, 'HD')).lot_count == 2
+
+        # The summaries don't know about stocks deleted outside the application...
+        Stock.query.filter_by(stock_symbol='TWTR').delete()
+        database.session.commit()
+
+    result = runner.invoke(args=['stocks', 'rebuild-summary', '--owner', 'siri@email.com'])
+    assert result.exit_code == 0
+    assert 'Rebuilt 2 position summaries and 1 portfolio summaries' in result.output
+
+    with test_client.application.app_context():
+        portfolio = database.session.get(PortfolioSummary, default_user_id)
+        assert (portfolio.position_count, portfolio.lot_count) == (2, 3)
+        assert portfolio.cost_basis == 5 * 20000 + 25 * 24729 + 65 * 11877
+        assert database.session.get(PositionSummary, (default_user_id, 'TWTR')) is None
+
+        Stock.query.filter(Stock.stock_symbol.in_(['HD', 'DIS'])).delete()
+        database.session.commit()
+        rebuild_summaries()
+
+
+def test_load_prices(test_client, tmp_path):
+    """
+    GIVEN a Flask application and a CSV file of daily closing prices
+    WHEN the 'flask stocks load-prices' command is run twice
+    THEN check the valid prices are stored once in the price history and the invalid rows are reported
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path / 'history')
+    test_client.application.extensions.pop('price_history', None)
+    filename = tmp_path / 'prices.csv'
+    filename.write_text('Symbol,Date,Close\n'
+                        'AAPL,2023-01-03,125.07\n'
+                        'AAPL,2023-01-04,126.36\n'
+                        'HD,2023-01-03,316.50\n'
+                        'HD,not-a-date,1\n')
+    runner = test_client.application.test_cli_runner()
+    try:
+        result = runner.invoke(args=['stocks', 'load-prices', str(filename)])
+        assert result.exit_code == 0
+        assert 'Loaded 3 of 4 prices (1 invalid, 0 already stored)' in result.output
+        assert 'Row 4:' in result.output
+
+        result = runner.invoke(args=['stocks', 'load-prices', str(filename)])
+        assert 'Loaded 0 of 4 prices (1 invalid, 3 already stored)' in result.output
+
+        with test_client.application.app_context():
+            store = get_price_history()
+            assert store.symbols() == ['AAPL', 'HD']
+            assert list(store.read('AAPL', start='2023-01-04').closes) == [12636]
+    finally:
+        test_client.application.config.pop('PRICE_HISTORY_DIR')
+        test_client.application.extensions.pop('price_history', None)
+
+
+def test_load_prices_unsorted(test_client, tmp_path):
+    """
+    GIVEN a Flask application and a CSV file of daily closing prices that isn't sorted by date
+    WHEN the 'flask stocks load-prices' command is run with a small batch size
+    THEN check the rows that can't be appended anymore are reported as invalid, not as already stored
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path / 'history')
+    test_client.application.extensions.pop('price_history', None)
+    filename = tmp_path / 'prices.csv'
+    filename.write_text('Symbol,Date,Close\n'
+                        'AAPL,2023-01-05,126.00\n'
+                        'AAPL,2023-01-04,126.36\n'
+                        'HD,2023-01-04,316.50\n'
+                        'AAPL,2023-01-03,125.07\n'
+                        'AAPL,2023-01-06,129.62\n')
+    runner = test_client.application.test_cli_runner()
+    try:
+        result = runner.invoke(args=['stocks', 'load-prices', str(filename), '--batch-size', '2'])
+        assert result.exit_code == 0
+        assert 'Loaded 4 of 5 prices (1 invalid, 0 already stored)' in result.output
+        assert 'Row 4: Out of order: prices of AAPL through 2023-01-05 were already written' in result.output
+
+        with test_client.application.app_context():
+            assert list(get_price_history().read('AAPL').closes) == [12636, 12600, 12962]
+    finally:
+        test_client.application.config.pop('PRICE_HISTORY_DIR')
+        test_client.application.extensions.pop('price_history', None)
+
+
+def test_snapshot(test_client, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with trades in the user's ledger and the price history of the symbol
+    WHEN the 'flask stocks snapshot' command is run after new prices and new (backdated) trades
+    THEN check only the days that changed are computed, and the snapshots hold the value of each day
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path)
+    test_client.application.extensions.pop('price_history', None)
+    runner = test_client.application.test_cli_runner()
+    snapshot = ['stocks', 'snapshot', '--owner', 'siri@email.com']
+    with test_client.application.app_context():
+        record_trade(default_user_id, 'SNPA', 'buy', quantity=10, price=10000, traded_at=datetime(2023, 1, 2))
+        database.session.commit()
+        store = get_price_history()
+        store.append('SNPA', ['2023-01-02', '2023-01-03', '2023-01-04'], [10000, 11000, 12100])
+
+    try:
+        result = runner.invoke(args=snapshot)
+        assert result.exit_code == 0
+        assert 'Wrote 3 snapshots for 1 users (0 up to date)' in result.output
+        result = runner.invoke(args=snapshot)
+        assert 'Wrote 0 snapshots for 0 users (1 up to date)' in result.output
+
+        # A new closing price: only the new day is computed
+        store.append('SNPA', ['2023-01-05'], [13310])
+        result = runner.invoke(args=snapshot)
+        assert 'Wrote 1 snapshots for 1 users' in result.output
+
+        # A backdated trade: the days from the trade are computed again
+        with test_client.application.app_context():
+            record_trade(default_user_id, 'SNPA', 'buy', quantity=10, price=12100, traded_at=datetime(2023, 1, 4))
+            database.session.commit()
+        result = runner.invoke(args=snapshot)
+        assert 'Wrote 2 snapshots for 1 users' in result.output
+
+        with test_client.application.app_context():
+            days, values = load_snapshots(default_user_id)
+            assert [str(day) for day in days] == ['2023-01-02', '2023-01-03', '2023-01-04', '2023-01-05']
+            assert values.tolist() == [100000, 110000, 242000, 266200]
+            days, values = load_snapshots(default_user_id, start='2023-01-03', end='2023-01-04')
+            assert values.tolist() == [110000, 242000]
+    finally:
+        test_client.application.config.pop('PRICE_HISTORY_DIR')
+        test_client.application.extensions.pop('price_history', None)
+        with test_client.application.app_context():
+            for model in (PortfolioSnapshot, SnapshotState):
+                model.query.filter_by(user_id=default_user_id).delete()
+            for model in (Lot, Holding, Transaction):
+                model.query.filter_by(stock_symbol='SNPA').delete()
+            database.session.commit()
+
+
+def test_snapshot_scheduler(test_client, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with trades in the user's ledger and the price history of the symbol
+    WHEN the snapshot scheduler takes the snapshots twice, and the same snapshot rows are written again
+    THEN check the snapshots are written once, and writing them again replaces them rather than failing
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path)
+    test_client.application.extensions.pop('price_history', None)
+    with test_client.application.app_context():
+        record_trade(default_user_id, 'SNPD', 'buy', quantity=2, price=5000, traded_at=datetime(2023, 1, 2))
+        database.session.commit()
+        store = get_price_history()
+        store.append('SNPD', ['2023-01-02', '2023-01-03'], [5000, 6000])
+
+        try:
+            run_snapshot_scheduler(0, max_runs=2, user_id=default_user_id)
+            assert load_snapshots(default_user_id)[1].tolist() == [10000, 12000]
+
+            # (as a run that overlaps another one does)
+            rows = [{'user_id': default_user_id, 'day': datetime(2023, 1, 3).date(),
+                     'market_value': 12500, 'position_count': 1}]
+            for _ in range(2):
+                database.session.connection().execute(_upsert_statement(PortfolioSnapshot.__table__), rows)
+            database.session.commit()
+            assert load_snapshots(default_user_id)[1].tolist() == [10000, 12500]
+        finally:
+            test_client.application.config.pop('PRICE_HISTORY_DIR')
+            test_client.application.extensions.pop('price_history', None)
+            for model in (PortfolioSnapshot, SnapshotState):
+                model.query.filter_by(user_id=default_user_id).delete()
+            for model in (Lot, Holding, Transaction):
+                model.query.filter_by(stock_symbol='SNPD').delete()
+            database.session.commit()
+
+
+def test_snapshot_worker_pool(test_client, default_user_id, tmp_path):
+    """
+    GIVEN a Flask application with the stocks of two users and the price history of the symbols
+    WHEN the snapshots are taken in batches of one user on a pool of worker threads
+    THEN check the snapshots of each user are written, valued at their current positions
+    """
+    test_client.application.config['PRICE_HISTORY_DIR'] = str(tmp_path)
+    test_client.application.extensions.pop('price_history', None)
+    with test_client.application.app_context():
+        other_user = User('snapshots@email.com', 'SnapshotsPassword123')
+        database.session.add(other_user)
+        database.session.flush()
+        add_stocks([Stock('SNPB', '5', '10.00', default_user_id),
+                    Stock('SNPC', '3', '10.00', default_user_id),
+                    Stock('SNPB', '7', '10.00', other_user.id)])
+        database.session.commit()
+        store = get_price_history()
+        store.append('SNPB', ['2023-01-02', '2023-01-03'], [1000, 2000])
+        store.append('SNPC', ['2023-01-02', '2023-01-03'], [3000, 3000])
+
+        try:
+            result = take_snapshots(user_id=None, batch_size=1, workers=2, full=True)
+            assert result.users >= 2
+            assert load_snapshots(default_user_id)[1].tolist() == [5 * 1000 + 3 * 3000, 5 * 2000 + 3 * 3000]
+            assert load_snapshots(other_user.id)[1].tolist() == [7 * 1000, 7 * 2000]
+        finally:
+            test_client.application.config.pop('PRICE_HISTORY_DIR')
+            test_client.application.extensions.pop('price_history', None)
+            PortfolioSnapshot.query.delete()
+            SnapshotState.query.delete()
+            Stock.query.filter(Stock.stock_symbol.in_(['SNPB', 'SNPC'])).delete()
+            database.session.delete(other_user)
+            database.session.commit()
+            rebuild_summaries()
@@ -1,4 +1,8 @@
-from project import mail
+from project import mail, database, password_hasher
+from project.hashing import PasswordHasherBusy
+from project.models import User
+from sqlalchemy import func
+from werkzeug.security import generate_password_hash
 
 
 def test_get_registration_page(test_client):
@@ -21,14 +25,18 @@ def test_valid_registration(test_client):
     WHEN the '/users/register' page is posted to (POST) with valid data
     THEN check the response is valid and the user is registered
     """
+    response = test_client.post('/users/register',
+                                data={'email': 'siri@email.com',
+                                      'password': 'privatePassword123'},
+                                follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Thanks for registering, siri@email.com!' in response.data
+    assert b'Flask Stock Portfolio App' in response.data
+
+    # The email is queued in the outbox, and sent by the outbox worker
     with mail.record_messages() as outbox:
-        response = test_client.post('/users/register',
-                                    data={'email': 'siri@email.com',
-                                          'password': 'privatePassword123'},
-                                    follow_redirects=True)
-        assert response.status_code == 200
-        assert b'Thanks for registering, siri@email.com!' in response.data
-        assert b'Flask Stock Portfolio App' in response.data
+        result = test_client.application.test_cli_runner().invoke(args=['users', 'send-mail', '--once'])
+        assert result.exit_code == 0
         assert len(outbox) == 1
         assert outbox[0].subject == "Registration - Flask Stock Portfolio App"
         assert outbox[0].sender == "flaskstockportfolioapp@email.com"
@@ -71,6 +79,27 @@ def test_duplicate_registration(test_client):
     assert b'ERROR! Email (siri@email.com) already exists' in response.data
 
 
+def test_duplicate_registration_different_case(test_client):
+    """
+    GIVEN a Flask application configured for testing
+    WHEN the '/users/register' page is posted to (POST) with the email address of an existing user in a different case
+    THEN check an error message is returned to the user, and no second user is added
+    """
+    test_client.post('/users/register',
+                     data={'email': 'siri@email.com',
+                           'password': 'privatePassword123'},
+                     follow_redirects=True)
+    response = test_client.post('/users/register',
+                                data={'email': 'Siri@Email.COM',
+                                      'password': 'privatePassword123'},
+                                follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Thanks for registering' not in response.data
+    assert b'ERROR! Email (Siri@Email.COM) already exists' in response.data
+    with test_client.application.app_context():
+        assert User.query.filter(func.lower(User.email) == 'siri@email.com').count() == 1
+
+
 # --------------
 # Login and Logout
 # Test login:
@@ -305,3 +334,106 @@ def test_login_with_next_invalid_path(test_client, register_default_user):
     assert response.status_code == 400
     assert b'User Profile' not in response.data
     assert b'Email: siri@email.com' not in response.data
+
+
+def test_login_upgrades_weaker_password_hash(test_client):
+    """
+    GIVEN a Flask application configured for testing and a user whose password hash has fewer iterations
+    WHEN the '/users/login' page is posted to (POST) with valid credentials
+    THEN check the user is logged in and the password is re-hashed with the current setting
+    """
+    with test_client.application.app_context():
+        user = User('rehash@email.com', 'privatePassword123')
+        user.password_hashed = generate_password_hash('privatePassword123', 'pbkdf2:sha256:1000')
+        database.session.add(user)
+        database.session.commit()
+
+    response = test_client.post('/users/login',
+                                data={'email': 'rehash@email.com',
+                                      'password': 'privatePassword123'},
+                                follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Thanks for logging in, rehash@email.com!' in response.data
+
+    with test_client.application.app_context():
+        user = User.query.filter_by(email='rehash@email.com').first()
+        assert user.password_hashed.startswith(f'pbkdf2:sha256:{password_hasher.iterations}$')
+        assert not user.password_needs_rehash()
+        assert user.is_password_correct('privatePassword123')
+        database.session.delete(user)
+        database.session.commit()
+
+    test_client.get('/users/logout', follow_redirects=True)
+
+
+def test_login_when_password_hashing_busy(test_client, register_default_user, monkeypatch):
+    """
+    GIVEN a Flask application configured for testing and a full password hashing pool
+    WHEN the '/users/login' page is posted to (POST)
+    THEN check a 503 (Service Unavailable) error is returned straight away with a Retry-After header
+    """
+    def busy(*args):
+        raise PasswordHasherBusy('Too many passwords are being hashed')
+
+    monkeypatch.setattr(password_hasher, 'check', busy)
+    response = test_client.post('/users/login',
+                                data={'email': 'siri@email.com',
+                                      'password': 'privatePassword123'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert b'Service Unavailable (503)' in response.data
+
+
+def test_profile_uses_cached_user(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application configured for testing and the default user logged in
+    WHEN the '/users/profile' page is requested (GET) twice
+    THEN check the second request loads the user from the cache without querying the users table
+    """
+    response = test_client.get('/users/profile')
+    assert response.status_code == 200
+    assert b'Email: siri@email.com' in response.data
+
+    response = test_client.get('/users/profile')
+    assert response.status_code == 200
+    assert b'Email: siri@email.com' in response.data
+    # (the only query is the one for the user's portfolio summary)
+    assert 'desc="1 queries"' in response.headers['Server-Timing']
+
+
+def test_profile_after_user_changed(test_client, log_in_default_user):
+    """
+    GIVEN a Flask application configured for testing, the default user logged in and cached
+    WHEN the email of the user is changed and the '/users/profile' page is requested (GET)
+    THEN check the cached user was invalidated and the new email is shown
+    """
+    test_client.get('/users/profile')
+    with test_client.application.app_context():
+        user = User.query.filter_by(email='siri@email.com').first()
+        user.email = 'siri.new@email.com'
+        database.session.commit()
+
+    response = test_client.get('/users/profile')
+    assert response.status_code == 200
+    assert b'Email: siri.new@email.com' in response.data
+
+    # Reset the email of the default user
+    with test_client.application.app_context():
+        user = User.query.filter_by(email='siri.new@email.com').first()
+        user.email = 'siri@email.com'
+        database.session.commit()
+
+
+def test_login_email_case_insensitive(test_client, register_default_user):
+    """
+    GIVEN a Flask application configured for testing and a registered user
+    WHEN the '/users/login' page is posted to (POST) with the email in a different case
+    THEN check the user is logged in
+    """
+    response = test_client.post('/users/login',
+                                data={'email': 'Siri@Email.com',
+                                      'password': 'privatePassword123'},
+                                follow_redirects=True)
+    assert response.status_code == 200
+    assert b'Thanks for logging in, siri@email.com!' in response.data
+    test_client.get('/users/logout', follow_redirects=True)
@@ -0,0 +1,181 @@
+"""
+This file (test_users_cli.py) contains the functional tests for the CLI commands of the users blueprint.
+
+The emails are sent to a local SMTP stand-in, which records the connections and messages it receives.
+"""
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from project import database
+from project.models import OutboxMessage
+from project.users.outbox import queue_email, send_queued_emails
+
+
+class SMTPRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Minimal SMTP server: accepts every command, and records the data of each message
+    """
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost SMTP stand-in')
+        while True:
+            line = self.rfile.readline().decode().strip()
+            command = line.split(' ', 1)[0].upper()
+            if not line or command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            if command == 'RCPT' and self.server.refuse and self.server.refuse in line:
+                self.reply('550 Mailbox unavailable')
+            elif command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while (data_line := self.rfile.readline()) not in (b'.\r\n', b''):
+                    data.append(data_line)
+                self.server.messages.append(b''.join(data).decode())
+                self.reply('250 OK')
+            else:
+                self.reply('250 OK')
+
+
+@pytest.fixture(scope='function')
+def smtp_server(test_client, monkeypatch):
+    server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), SMTPRequestHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.messages = []
+    server.refuse = None
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    # Send the emails to the stand-in rather than suppressing them (as in testing)
+    mail_state = test_client.application.extensions['mail']
+    monkeypatch.setattr(mail_state, 'server', '127.0.0.1')
+    monkeypatch.setattr(mail_state, 'port', server.server_address[1])
+    monkeypatch.setattr(mail_state, 'suppress', False)
+    monkeypatch.setattr(mail_state, 'use_tls', False)
+    monkeypatch.setattr(mail_state, 'use_ssl', False)
+    monkeypatch.setattr(mail_state, 'username', None)
+    yield server
+
+    server.shutdown()
+    server.server_close()
+    with test_client.application.app_context():
+        OutboxMessage.query.delete()
+        database.session.commit()
+
+
+def test_send_mail_batch_over_one_connection(test_client, smtp_server):
+    """
+    GIVEN a Flask application and three emails in the outbox
+    WHEN the 'flask users send-mail --once' command is called
+    THEN check all three emails are sent over a single SMTP connection
+    """
+    with test_client.application.app_context():
+        for index in range(3):
+            queue_email([f'user{index}@email.com'], f'Welcome {index}', 'Thanks for registering!')
+        database.session.commit()
+
+    runner = test_client.application.test_cli_runner()
+    result = runner.invoke(args=['users', 'send-mail', '--once'])
+    assert result.exit_code == 0
+    assert 'Sent 3 emails (0 to be retried, 0 failed)' in result.output
+    assert smtp_server.connections == 1
+    assert len(smtp_server.messages) == 3
+    assert 'Subject: Welcome 0' in smtp_server.messages[0]
+
+    with test_client.application.app_context():
+        assert {message.status for message in OutboxMessage.query.all()} == {'sent'}
+
+    # The emails are only sent once
+    result = runner.invoke(args=['users', 'send-mail', '--once'])
+    assert result.exit_code == 0
+    assert len(smtp_server.messages) == 3
+
+
+def test_send_mail_retry_with_backoff(test_client, smtp_server):
+    """
+    GIVEN a Flask application and an email to a recipient refused by the SMTP server
+    WHEN the outbox is sent repeatedly
+    THEN check the email is retried with an exponential backoff and then marked as failed
+    """
+    smtp_server.refuse = 'refused@email.com'
+    test_client.application.config['MAIL_OUTBOX_MAX_ATTEMPTS'] = 3
+    test_client.application.config['MAIL_OUTBOX_RETRY_DELAY'] = 30
+    with test_client.application.app_context():
+        message = queue_email(['refused@email.com'], 'Welcome', 'Thanks for registering!')
+        queue_email(['accepted@email.com'], 'Welcome', 'Thanks for registering!')
+        database.session.commit()
+        message_id = message.id
+        now = datetime.utcnow()
+
+        result = send_queued_emails(now=now)
+        assert (result.sent, result.retried, result.failed) == (1, 1, 0)
+        message = database.session.get(OutboxMessage, message_id)
+        assert message.attempts == 1
+        assert message.next_attempt_at == now + timedelta(seconds=30)
+        assert 'SMTPRecipientsRefused' in message.last_error
+
+        # Not due yet
+        assert send_queued_emails(now=now + timedelta(seconds=29)).total == 0
+
+        now += timedelta(seconds=30)
+        send_queued_emails(now=now)
+        message = database.session.get(OutboxMessage, message_id)
+        assert message.attempts == 2
+        assert message.next_attempt_at == now + timedelta(seconds=60)
+
+        result = send_queued_emails(now=now + timedelta(seconds=60))
+        assert result.failed == 1
+        message = database.session.get(OutboxMessage, message_id)
+        assert message.status == 'failed'
+
+    test_client.application.config.pop('MAIL_OUTBOX_MAX_ATTEMPTS')
+    test_client.application.config.pop('MAIL_OUTBOX_RETRY_DELAY')
+
+
+def test_send_mail_smtp_server_down(test_client, smtp_server):
+    """
+    GIVEN a Flask application, an email in the outbox and an SMTP server that is down
+    WHEN the outbox is sent
+    THEN check the email is kept in the outbox to be retried
+    """
+    smtp_server.shutdown()
+    smtp_server.server_close()
+    with test_client.application.app_context():
+        message = queue_email(['siri@email.com'], 'Welcome', 'Thanks for registering!')
+        database.session.commit()
+        message_id = message.id
+
+        result = send_queued_emails()
+        assert result.retried == 1
+        message = database.session.get(OutboxMessage, message_id)
+        assert message.status == 'pending'
+        assert message.attempts == 1
+        assert message.claim_token is None
+
+
+def test_registration_email_sent_by_worker_thread(test_client, smtp_server):
+    """
+    GIVEN a Flask application with the outbox worker thread enabled
+    WHEN the '/users/register' page is posted to (POST) with valid data
+    THEN check the registration email is sent by the worker thread
+    """
+    test_client.application.config['MAIL_OUTBOX_THREAD'] = True
+    response = test_client.post('/users/register',
+                                data={'email': 'worker@email.com',
+                                      'password': 'privatePassword123'})
+    assert response.status_code == 302
+
+    deadline = time.monotonic() + 5
+    while not smtp_server.messages and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert len(smtp_server.messages) == 1
+    assert 'Subject: Registration - Flask Stock Portfolio App' in smtp_server.messages[0]
+    test_client.application.config.pop('MAIL_OUTBOX_THREAD')
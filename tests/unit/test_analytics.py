@@ -0,0 +1,94 @@
+"""
+This file contains the unit tests for the analytics.py file
+"""
+import math
+
+import numpy as np
+
+from project.stocks.analytics import (fill_gaps, daily_returns, rolling_volatility, max_drawdown, beta,
+                                      correlation_matrix, net_returns, time_weighted_return,
+                                      money_weighted_return, TRADING_DAYS)
+
+
+def test_fill_gaps():
+    """
+    GIVEN a price matrix with missing prices before, between and after the prices of a symbol
+    WHEN the gaps are filled
+    THEN check each missing price is the last price before it, or the first price before the history starts
+    """
+    nan = np.nan
+    prices = np.array([[nan, 10.0],
+                       [5.0, nan],
+                       [nan, 12.0],
+                       [6.0, nan]])
+    assert fill_gaps(prices).tolist() == [[5.0, 10.0], [5.0, 10.0], [5.0, 12.0], [6.0, 12.0]]
+
+
+def test_rolling_volatility_matches_standard_deviation():
+    """
+    GIVEN daily returns of two series
+    WHEN the rolling volatility is computed
+    THEN check each window equals the annualized sample standard deviation of its returns
+    """
+    returns = np.random.default_rng(1).normal(0, 0.01, size=(50, 2))
+    result = rolling_volatility(returns, 10)
+
+    assert result.shape == (41, 2)
+    expected = returns[5:15].std(axis=0, ddof=1) * math.sqrt(TRADING_DAYS)
+    assert np.allclose(result[5], expected)
+
+
+def test_max_drawdown_and_beta():
+    """
+    GIVEN the prices of a holding and of a benchmark
+    WHEN the max drawdown and beta are computed
+    THEN check the largest fall from a peak and the sensitivity to the benchmark
+    """
+    prices = np.array([100.0, 120.0, 90.0, 130.0, 117.0])
+    assert max_drawdown(prices) == 90.0 / 120.0 - 1.0
+
+    benchmark_returns = np.array([0.01, -0.02, 0.03, 0.0])
+    returns = np.column_stack([2 * benchmark_returns, -benchmark_returns + 0.001])
+    assert np.allclose(beta(returns, benchmark_returns), [2.0, -1.0])
+
+
+def test_correlation_matrix():
+    """
+    GIVEN returns of three holdings, one of which never changes
+    WHEN the correlation matrix is computed
+    THEN check it matches numpy.corrcoef and the constant holding has no correlation (NaN)
+    """
+    rng = np.random.default_rng(2)
+    returns = np.column_stack([rng.normal(size=30), rng.normal(size=30), np.zeros(30)])
+    correlation = correlation_matrix(returns)
+
+    assert np.allclose(correlation[:2, :2], np.corrcoef(returns[:, :2], rowvar=False))
+    assert np.isnan(correlation[2]).all()
+
+
+def test_time_and_money_weighted_returns():
+    """
+    GIVEN a portfolio that doubles in value, then gets a deposit that is followed by a fall
+    WHEN the time-weighted and money-weighted returns are computed
+    THEN check the time-weighted return ignores the deposit and the money-weighted return is lower
+    """
+    values = np.array([100.0, 200.0, 400.0, 200.0])
+    flows = np.array([0.0, 0.0, 200.0, 0.0])
+
+    returns = net_returns(values, flows)
+    assert returns.tolist() == [1.0, 0.0, -0.5]
+    assert time_weighted_return(returns) == 0.0
+
+    # 100 paid in, growing to 110 after one year, is a 10% money-weighted return
+    days = np.array([0, 365, 730, 1096])
+    assert abs(money_weighted_return(np.array([0, 365.25]), np.array([100.0, 110.0]), np.zeros(2)) - 0.1) < 1e-9
+    assert money_weighted_return(days, values, flows) < 0.0
+
+
+def test_daily_returns_of_zero_price():
+    """
+    GIVEN a series with a price of zero
+    WHEN the daily returns are computed
+    THEN check the return after the zero price is 0 instead of infinity
+    """
+    assert np.allclose(daily_returns(np.array([0.0, 10.0, 11.0])), [0.0, 0.1])
@@ -0,0 +1,36 @@
+"""
+This file contains the unit tests for the benchmark suite (benchmarks/suite.py)
+"""
+from benchmarks.suite import compare_results
+
+
+def make_results(**ops_per_sec):
+    return {'meta': {}, 'results': [{'name': name, 'size': 1000, 'ops_per_sec': ops}
+                                    for name, ops in ops_per_sec.items()]}
+
+
+def test_compare_results_within_threshold():
+    """
+    GIVEN baseline and current benchmark results
+    WHEN the throughput changed by less than the allowed regression
+    THEN check no regression is reported
+    """
+    lines, regressions = compare_results(make_results(list_stocks=100.0, login=10.0),
+                                         make_results(list_stocks=95.0, login=12.0),
+                                         max_regression=10)
+    assert regressions == []
+    assert len(lines) == 2
+
+
+def test_compare_results_regression():
+    """
+    GIVEN baseline and current benchmark results
+    WHEN the throughput of a benchmark dropped by more than the allowed regression
+    THEN check the benchmark is reported as a regression
+    """
+    lines, regressions = compare_results(make_results(list_stocks=100.0, login=10.0),
+                                         make_results(list_stocks=80.0, login=10.0, register=5.0),
+                                         max_regression=10)
+    assert regressions == [(('list_stocks', 1000), -20.0)]
+    assert 'REGRESSION' in lines[0]
+    assert '(no baseline)' in lines[2]
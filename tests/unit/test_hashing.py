@@ -0,0 +1,98 @@
+"""
+This file (test_hashing.py) contains the unit tests for the hashing.py file.
+"""
+import threading
+import time
+import pytest
+from werkzeug.security import generate_password_hash
+from project.hashing import PasswordHasher, PasswordHasherBusy
+
+
+@pytest.fixture
+def pool_hasher():
+    hasher = PasswordHasher()
+    hasher.configure(workers=1, queue_depth=1, iterations=1000)
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_and_check_inline():
+    """
+    GIVEN a password hasher that hasn't been initialized with an application
+    WHEN a password is hashed and checked
+    THEN check the password is hashed on the calling thread with the current setting
+    """
+    hasher = PasswordHasher()
+    hasher.configure(workers=0, iterations=1000)
+    password_hashed = hasher.hash('FlaskIsAwesome123')
+    assert password_hashed.startswith('pbkdf2:sha256:1000$')
+    assert hasher.check(password_hashed, 'FlaskIsAwesome123')
+    assert not hasher.check(password_hashed, 'FlaskIsNotAwesome')
+
+
+def test_hash_and_check_on_pool(pool_hasher):
+    """
+    GIVEN a password hasher with a process pool
+    WHEN a password is hashed and checked
+    THEN check the hash is created and verified by the pool
+    """
+    password_hashed = pool_hasher.hash('FlaskIsAwesome123')
+    assert password_hashed.startswith('pbkdf2:sha256:1000$')
+    assert pool_hasher.check(password_hashed, 'FlaskIsAwesome123')
+    assert not pool_hasher.check(password_hashed, 'FlaskIsNotAwesome')
+
+
+def test_pool_queue_full(pool_hasher):
+    """
+    GIVEN a password hasher with a queue depth of one
+    WHEN a second password is hashed while the first one is still being hashed
+    THEN check the second password is rejected straight away (PasswordHasherBusy)
+    """
+    pool_hasher.hash('warm-up')
+    pool_hasher.iterations = 2000000
+    started = threading.Event()
+    thread = threading.Thread(target=lambda: (started.set(), pool_hasher.hash('FlaskIsAwesome123')))
+    thread.start()
+    started.wait()
+    # Wait for the first hash to take the only slot
+    while pool_hasher._slots._value:
+        time.sleep(0.001)
+    with pytest.raises(PasswordHasherBusy):
+        pool_hasher.hash('FlaskIsAwesome123')
+    thread.join()
+
+
+def test_configure_while_hashing(pool_hasher, caplog):
+    """
+    GIVEN a password hasher with a queue depth of one
+    WHEN the hasher is reconfigured while a password is being hashed
+    THEN check the slot of that password is released to the old queue, not the new one
+    """
+    pool_hasher.hash('warm-up')
+    pool_hasher.iterations = 2000000
+    old_slots = pool_hasher._slots
+    thread = threading.Thread(target=lambda: pool_hasher.hash('FlaskIsAwesome123'))
+    thread.start()
+    while old_slots._value:
+        time.sleep(0.001)
+    pool_hasher.configure(workers=1, queue_depth=2, iterations=1000)
+    thread.join()
+    assert old_slots._value == 1
+    assert pool_hasher._slots._value == 2
+    assert not [record for record in caplog.records if record.levelname == 'ERROR']
+    assert pool_hasher.check(pool_hasher.hash('FlaskIsAwesome123'), 'FlaskIsAwesome123')
+
+
+def test_needs_rehash():
+    """
+    GIVEN a password hasher configured with 1000 iterations
+    WHEN password hashes created with other settings are checked
+    THEN check only the weaker hashes need to be re-hashed
+    """
+    hasher = PasswordHasher()
+    hasher.configure(workers=0, iterations=1000)
+    assert hasher.needs_rehash(generate_password_hash('password', 'pbkdf2:sha256:500'))
+    assert not hasher.needs_rehash(generate_password_hash('password', 'pbkdf2:sha256:1000'))
+    assert not hasher.needs_rehash(generate_password_hash('password', 'pbkdf2:sha256:2000'))
+    assert hasher.needs_rehash(generate_password_hash('password', 'pbkdf2:sha1:1000'))
+    assert hasher.needs_rehash('plain-text')
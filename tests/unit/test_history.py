@@ -0,0 +1,77 @@
+"""
+This file contains the unit tests for the history.py file
+"""
+from datetime import date
+
+import numpy as np
+import pytest
+
+from project.stocks.history import PriceHistoryStore, PriceHistoryError, RECORD_DTYPE, to_day
+
+
+def test_append_and_read_range(tmp_path):
+    """
+    GIVEN a price history store
+    WHEN closing prices are appended out of order and read between two dates
+    THEN check the records are sorted and only the ones in the range are returned, as a memory-mapped view
+    """
+    store = PriceHistoryStore(str(tmp_path))
+    written = store.append('AAPL', [date(2023, 1, 4), date(2023, 1, 2), date(2023, 1, 3), date(2023, 1, 6)],
+                           [12600, 12500, 12550, 12900])
+    assert written == 4
+
+    series = store.read('AAPL', start='2023-01-03', end=date(2023, 1, 5))
+    assert len(series) == 2
+    assert list(series.closes) == [12550, 12600]
+    assert list(series.dates) == [np.datetime64('2023-01-03'), np.datetime64('2023-01-04')]
+    assert isinstance(series.records, np.memmap)
+
+    assert len(store.read('AAPL')) == 4
+    assert len(store.read('AAPL', start='2024-01-01')) == 0
+    assert len(store.read('MSFT')) == 0
+    assert store.symbols() == ['AAPL']
+
+
+def test_append_only_after_last_day(tmp_path):
+    """
+    GIVEN a price history store with prices of a symbol
+    WHEN prices are appended that overlap the stored prices (e.g. the same file is loaded twice)
+    THEN check only the prices after the last stored day are written
+    """
+    store = PriceHistoryStore(str(tmp_path))
+    store.append('HD', ['2023-01-02', '2023-01-03'], [30000, 30100])
+    assert store.append('HD', ['2023-01-02', '2023-01-03'], [30000, 30100]) == 0
+    assert store.append('HD', ['2023-01-03', '2023-01-04', '2023-01-04'], [1, 30200, 30300]) == 1
+
+    series = store.read('HD')
+    assert list(series.closes) == [30000, 30100, 30300]
+    assert store.last_day('HD') == to_day('2023-01-04')
+
+
+def test_partial_record_is_ignored(tmp_path):
+    """
+    GIVEN a price history file that ends with a partial record
+    WHEN the file is read and appended to
+    THEN check the partial record is ignored and then overwritten
+    """
+    store = PriceHistoryStore(str(tmp_path))
+    store.append('DIS', ['2023-01-02'], [10000])
+    with open(store.path('DIS'), 'ab') as file:
+        file.write(b'\x01\x02\x03')
+
+    assert len(store.read('DIS')) == 1
+    store.append('DIS', ['2023-01-03'], [10100])
+    assert list(store.read('DIS').closes) == [10000, 10100]
+    assert (tmp_path / 'DIS.bin').stat().st_size == 2 * RECORD_DTYPE.itemsize
+
+
+def test_invalid_symbol(tmp_path):
+    """
+    GIVEN a price history store
+    WHEN prices are appended for a symbol that isn't a valid stock symbol
+    THEN check a PriceHistoryError is raised and no file is written outside the store
+    """
+    store = PriceHistoryStore(str(tmp_path / 'history'))
+    with pytest.raises(PriceHistoryError):
+        store.append('../../etc', ['2023-01-02'], [1])
+    assert not (tmp_path / 'history').exists()
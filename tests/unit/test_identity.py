@@ -0,0 +1,79 @@
+"""
+This file (test_identity.py) contains the unit tests for the user cache (users/identity.py file).
+"""
+import pytest
+from project.cache import RedisCache, MISSING, TTLCache
+from project.users.identity import create_user_cache
+
+
+class FakeRedis:
+    """
+    In-memory stand-in for the few commands of a Redis client used by RedisCache
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.expiry = {}
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def set(self, name, value, px=None):
+        self.values[name] = value.encode()
+        self.expiry[name] = px
+
+    def delete(self, *names):
+        for name in names:
+            self.values.pop(name, None)
+
+    def scan_iter(self, match):
+        return [name for name in self.values if name.startswith(match.rstrip('*'))]
+
+
+def test_redis_cache():
+    """
+    GIVEN a Redis cache with a key prefix
+    WHEN values are set, read and deleted
+    THEN check the values are stored as JSON under the prefixed keys with the TTL in milliseconds
+    """
+    client = FakeRedis()
+    cache = RedisCache(prefix='user:', ttl=30, client=client)
+    assert cache.get(1) is MISSING
+    cache.set(1, {'id': 1, 'email': 'patrick@gmail.com'})
+    assert client.values['user:1'] == b'{"id": 1, "email": "patrick@gmail.com"}'
+    assert client.expiry['user:1'] == 30000
+    assert cache.get(1) == {'id': 1, 'email': 'patrick@gmail.com'}
+    assert 1 in cache
+    cache.delete(1)
+    assert 1 not in cache
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+
+
+def test_redis_cache_clear():
+    """
+    GIVEN a Redis cache sharing the Redis database with other keys
+    WHEN the cache is cleared
+    THEN check only the keys of the cache are deleted
+    """
+    client = FakeRedis()
+    client.values['other'] = b'1'
+    cache = RedisCache(prefix='user:', client=client)
+    cache.set(1, 'one')
+    cache.set(2, 'two')
+    cache.clear()
+    assert list(client.values) == ['other']
+
+
+def test_create_user_cache():
+    """
+    GIVEN the user cache configuration
+    WHEN the user cache is created
+    THEN check the configured backend is used
+    """
+    cache = create_user_cache({'USER_CACHE_SIZE': 10, 'USER_CACHE_TTL': 5})
+    assert isinstance(cache, TTLCache)
+    assert cache.maxsize == 10
+    assert cache.ttl == 5
+    assert create_user_cache({'USER_CACHE_BACKEND': 'none'}) is None
+    with pytest.raises(ValueError):
+        create_user_cache({'USER_CACHE_BACKEND': 'memcached'})
@@ -0,0 +1,89 @@
+"""
+This file contains the unit tests for the importer.py file
+"""
+import io
+import pytest
+from project.stocks.importer import read_json_rows, read_ndjson_rows, read_csv_rows, get_row_reader
+
+
+def test_read_csv_rows():
+    """
+    GIVEN a CSV file with a header row
+    WHEN the rows are read
+    THEN check one dictionary is returned per row
+    """
+    file = io.StringIO('stock_symbol,number_of_shares,purchase_price\nAAPL,16,406.78\nHD,25,247.29\n')
+    rows = list(read_csv_rows(file))
+    assert rows == [{'stock_symbol': 'AAPL', 'number_of_shares': '16', 'purchase_price': '406.78'},
+                    {'stock_symbol': 'HD', 'number_of_shares': '25', 'purchase_price': '247.29'}]
+
+
+def test_read_json_rows_across_chunks():
+    """
+    GIVEN a JSON array of stocks
+    WHEN the rows are read with a chunk size smaller than one object
+    THEN check every object is decoded
+    """
+    file = io.StringIO('[{"stock_symbol": "AAPL", "number_of_shares": 16, "purchase_price": 406.78},\n'
+                       ' {"stock_symbol": "HD", "number_of_shares": 25, "purchase_price": 247.29}]')
+    rows = list(read_json_rows(file, chunk_size=7))
+    assert [row['stock_symbol'] for row in rows] == ['AAPL', 'HD']
+    assert rows[1]['purchase_price'] == 247.29
+
+
+def test_read_json_rows_invalid_element():
+    """
+    GIVEN a JSON array of stocks with an invalid object in the middle
+    WHEN the rows are read with a chunk size smaller than one object
+    THEN check the invalid object is returned as an error and the objects after it are still read
+    """
+    file = io.StringIO('[{"stock_symbol": "AAPL", "number_of_shares": 16},\n'
+                       ' {"stock_symbol": "DIS", "number_of_shares": 1O, "note": "}, {"},\n'
+                       ' {"stock_symbol": "HD", "number_of_shares": 25},\n'
+                       ' {"stock_symbol": "NKE" "number_of_shares": 3},\n'
+                       ' {"stock_symbol": "KO", "number_of_shares": 4}]')
+    rows = list(read_json_rows(file, chunk_size=7))
+    assert [row['stock_symbol'] if isinstance(row, dict) else 'error' for row in rows] == \
+        ['AAPL', 'error', 'HD', 'error', 'KO']
+    assert str(rows[1]).startswith('Invalid JSON')
+
+
+def test_read_json_rows_element_too_long():
+    """
+    GIVEN a JSON array of stocks with an object longer than the maximum row size
+    WHEN the rows are read
+    THEN check the long object is returned as an error without being held in memory, and the next object is read
+    """
+    file = io.StringIO('[{"stock_symbol": "AAPL", "note": "' + 'x' * 1000 + '"},\n'
+                       ' {"stock_symbol": "HD", "number_of_shares": 25}]')
+    rows = list(read_json_rows(file, chunk_size=16, max_row_size=100))
+    assert str(rows[0]) == 'Row is longer than 100 characters'
+    assert rows[1] == {'stock_symbol': 'HD', 'number_of_shares': 25}
+    assert len(rows) == 2
+
+
+def test_read_ndjson_rows_invalid_line():
+    """
+    GIVEN a newline-delimited JSON file with an invalid line
+    WHEN the rows are read
+    THEN check the invalid line is returned as an error and the next line is still read
+    """
+    file = io.StringIO('{"stock_symbol": "AAPL"}\n{not json}\n\n{"stock_symbol": "HD"}\n')
+    rows = list(read_ndjson_rows(file))
+    assert rows[0] == {'stock_symbol': 'AAPL'}
+    assert isinstance(rows[1], ValueError)
+    assert rows[2] == {'stock_symbol': 'HD'}
+
+
+def test_get_row_reader():
+    """
+    GIVEN file names with different extensions
+    WHEN the row reader is selected
+    THEN check the reader matches the extension and unsupported formats are rejected
+    """
+    assert get_row_reader('stocks.CSV') is read_csv_rows
+    assert get_row_reader('stocks.json') is read_json_rows
+    assert get_row_reader('stocks.jsonl') is read_ndjson_rows
+    assert get_row_reader('stocks.txt', 'ndjson') is read_ndjson_rows
+    with pytest.raises(ValueError):
+        get_row_reader('stocks.xlsx')
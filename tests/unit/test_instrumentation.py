@@ -0,0 +1,79 @@
+"""
+This file contains the unit tests for the instrumentation.py file
+"""
+import logging
+
+import pytest
+from flask import Flask
+
+from project.instrumentation import Histogram, MetricsRegistry, register_instrumentation, resolve_log_level
+
+
+def test_histogram_buckets_are_cumulative():
+    """
+    GIVEN a histogram with three buckets
+    WHEN values are observed
+    THEN check the rendered buckets are cumulative and the sum and count are correct
+    """
+    histogram = Histogram('request_seconds', 'Request time', ('endpoint',), buckets=(0.1, 0.5, 1.0))
+    for value in [0.05, 0.1, 0.3, 2.0]:
+        histogram.observe(value, 'stocks.list_stocks')
+
+    lines = histogram.render().splitlines()
+    assert lines[0] == '# HELP request_seconds Request time'
+    assert lines[1] == '# TYPE request_seconds histogram'
+    assert 'request_seconds_bucket{endpoint="stocks.list_stocks",le="0.1"} 2' in lines
+    assert 'request_seconds_bucket{endpoint="stocks.list_stocks",le="0.5"} 3' in lines
+    assert 'request_seconds_bucket{endpoint="stocks.list_stocks",le="1.0"} 3' in lines
+    assert 'request_seconds_bucket{endpoint="stocks.list_stocks",le="+Inf"} 4' in lines
+    assert 'request_seconds_sum{endpoint="stocks.list_stocks"} 2.45' in lines
+    assert 'request_seconds_count{endpoint="stocks.list_stocks"} 4' in lines
+    assert histogram.count('stocks.list_stocks') == 4
+
+
+def test_metrics_registry_reuses_histograms():
+    """
+    GIVEN a metrics registry
+    WHEN the same histogram is requested twice
+    THEN check the same histogram is returned
+    """
+    registry = MetricsRegistry()
+    histogram = registry.histogram('queries', 'Queries per request')
+    assert registry.histogram('queries', 'Queries per request') is histogram
+    assert registry.render() == '# HELP queries Queries per request\n# TYPE queries histogram\n'
+
+
+def test_resolve_log_level():
+    """
+    GIVEN the names and numbers of logging levels
+    WHEN they are resolved to level numbers
+    THEN check names in any case and numbers are accepted, and an unknown name is rejected
+    """
+    assert resolve_log_level('WARNING') == logging.WARNING
+    assert resolve_log_level('warning') == logging.WARNING
+    assert resolve_log_level(30) == logging.WARNING
+    assert resolve_log_level('40') == logging.ERROR
+    with pytest.raises(ValueError):
+        resolve_log_level('loud')
+
+
+@pytest.mark.parametrize('level', ['error', logging.ERROR, 'warning', logging.WARNING])
+def test_access_log_level_threshold(level, caplog):
+    """
+    GIVEN a Flask application with the access log level set to a lower-case name or a number
+    WHEN a valid page and a missing page are requested (GET)
+    THEN check the requests succeed, and only the records at or above the level are written
+    """
+    app = Flask(__name__)
+    app.config['ACCESS_LOG_LEVEL'] = level
+    register_instrumentation(app)
+    app.add_url_rule('/valid', 'valid', lambda: 'OK')
+    client = app.test_client()
+
+    with caplog.at_level(logging.INFO, logger=app.logger.name):
+        assert client.get('/valid').status_code == 200
+        assert client.get('/missing-page').status_code == 404
+
+    records = [record for record in caplog.records if hasattr(record, 'access')]
+    expected = [] if resolve_log_level(level) == logging.ERROR else [404]
+    assert [record.access['status'] for record in records] == expected
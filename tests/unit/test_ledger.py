@@ -0,0 +1,84 @@
+"""
+This file contains the unit tests for the ledger.py file
+"""
+import pytest
+
+from project.stocks.ledger import LotBook, OpenLot, LedgerError, take_shares
+
+
+def test_take_shares_partial_lot():
+    """
+    GIVEN two open lots
+    WHEN more shares are taken than the first lot holds
+    THEN check the first lot is emptied and the cost of the second lot is reduced in proportion
+    """
+    lots = [OpenLot(10, 1000), OpenLot(20, 3000)]
+    cost, emptied = take_shares(lots, 15)
+
+    assert cost == 1000 + 750
+    assert emptied == [lots[0]]
+    assert lots[1].quantity == 15
+    assert lots[1].cost == 2250
+
+
+def test_take_shares_not_enough():
+    """
+    GIVEN one open lot
+    WHEN more shares are taken than the lot holds
+    THEN check a LedgerError is raised
+    """
+    with pytest.raises(LedgerError):
+        take_shares([OpenLot(10, 1000)], 11)
+
+
+@pytest.mark.parametrize('method, cost_basis, realized_gain', [
+    ('fifo', 20 * 2000, 10 * 2500 - 10 * 1000),
+    ('lifo', 10 * 1000 + 10 * 2000, 10 * 2500 - 10 * 2000),
+    # (10 of the 30 shares that cost $500.00 in total, rounded down to the cent)
+    ('average', 50000 - 16666, 10 * 2500 - 16666),
+])
+def test_lot_book_cost_methods(method, cost_basis, realized_gain):
+    """
+    GIVEN a lot book with two buys at different prices
+    WHEN some of the shares are sold
+    THEN check the cost basis and realized gain follow the cost method
+    """
+    book = LotBook(method)
+    book.buy(10, 1000, transaction_id=1)
+    book.buy(20, 2000, transaction_id=2)
+    book.sell(10, 2500)
+
+    assert book.shares == 20
+    assert book.cost_basis == cost_basis
+    assert book.realized_gain == realized_gain
+    assert len(book.lots) == (1 if method != 'lifo' else 2)
+
+
+def test_lot_book_split():
+    """
+    GIVEN a lot book with two open lots
+    WHEN a 3-for-2 split is applied
+    THEN check the shares of every lot are multiplied (dropping fractional shares) and the cost is unchanged
+    """
+    book = LotBook('fifo')
+    book.buy(10, 1000)
+    book.buy(5, 1000)
+    book.apply('split', None, None, 3, 2)
+
+    assert [lot.quantity for lot in book.lots] == [15, 7]
+    assert book.shares == 22
+    assert book.cost_basis == 15000
+
+
+def test_lot_book_sell_too_many():
+    """
+    GIVEN a lot book with 10 shares
+    WHEN 11 shares are sold
+    THEN check a LedgerError is raised and the lots are unchanged
+    """
+    book = LotBook('fifo')
+    book.buy(10, 1000)
+    with pytest.raises(LedgerError):
+        book.sell(11, 1000)
+    assert book.shares == 10
+    assert book.lots[0].quantity == 10
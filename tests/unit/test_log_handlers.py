@@ -0,0 +1,73 @@
+"""
+This file contains the unit tests for the log_handlers.py file
+"""
+import logging
+import queue
+import pytest
+from project.log_handlers import BoundedQueueHandler, attach_async_handlers
+
+
+def make_record(message):
+    return logging.LogRecord('project', logging.INFO, __file__, 1, message, None, None)
+
+
+def test_bounded_queue_handler_drop_new():
+    """
+    GIVEN a queue handler with the 'drop_new' policy and a full queue
+    WHEN another record is logged
+    THEN check the new record is discarded and counted
+    """
+    log_queue = queue.Queue(maxsize=2)
+    handler = BoundedQueueHandler(log_queue, drop_policy='drop_new')
+    for message in ['one', 'two', 'three']:
+        handler.handle(make_record(message))
+    assert [log_queue.get_nowait().msg for _ in range(2)] == ['one', 'two']
+    assert handler.dropped == 1
+
+
+def test_bounded_queue_handler_drop_oldest():
+    """
+    GIVEN a queue handler with the 'drop_oldest' policy and a full queue
+    WHEN another record is logged
+    THEN check the oldest record is discarded to make room for the new one
+    """
+    log_queue = queue.Queue(maxsize=2)
+    handler = BoundedQueueHandler(log_queue, drop_policy='drop_oldest')
+    for message in ['one', 'two', 'three']:
+        handler.handle(make_record(message))
+    assert [log_queue.get_nowait().msg for _ in range(2)] == ['two', 'three']
+    assert handler.dropped == 1
+
+
+def test_bounded_queue_handler_invalid_policy():
+    """
+    GIVEN a queue handler
+    WHEN an unknown drop policy is requested
+    THEN check a ValueError is raised
+    """
+    with pytest.raises(ValueError):
+        BoundedQueueHandler(queue.Queue(), drop_policy='drop_everything')
+
+
+def test_async_logging_flushes_on_stop(tmp_path):
+    """
+    GIVEN a logger using asynchronous logging to a file
+    WHEN records are logged and the listener is stopped
+    THEN check every record has been written to the file
+    """
+    filename = tmp_path / 'test.log'
+    file_handler = logging.FileHandler(filename)
+    logger = logging.getLogger('test_async_logging')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    async_logging = attach_async_handlers(logger, [file_handler], queue_size=1000, drop_policy='block')
+    for index in range(500):
+        logger.info(f'Message {index}')
+    async_logging.stop()
+    logger.removeHandler(async_logging.handler)
+    file_handler.close()
+
+    lines = filename.read_text().splitlines()
+    assert len(lines) == 500
+    assert lines[-1] == 'Message 499'
@@ -1,18 +1,19 @@
 """
 This file contains the unit tests fo the models.py file
 """
-from project.models import Stock
+from project.models import Stock, User
 
 
 def test_new_stock(new_stock):
     """
     GIVEN a Stock model
     WHEN a new Stock object is created
-    THEN check the symbol, number of shares, and purchase price fields are defined correctly
+    THEN check the symbol, number of shares, purchase price, and user ID fields are defined correctly
     """
     assert new_stock.stock_symbol == 'AAPL'
     assert new_stock.number_of_shares == 16
     assert new_stock.purchase_price == 40678
+    assert new_stock.user_id == 17
 
 
 def test_new_user(new_user):
@@ -22,4 +23,13 @@ def test_new_user(new_user):
     THEN check the email is valid and hashed password does not equal the password provided
     """
     assert new_user.email == 'siri@email.com'
-    assert new_user.password_hashed != 'privatePassword123'
\ No newline at end of file
+    assert new_user.password_hashed != 'privatePassword123'
+
+
+def test_new_user_email_lower_case():
+    """
+    GIVEN a User model
+    WHEN a new User object is created with an email in mixed case
+    THEN check the email is stored in lower case
+    """
+    assert User('Siri@Email.COM', 'privatePassword123').email == 'siri@email.com'
@@ -0,0 +1,317 @@
+"""
+This file contains the unit tests for the quotes.py and cache.py files
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from project.cache import TTLCache, MISSING
+from project.stocks.quotes import QuoteCache, QuoteProvider, QuoteProviderError, StubQuoteProvider, \
+    HttpQuoteProvider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CountingProvider(QuoteProvider):
+    def __init__(self, prices):
+        self.prices = prices
+        self.calls = []
+
+    def get_quote(self, symbol):
+        self.calls.append(symbol)
+        if symbol == 'DOWN':
+            raise QuoteProviderError('provider unavailable')
+        return self.prices.get(symbol)
+
+
+def test_ttl_cache_expires_entries():
+    """
+    GIVEN an LRU cache with a time-to-live
+    WHEN an entry is read before and after its time-to-live
+    THEN check the entry is a hit and then a miss
+    """
+    clock = FakeClock()
+    cache = TTLCache(maxsize=10, ttl=60, timer=clock)
+    cache.set('AAPL', 43217)
+    assert cache.get('AAPL') == 43217
+    clock.now = 61
+    assert cache.get('AAPL') is MISSING
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    """
+    GIVEN an LRU cache that is full
+    WHEN a new entry is added
+    THEN check the least recently used entry is evicted
+    """
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set('AAPL', 1)
+    cache.set('HD', 2)
+    cache.get('AAPL')
+    cache.set('DIS', 3)
+    assert 'AAPL' in cache
+    assert 'HD' not in cache
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_evicts_to_byte_budget():
+    """
+    GIVEN an LRU cache with a budget of bytes
+    WHEN entries are added until their sizes go over the budget
+    THEN check the least recently used entries are evicted to fit, and an entry larger than the budget isn't cached
+    """
+    cache = TTLCache(maxsize=10, ttl=60, maxbytes=10)
+    cache.set('a', 'x' * 4)
+    cache.set('b', 'x' * 4)
+    cache.set('c', 'x' * 4)
+    assert 'a' not in cache
+    assert cache.stats()['bytes'] == 8
+
+    # Replacing an entry only counts its new size
+    cache.set('c', 'x' * 2)
+    assert cache.stats()['bytes'] == 6
+
+    cache.set('d', 'x' * 11)
+    assert 'd' not in cache
+    assert cache.stats()['size'] == 2
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_existing_keys():
+    """
+    GIVEN an LRU cache with live, expired and evicted entries
+    WHEN the keys that are cached are looked up together
+    THEN check only the live keys are returned, without counting lookups or changing the LRU order
+    """
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=60, timer=clock)
+    cache.set('AAPL', 1)
+    cache.set('HD', 2, ttl=10)
+    cache.set('DIS', 3)
+    clock.now = 11
+    assert cache.existing(['AAPL', 'HD', 'DIS', 'MSFT']) == {'DIS'}
+    assert cache.hits == cache.misses == 0
+
+    cache.set('MSFT', 4)
+    cache.existing(['DIS'])
+    cache.set('AAPL', 1)
+    assert cache.existing(['DIS', 'MSFT', 'AAPL']) == {'MSFT', 'AAPL'}
+
+
+def test_quote_cache_one_upstream_call_per_ttl_window():
+    """
+    GIVEN a quote cache in front of a quote provider
+    WHEN the same symbol is requested repeatedly within and after the TTL window
+    THEN check the provider is called once per TTL window
+    """
+    clock = FakeClock()
+    provider = CountingProvider({'AAPL': 43217})
+    quote_cache = QuoteCache(provider, ttl=60, cache=TTLCache(ttl=60, timer=clock))
+    for _ in range(5):
+        assert quote_cache.get_price('aapl') == 43217
+    assert provider.calls == ['AAPL']
+    assert quote_cache.hits == 4
+
+    clock.now = 61
+    assert quote_cache.get_price('AAPL') == 43217
+    assert provider.calls == ['AAPL', 'AAPL']
+
+
+def test_quote_cache_negative_caching():
+    """
+    GIVEN a quote cache in front of a quote provider
+    WHEN an unknown symbol is checked repeatedly
+    THEN check the symbol is reported as unknown and the provider is called once
+    """
+    provider = CountingProvider({})
+    quote_cache = QuoteCache(provider)
+    assert not quote_cache.is_known('XYZ')
+    assert not quote_cache.is_known('XYZ')
+    assert quote_cache.get_prices(['XYZ']) == {}
+    assert provider.calls == ['XYZ']
+
+
+def test_quote_cache_unknown_symbols(test_client):
+    """
+    GIVEN a quote cache in front of a quote provider
+    WHEN the unknown symbols of a list of known, unknown and unavailable symbols are requested twice
+    THEN check only the unknown symbol is returned, and the provider is called once for each symbol
+    """
+    provider = CountingProvider({'AAPL': 43217})
+    quote_cache = QuoteCache(provider)
+    with test_client.application.app_context():
+        assert quote_cache.unknown_symbols(['aapl', 'XYZ', 'DOWN']) == {'XYZ'}
+        assert quote_cache.unknown_symbols(['AAPL', 'XYZ']) == {'XYZ'}
+    assert sorted(provider.calls) == ['AAPL', 'DOWN', 'XYZ']
+
+
+def test_quote_cache_does_not_cache_provider_errors(test_client):
+    """
+    GIVEN a quote cache in front of a quote provider that is unavailable
+    WHEN a symbol is requested twice
+    THEN check no price is returned, the symbol isn't rejected and the provider is retried
+    """
+    provider = CountingProvider({})
+    quote_cache = QuoteCache(provider)
+    with test_client.application.app_context():
+        assert quote_cache.get_price('DOWN') is None
+        assert quote_cache.is_known('DOWN')
+    assert provider.calls == ['DOWN', 'DOWN']
+
+
+def test_stub_quote_provider_reloads_file(tmp_path):
+    """
+    GIVEN a stub quote provider reading a JSON file
+    WHEN the file is changed
+    THEN check the new prices are returned
+    """
+    filename = tmp_path / 'quotes.json'
+    filename.write_text(json.dumps({'AAPL': 432.17}))
+    provider = StubQuoteProvider(str(filename))
+    assert provider.get_quote('aapl') == 43217
+    assert provider.get_quote('HD') is None
+
+    filename.write_text(json.dumps({'AAPL': 400, 'HD': 300.5}))
+    assert provider.get_quote('AAPL') == 40000
+    assert provider.get_quote('HD') == 30050
+
+
+def test_stub_quote_provider_malformed_file(tmp_path):
+    """
+    GIVEN a stub quote provider reading a JSON file
+    WHEN the file is malformed (half-written, or with a price that isn't a number)
+    THEN check a QuoteProviderError is raised (so the quotes are left out), until the file is fixed
+    """
+    filename = tmp_path / 'quotes.json'
+    provider = StubQuoteProvider(str(filename))
+    for content in ('{"AAPL": 43', json.dumps({'AAPL': 'n/a'}), json.dumps(['AAPL'])):
+        filename.write_text(content)
+        with pytest.raises(QuoteProviderError):
+            provider.get_quote('AAPL')
+        assert provider.get_quotes(['AAPL']) == {}
+
+    filename.write_text(json.dumps({'AAPL': 432.17, 'HD': None}))
+    assert provider.get_quotes(['AAPL', 'HD']) == {'AAPL': 43217, 'HD': None}
+
+
+# ------------------------------------------
+# Batched and concurrent quote fetching
+# (against a local stand-in for the quote API)
+# ------------------------------------------
+
+class QuoteRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        symbols = parse_qs(urlparse(self.path).query)['symbols'][0].split(',')
+        self.server.requests.append(symbols)
+        time.sleep(self.server.delay)
+        body = json.dumps({symbol: self.server.prices.get(symbol) for symbol in symbols}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def quote_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), QuoteRequestHandler)
+    server.daemon_threads = True
+    server.prices = {f'SYM{index}': 10.0 + index for index in range(200)}
+    server.delay = 0.02
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_http_quote_provider_batches(quote_server):
+    """
+    GIVEN an HTTP quote provider with a batch size of 10
+    WHEN the quotes for 25 symbols (one of them unknown) are requested
+    THEN check 3 requests are made and every symbol gets a price or None
+    """
+    quote_server.requests.clear()
+    provider = HttpQuoteProvider(f'http://127.0.0.1:{quote_server.server_port}/quotes',
+                                 batch_size=10, max_workers=4)
+    symbols = [f'SYM{index}' for index in range(24)] + ['XYZ']
+    quotes = provider.get_quotes(symbols)
+    provider.close()
+
+    assert len(quote_server.requests) == 3
+    assert quotes['SYM0'] == 1000
+    assert quotes['SYM23'] == 3300
+    assert quotes['XYZ'] is None
+
+
+def test_http_quote_provider_concurrent_speedup(quote_server):
+    """
+    GIVEN an HTTP quote provider that is batched and concurrent, and one that is serial
+    WHEN the quotes for 100 symbols are requested from each
+    THEN check the batched, concurrent provider returns the same quotes at least 5x faster
+    """
+    url = f'http://127.0.0.1:{quote_server.server_port}/quotes'
+    symbols = [f'SYM{index}' for index in range(100)]
+
+    serial_provider = HttpQuoteProvider(url, batch_size=1, max_workers=1)
+    start = time.perf_counter()
+    serial_quotes = serial_provider.get_quotes(symbols)
+    serial_time = time.perf_counter() - start
+    serial_provider.close()
+
+    batched_provider = HttpQuoteProvider(url, batch_size=25, max_workers=4)
+    start = time.perf_counter()
+    batched_quotes = batched_provider.get_quotes(symbols)
+    batched_time = time.perf_counter() - start
+    batched_provider.close()
+
+    assert batched_quotes == serial_quotes
+    assert serial_time / batched_time > 5
+
+
+def test_quote_cache_coalesces_concurrent_requests(quote_server):
+    """
+    GIVEN a quote cache in front of an HTTP quote provider
+    WHEN 20 threads request the same symbol at the same time
+    THEN check that only one request is made to the quote API
+    """
+    quote_server.requests.clear()
+    quote_server.delay = 0.2
+    provider = HttpQuoteProvider(f'http://127.0.0.1:{quote_server.server_port}/quotes')
+    quote_cache = QuoteCache(provider)
+    barrier = threading.Barrier(20)
+    prices = []
+
+    def get_price():
+        barrier.wait()
+        prices.append(quote_cache.get_price('SYM1'))
+
+    try:
+        threads = [threading.Thread(target=get_price) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        quote_server.delay = 0.02
+        provider.close()
+
+    assert prices == [1100] * 20
+    assert quote_server.requests == [['SYM1']]
+    assert quote_cache.upstream_calls == 1
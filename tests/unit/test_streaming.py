@@ -0,0 +1,119 @@
+"""
+This file contains the unit tests for the streaming.py file
+"""
+import json
+
+from project.stocks.quotes import QuoteCache, QuoteProvider
+from project.stocks.streaming import QuotePublisher, stream_position_values
+from project.stocks.valuation import Positions
+
+
+class FakeQuoteFeed(QuoteProvider):
+    """
+    Local quote feed whose prices (in cents) are changed by the tests
+    """
+
+    def __init__(self, prices):
+        self.prices = dict(prices)
+        self.batches = []
+
+    def get_quote(self, symbol):
+        return self.prices.get(symbol)
+
+    def get_quotes(self, symbols):
+        self.batches.append(sorted(symbols))
+        return super().get_quotes(symbols)
+
+
+def create_publisher(prices):
+    feed = FakeQuoteFeed(prices)
+    # Quotes are never cached, so every poll reaches the feed
+    return feed, QuotePublisher(QuoteCache(feed, ttl=0, negative_ttl=0), interval=60)
+
+
+def test_publisher_polls_once_for_every_subscription():
+    """
+    GIVEN a quote publisher with many subscriptions to overlapping symbols
+    WHEN the quotes are polled
+    THEN check the feed is asked once for the union of the symbols, and each subscription gets its own symbols
+    """
+    feed, publisher = create_publisher({'AAPL': 17250, 'HD': 31650, 'DIS': 9500})
+    subscriptions = [publisher.subscribe(['AAPL', 'hd']) for _ in range(1000)]
+    other = publisher.subscribe(['DIS'])
+
+    assert publisher.poll() == {'AAPL': 17250, 'HD': 31650, 'DIS': 9500}
+    assert feed.batches == [['AAPL', 'DIS', 'HD']]
+    assert publisher.subscriber_count == 1001
+    assert all(subscription.wait(0) == {'AAPL': 17250, 'HD': 31650} for subscription in subscriptions)
+    assert other.wait(0) == {'DIS': 9500}
+
+
+def test_publisher_publishes_only_changes():
+    """
+    GIVEN a quote publisher with a subscription that was sent the current prices
+    WHEN the quotes are polled again, before and after a price changes
+    THEN check the subscription only gets the changed price, and a later subscription gets the last prices
+    """
+    feed, publisher = create_publisher({'AAPL': 17250, 'HD': 31650})
+    subscription = publisher.subscribe(['AAPL', 'HD'])
+    publisher.poll()
+    subscription.wait(0)
+
+    assert publisher.poll() == {}
+    assert subscription.wait(0) == {}
+
+    feed.prices['HD'] = 32000
+    publisher.poll()
+    feed.prices['HD'] = 32100
+    publisher.poll()
+    # The changes are coalesced: only the latest price is kept
+    assert subscription.wait(0) == {'HD': 32100}
+    assert publisher.subscribe(['HD']).wait(0) == {'HD': 32100}
+
+
+def test_publisher_unsubscribe():
+    """
+    GIVEN a quote publisher with two subscriptions
+    WHEN one of them is unsubscribed
+    THEN check its symbols are no longer polled
+    """
+    feed, publisher = create_publisher({'AAPL': 17250, 'HD': 31650})
+    apple = publisher.subscribe(['AAPL'])
+    publisher.subscribe(['HD'])
+    publisher.unsubscribe(apple)
+
+    publisher.poll()
+    assert feed.batches == [['HD']]
+    assert publisher.subscriber_count == 1
+
+
+def test_stream_position_values():
+    """
+    GIVEN positions of a portfolio and a quote publisher
+    WHEN the events of the stream are generated as the prices change
+    THEN check each event has the changed positions and the totals of the portfolio (in dollars)
+    """
+    feed, publisher = create_publisher({'AAPL': 20000, 'HD': 30000})
+    positions = Positions(symbols=['AAPL', 'HD'], number_of_shares=[10, 2], purchase_price=[15000, 30000])
+    stream = stream_position_values(publisher, positions, keepalive=0.01)
+    assert next(stream) == 'retry: 10\n\n'
+    # No prices yet
+    assert next(stream) == ': keep-alive\n\n'
+
+    publisher.poll()
+    event, data = next(stream).split('\n', 1)
+    assert event == 'event: quotes'
+    assert json.loads(data[len('data: '):]) == {
+        'quotes': {'AAPL': {'price': 200.0, 'market_value': 2000.0, 'gain': 500.0},
+                   'HD': {'price': 300.0, 'market_value': 600.0, 'gain': 0.0}},
+        'portfolio': {'market_value': 2600.0, 'gain': 500.0}}
+
+    feed.prices['AAPL'] = 14000
+    publisher.poll()
+    data = json.loads(next(stream).split('data: ', 1)[1])
+    assert data == {'quotes': {'AAPL': {'price': 140.0, 'market_value': 1400.0, 'gain': -100.0}},
+                    'portfolio': {'market_value': 2000.0, 'gain': -100.0}}
+
+    # Closing the stream (the client disconnected) ends the subscription
+    stream.close()
+    assert publisher.subscriber_count == 0
@@ -0,0 +1,66 @@
+"""
+This file contains the unit tests for the valuation.py file
+"""
+from project.stocks.valuation import Positions, value_positions
+
+
+def test_value_positions_nominal():
+    """
+    GIVEN positions in two stocks and a market price for each symbol
+    WHEN the positions are valued
+    THEN check the per-position and total cost basis, market value, gain and weight
+    """
+    positions = Positions(symbols=['AAPL', 'HD', 'AAPL'],
+                          number_of_shares=[10, 5, 20],
+                          purchase_price=[10000, 20000, 15000])
+    valuation = value_positions(positions, {'AAPL': 12000, 'HD': 18000})
+
+    assert list(valuation.cost_basis) == [100000, 100000, 300000]
+    assert list(valuation.market_value) == [120000, 90000, 240000]
+    assert list(valuation.gain) == [20000, -10000, -60000]
+    assert valuation.gain_percent[0] == 20.0
+    assert valuation.total_cost_basis == 500000
+    assert valuation.total_market_value == 450000
+    assert valuation.total_gain == -50000
+    assert valuation.total_gain_percent == -10.0
+    assert round(float(valuation.weight.sum()), 6) == 100.0
+
+
+def test_value_positions_missing_price():
+    """
+    GIVEN positions where one symbol has no market price
+    WHEN the positions are valued
+    THEN check the unpriced position is valued at its purchase price
+    """
+    positions = Positions(symbols=['AAPL', 'XYZ'],
+                          number_of_shares=[10, 3],
+                          purchase_price=[10000, 2500])
+    valuation = value_positions(positions, {'AAPL': 11000})
+
+    assert list(valuation.priced) == [True, False]
+    assert list(valuation.market_value) == [110000, 7500]
+    assert valuation.gain[1] == 0
+
+
+def test_value_positions_empty():
+    """
+    GIVEN no positions
+    WHEN the positions are valued
+    THEN check the totals are zero
+    """
+    valuation = value_positions(Positions([], [], []), {'AAPL': 11000})
+    assert len(valuation) == 0
+    assert valuation.total_market_value == 0
+    assert valuation.total_gain_percent == 0.0
+
+
+def test_value_positions_with_aggregated_cost_basis():
+    """
+    GIVEN an aggregated position whose cost basis is not a multiple of its shares
+    WHEN the position is valued without a market price
+    THEN check the market value equals the exact cost basis
+    """
+    positions = Positions(symbols=['HD'], number_of_shares=[3], purchase_price=[3333], cost_basis=[10000])
+    valuation = value_positions(positions, {})
+    assert valuation.total_market_value == 10000
+    assert valuation.total_gain == 0